@@ -0,0 +1,122 @@
+"""
+Load-test client LLM với stub server (không gọi API thật, chạy từ thư mục app/):
+    python benchmarks/llm_stub_server.py --port 8089 &
+    python benchmarks/llm_client_benchmark.py --requests 500 --concurrency 50 --stream
+
+- shared:      ClaudeLLMService dùng connection pool httpx dùng chung (utils.httpClient)
+- per_request: tạo client Anthropic mới cho mỗi request (mỗi request một connection mới)
+In ra latency p50/p95/p99, throughput và số connection TCP mà stub đã nhận cho mỗi mode.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+CONTEXT = "Sản phẩm A có giá 100.000đ, bảo hành 12 tháng. " * 40
+
+
+def stub_stats(base_url: str, reset: bool = False) -> dict:
+    request = urllib.request.Request(f"{base_url}/stats", method="POST" if reset else "GET")
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def run_shared(question: str, stream: bool, service) -> None:
+    if stream:
+        async for _ in service.astream_chat(CONTEXT, [], question):
+            pass
+    else:
+        await service.achat(CONTEXT, [], question)
+
+
+async def run_per_request(question: str, stream: bool, base_url: str) -> None:
+    import anthropic
+    client = anthropic.AsyncAnthropic(api_key="stub", base_url=base_url)
+    try:
+        params = {
+            "model": "claude-sonnet-4-20250514",
+            "max_tokens": 2000,
+            "system": CONTEXT,
+            "messages": [{"role": "user", "content": question}],
+        }
+        if stream:
+            async with client.messages.stream(**params) as events:
+                async for _ in events:
+                    pass
+        else:
+            await client.messages.create(**params)
+    finally:
+        await client.close()
+
+
+async def benchmark(mode: str, args) -> None:
+    service = None
+    if mode == "shared":
+        from infrastructure.LLM.ClaudeService import ClaudeLLMService
+        service = ClaudeLLMService()
+
+    stub_stats(args.base_url, reset=True)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def one(i: int):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if mode == "shared":
+                    await run_shared(f"Câu hỏi {i}", args.stream, service)
+                else:
+                    await run_per_request(f"Câu hỏi {i}", args.stream, args.base_url)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                failures += 1
+                if failures <= 3:
+                    print(f"❌ {mode}: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    stats = stub_stats(args.base_url)
+
+    if latencies:
+        print(f"{mode:<12} p50={percentile(latencies, 0.5):.3f}s  p95={percentile(latencies, 0.95):.3f}s  "
+              f"p99={percentile(latencies, 0.99):.3f}s  mean={statistics.mean(latencies):.3f}s  "
+              f"{len(latencies) / elapsed:.1f} req/s")
+    print(f"{'':<12} ok={len(latencies)} failed={failures}  connections={stats['connections']}  "
+          f"stub requests={stats['requests']} (lỗi giả lập {stats['errors']})")
+
+    if mode == "shared":
+        from utils.httpClient import close_http_clients
+        await close_http_clients()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8089")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--modes", default="shared,per_request")
+    args = parser.parse_args()
+
+    os.environ["ANTHROPIC_BASE_URL"] = args.base_url
+    os.environ.setdefault("ANTHROPIC_API_KEY", "stub")
+    for mode in args.modes.split(","):
+        await benchmark(mode.strip(), args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
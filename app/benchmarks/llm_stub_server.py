@@ -0,0 +1,145 @@
+"""
+Stub server giả lập Anthropic Messages API (POST /v1/messages, JSON hoặc SSE khi "stream": true)
+để load-test connection pool / retry mà không gọi API thật (chạy từ thư mục app/):
+    python benchmarks/llm_stub_server.py --port 8089 --latency 0.3 --error-rate 0.05
+
+- latency:    thời gian chờ trước khi trả lời (giây), stream chia đều cho các token
+- error-rate: tỉ lệ request trả 529 overloaded (kèm retry-after) để thử retry
+- GET /stats: số connection TCP đã mở, số request, số lỗi đã trả (POST /stats/reset để reset)
+Chỉ dùng thư viện chuẩn, HTTP/1.1 keep-alive.
+"""
+import argparse
+import asyncio
+import json
+import random
+import uuid
+
+STATS = {"connections": 0, "open_connections": 0, "requests": 0, "errors": 0, "streams": 0}
+
+
+def http_response(status: str, body: bytes, content_type: str = "application/json", headers: dict = None) -> bytes:
+    lines = [f"HTTP/1.1 {status}", f"Content-Type: {content_type}", f"Content-Length: {len(body)}",
+             "Connection: keep-alive"]
+    lines += [f"{key}: {value}" for key, value in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+
+def message_body(model: str, text: str, input_tokens: int, output_tokens: int) -> dict:
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                  "cache_creation_input_tokens": 0, "cache_read_input_tokens": input_tokens // 2},
+    }
+
+
+def sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+async def write_stream(writer: asyncio.StreamWriter, model: str, tokens: list, latency: float, input_tokens: int):
+    """Trả lời SSE theo chunked encoding như API thật"""
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                 b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n")
+
+    async def send(payload: bytes):
+        writer.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        await writer.drain()
+
+    message = message_body(model, "", input_tokens, 0)
+    message["content"] = []
+    await send(sse("message_start", {"type": "message_start", "message": message}))
+    await send(sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                           "content_block": {"type": "text", "text": ""}}))
+    for token in tokens:
+        await asyncio.sleep(latency / max(1, len(tokens)))
+        await send(sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                               "delta": {"type": "text_delta", "text": token}}))
+    await send(sse("content_block_stop", {"type": "content_block_stop", "index": 0}))
+    await send(sse("message_delta", {"type": "message_delta",
+                                     "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                     "usage": {"output_tokens": len(tokens)}}))
+    await send(sse("message_stop", {"type": "message_stop"}))
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, args):
+    STATS["connections"] += 1
+    STATS["open_connections"] += 1
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode().split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode().partition(":")
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", "0")))
+
+            if path.startswith("/stats"):
+                if method == "POST":
+                    for key in STATS:
+                        STATS[key] = STATS["open_connections"] if key == "open_connections" else 0
+                writer.write(http_response("200 OK", json.dumps(STATS).encode()))
+                await writer.drain()
+                continue
+
+            STATS["requests"] += 1
+            if random.random() < args.error_rate:
+                STATS["errors"] += 1
+                error = {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded (stub)"}}
+                writer.write(http_response("529 Overloaded", json.dumps(error).encode(), headers={"retry-after": "0"}))
+                await writer.drain()
+                continue
+
+            payload = json.loads(body or b"{}")
+            model = payload.get("model", "stub")
+            input_tokens = max(1, len(body) // 4)
+            tokens = [f"token{i} " for i in range(args.tokens)]
+            if payload.get("stream"):
+                STATS["streams"] += 1
+                await write_stream(writer, model, tokens, args.latency, input_tokens)
+            else:
+                await asyncio.sleep(args.latency)
+                response = message_body(model, "".join(tokens), input_tokens, len(tokens))
+                writer.write(http_response("200 OK", json.dumps(response).encode()))
+                await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        STATS["open_connections"] -= 1
+        writer.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = await asyncio.start_server(lambda r, w: handle_connection(r, w, args), args.host, args.port)
+    print(f"🧪 Stub Anthropic API tại http://{args.host}:{args.port} (latency {args.latency}s, "
+          f"{args.tokens} tokens, error rate {args.error_rate})")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
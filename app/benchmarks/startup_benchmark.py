@@ -0,0 +1,114 @@
+"""
+Đo thời gian khởi động app (chạy từ thư mục app/):
+    python benchmarks/startup_benchmark.py --runs 3
+
+- import_s: thời gian `import main` (không được load model / FAISS)
+- live_s:   từ lúc spawn uvicorn tới khi /health/live trả 200 (port đã bind)
+- ready_s:  từ lúc spawn uvicorn tới khi /health/ready trả 200 (model + vector store đã load)
+- rss_mb:   RSS của process uvicorn khi đã ready, tách anon (riêng của worker) và file (page cache
+            dùng chung, gồm index FAISS mmap). So sánh: chạy thêm với --mmap (FAISS_MMAP=true)
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import() -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=APP_DIR, text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+def wait_for(url: str, start: float, timeout: float, process: subprocess.Popen) -> float:
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn đã thoát (code {process.returncode})")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"Quá {timeout}s mà {url} chưa sẵn sàng")
+
+
+def read_rss(pid: int) -> dict:
+    """VmRSS / RssAnon / RssFile (MB) từ /proc/<pid>/status, rỗng nếu không phải Linux"""
+    rss = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile"):
+                    rss[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return rss
+
+
+def measure_server(port: int, timeout: float, mmap: bool) -> tuple:
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, FAISS_MMAP="true" if mmap else "false")
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR,
+        stdout=subprocess.DEVNULL,
+        env=env,
+    )
+    try:
+        live = wait_for(f"{base_url}/health/live", start, timeout, process)
+        ready = wait_for(f"{base_url}/health/ready", start, timeout, process)
+        return live, ready, read_rss(process.pid)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def summarize(name: str, values: list, unit: str = "s"):
+    if not values:
+        return
+    print(f"{name:<10} min={min(values):.3f}{unit}  median={statistics.median(values):.3f}{unit}  "
+          f"max={max(values):.3f}{unit}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark thời gian khởi động app")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--mmap", action="store_true", help="Chạy server với FAISS_MMAP=true")
+    args = parser.parse_args()
+
+    imports, lives, readies, rss, anon = [], [], [], [], []
+    for run in range(1, args.runs + 1):
+        imports.append(measure_import())
+        live, ready, memory = measure_server(args.port, args.timeout, args.mmap)
+        lives.append(live)
+        readies.append(ready)
+        line = f"Run {run}: import={imports[-1]:.3f}s live={live:.3f}s ready={ready:.3f}s"
+        if memory:
+            rss.append(memory.get("VmRSS", 0.0))
+            anon.append(memory.get("RssAnon", 0.0))
+            line += (f" rss={rss[-1]:.1f}MB (anon={anon[-1]:.1f}MB, "
+                     f"file={memory.get('RssFile', 0.0):.1f}MB)")
+        print(line)
+
+    print()
+    summarize("import_s", imports)
+    summarize("live_s", lives)
+    summarize("ready_s", readies)
+    summarize("rss_mb", rss, "MB")
+    summarize("anon_mb", anon, "MB")
+
+
+if __name__ == "__main__":
+    main()
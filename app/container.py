@@ -0,0 +1,182 @@
+import asyncio
+import os
+import time
+from typing import Optional
+from dotenv import load_dotenv
+from infrastructure.db.Mongo import get_conversation_collection
+from infrastructure.LLM.ClaudeService import ClaudeLLMService
+from infrastructure.LLM.SemanticResponseCache import SEMANTIC_CACHE_ENABLED, SemanticResponseCache
+from infrastructure.VectorDB.Qwen3Faiss import Qwen3Faiss
+from infrastructure.jobs.IngestWorkerPool import IngestWorkerPool
+from infrastructure.repository.ChatHistoryStore import ChatHistoryStore
+from infrastructure.repository.ConversationRepositoryMongo import ConversationRepositoryMongo
+from infrastructure.repository.IngestJobRepository import IngestJobRepository
+from utils.executor import run_blocking, shutdown_executor, shutdown_process_pool
+from utils.httpClient import close_http_clients, http_client_info
+
+load_dotenv()
+
+# Load model + FAISS ngay khi app start (background), tắt đi để load lazy ở request đầu tiên
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+# Mỗi user một namespace vector (upload + search tách biệt). Mặc định tắt: mọi upload vào kho dùng chung
+# (namespace None) như trước; khi bật thì không còn đường nào để /embed ghi vào kho dùng chung
+VECTOR_NAMESPACE_PER_USER = os.getenv("VECTOR_NAMESPACE_PER_USER", "false").lower() == "true"
+
+
+class ServiceContainer:
+    """
+    Giữ các service nặng (LLM client, Qwen3 + FAISS) dùng chung cho cả process.
+    Không có gì được load lúc import: vector service được tạo một lần trong executor,
+    các request đến trong lúc đang load sẽ chờ chung một task thay vì load lại.
+    """
+
+    def __init__(self):
+        self.llm_service: Optional[ClaudeLLMService] = None
+        self.vector_service: Optional[Qwen3Faiss] = None
+        self.vector_task: Optional[asyncio.Task] = None
+        self.status = "idle"  # idle -> loading -> ready / failed
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.timings: dict = {}
+        self.ingest_pool: Optional[IngestWorkerPool] = None
+        self.chat_history: Optional[ChatHistoryStore] = None
+        self.response_cache: Optional[SemanticResponseCache] = None
+
+    def get_llm_service(self) -> ClaudeLLMService:
+        if self.llm_service is None:
+            self.llm_service = ClaudeLLMService()
+        return self.llm_service
+
+    async def get_chat_history_store(self) -> ChatHistoryStore:
+        """History chat (MongoDB) + LRU các conversation đang hoạt động của worker này"""
+        if self.chat_history is None:
+            collection = await get_conversation_collection()
+            self.chat_history = ChatHistoryStore(ConversationRepositoryMongo(collection))
+        return self.chat_history
+
+    async def get_response_cache(self) -> Optional[SemanticResponseCache]:
+        """Semantic cache câu trả lời (SEMANTIC_CACHE_ENABLED), embedding câu hỏi bằng model Qwen3"""
+        if not SEMANTIC_CACHE_ENABLED:
+            return None
+        if self.response_cache is None:
+            vector_service = await self.get_vector_service()
+            self.response_cache = SemanticResponseCache(vector_service.embed_query)
+        return self.response_cache
+
+    def get_ingest_pool(self) -> IngestWorkerPool:
+        """Hàng đợi job ingest (SQLite) + worker, file upload được spool trong PERSIST_PATH"""
+        if self.ingest_pool is None:
+            persist_path = os.getenv("PERSIST_PATH")
+            jobs = IngestJobRepository(
+                os.getenv("INGEST_JOB_DB", os.path.join(persist_path, "ingest_jobs.sqlite")),
+                stale_after=float(os.getenv("INGEST_JOB_STALE_SECONDS", "900")),
+                max_attempts=int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", "3")),
+            )
+            self.ingest_pool = IngestWorkerPool(
+                jobs,
+                self.get_vector_service,
+                spool_dir=os.getenv("INGEST_SPOOL_DIR", os.path.join(persist_path, "ingest_spool")),
+            )
+        return self.ingest_pool
+
+    async def get_vector_service(self) -> Qwen3Faiss:
+        if self.vector_service is not None:
+            return self.vector_service
+        task = self.vector_task
+        if task is None or (task.done() and (task.cancelled() or task.exception())):
+            self.vector_task = asyncio.create_task(self._load_vector_service())
+        return await asyncio.shield(self.vector_task)
+
+    async def _load_vector_service(self) -> Qwen3Faiss:
+        self.status = "loading"
+        self.error = None
+        start_time = time.time()
+        try:
+            service = await run_blocking(Qwen3Faiss)
+            self.timings["vector_service_load_s"] = round(time.time() - start_time, 3)
+
+            # Embed thử một câu để model/kernel được khởi tạo trước request thật
+            warmup_start = time.time()
+            await run_blocking(service.embeddings.embed_query, "warmup")
+            self.timings["warmup_query_s"] = round(time.time() - warmup_start, 3)
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"❌ Lỗi khi load vector service: {e}")
+            raise
+
+        self.vector_service = service
+        self.status = "ready"
+        self.timings["ready_after_start_s"] = round(time.time() - self.started_at, 3)
+        print(f"✅ Vector service sẵn sàng sau {self.timings['vector_service_load_s']:.2f}s")
+        return service
+
+    def start_warmup(self):
+        """Bắt đầu load vector service ở background, không chặn việc bind port"""
+        if self.vector_task is None:
+            self.vector_task = asyncio.create_task(self._load_vector_service())
+            # Lỗi đã được ghi vào status, tránh cảnh báo "exception was never retrieved"
+            self.vector_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def info(self) -> dict:
+        info = {
+            "status": self.status,
+            "uptime_s": round(time.time() - self.started_at, 3),
+            "timings": self.timings,
+        }
+        if self.error:
+            info["error"] = self.error
+        if self.chat_history is not None:
+            info["chat_history_cache"] = self.chat_history.stats()
+        if self.response_cache is not None:
+            info["response_cache"] = self.response_cache.stats()
+        if self.llm_service is not None:
+            info["llm_usage"] = self.llm_service.usage_stats()
+        info["http_client"] = http_client_info()
+        if self.vector_service is not None:
+            # Probe gọi liên tục trên event loop: thống kê chunk (COUNT SQLite) xem ở /embed/stats
+            info["vectorstore"] = self.vector_service.readiness_info()
+        return info
+
+    async def shutdown(self):
+        if self.ingest_pool is not None:
+            await self.ingest_pool.stop()
+        if self.vector_task is not None and not self.vector_task.done():
+            self.vector_task.cancel()
+        if self.vector_service is not None:
+            await run_blocking(self.vector_service.flush)
+        await close_http_clients()
+        shutdown_executor(wait=True)
+        shutdown_process_pool(wait=True)
+
+
+container = ServiceContainer()
+
+
+def get_llm_service() -> ClaudeLLMService:
+    return container.get_llm_service()
+
+
+async def get_vector_service() -> Qwen3Faiss:
+    return await container.get_vector_service()
+
+
+async def get_chat_history_store() -> ChatHistoryStore:
+    return await container.get_chat_history_store()
+
+
+async def get_response_cache() -> Optional[SemanticResponseCache]:
+    return await container.get_response_cache()
+
+
+def get_ingest_pool() -> IngestWorkerPool:
+    return container.get_ingest_pool()
+
+
+def namespace_for(user_id: Optional[str]) -> Optional[str]:
+    """Namespace vector của user (None = dữ liệu dùng chung)"""
+    return user_id if VECTOR_NAMESPACE_PER_USER and user_id else None
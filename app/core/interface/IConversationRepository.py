@@ -36,4 +36,14 @@ class IConversationRepository(ABC):
     @abstractmethod
     async def get_messages(self, conversation_id: str, user_id: str, limit: int = 50) -> List[Message]:
         """Lấy messages của conversation (chỉ owner mới được xem)"""
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    async def add_messages(self, conversation_id: str, messages: List[Message]) -> bool:
+        """Thêm nhiều message vào conversation trong một lần ghi"""
+        pass
+
+    @abstractmethod
+    async def get_message_count(self, conversation_id: str, user_id: str) -> Optional[int]:
+        """Số message của conversation (None nếu không tồn tại hoặc không phải owner)"""
+        pass
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional
 from langchain_core.documents import Document
 from fastapi import UploadFile
 
@@ -23,3 +23,8 @@ class IFileRepository(ABC):
     @abstractmethod
     def extract_file(self, documents: list[UploadFile]) -> List[Document]:
         pass
+
+    @abstractmethod
+    def iter_extract_file(self, documents: list[UploadFile], batch_size: int = 1000,
+                          report: Optional[List[Dict[str, Any]]] = None) -> Iterator[List[Document]]:
+        pass
@@ -0,0 +1,34 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+
+class IIngestJobRepository(ABC):
+    @abstractmethod
+    def enqueue(self, job_id: str, user_id: Optional[str], files: List[dict], namespace: Optional[str] = None) -> dict:
+        """Thêm job ingest mới (files: filename, path, size) ở trạng thái queued"""
+        pass
+
+    @abstractmethod
+    def fail_stale(self) -> List[str]:
+        """Đánh dấu failed các job running bị treo đã quá số lần thử, trả về job_id của chúng"""
+        pass
+
+    @abstractmethod
+    def claim_next(self) -> Optional[dict]:
+        """Lấy job queued lâu nhất và chuyển sang running (atomic giữa các worker/process)"""
+        pass
+
+    @abstractmethod
+    def update_progress(self, job_id: str, documents_done: int, files_done: int, bytes_done: int):
+        """Cập nhật tiến độ của job đang chạy"""
+        pass
+
+    @abstractmethod
+    def finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        """Kết thúc job (done / partial / failed)"""
+        pass
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[dict]:
+        """Lấy trạng thái + tiến độ của job"""
+        pass
@@ -1,8 +1,16 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import AsyncIterator, List
 from core.entity.Chat import Message
 
 class ILLMRepository(ABC):
     @abstractmethod
     def chat(self, context: str, history: List[Message], question: str) -> str:
+        pass
+
+    @abstractmethod
+    async def achat(self, context: str, history: List[Message], question: str) -> str:
+        pass
+
+    @abstractmethod
+    def astream_chat(self, context: str, history: List[Message], question: str) -> AsyncIterator[str]:
         pass
\ No newline at end of file
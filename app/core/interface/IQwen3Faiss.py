@@ -1,8 +1,11 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional
 from langchain_core.documents import Document
 
 class IQwen3Faiss(ABC):
+    # True khi process này không giữ quyền ghi vector store (chỉ search được)
+    read_only: bool = False
+
     @abstractmethod
     def save_vectorstore(self) -> bool:
         pass
@@ -16,9 +19,22 @@ class IQwen3Faiss(ABC):
         pass
     
     @abstractmethod
-    def add_documents_optimized(self, documents: List[Document], chunk_size: int) -> bool:
+    def add_documents_optimized(self, documents: List[Document], chunk_size: Optional[int] = None,
+                                ingest_id: Optional[str] = None, namespace: Optional[str] = None) -> bool:
+        pass
+
+    @abstractmethod
+    def remove_stale_chunks(self, sources: List[str], ingest_id: str, namespace: Optional[str] = None) -> int:
+        pass
+
+    @abstractmethod
+    def delete_source(self, source: str, namespace: Optional[str] = None) -> int:
+        pass
+
+    @abstractmethod
+    def list_sources(self, namespace: Optional[str] = None) -> List[dict]:
         pass
     
     @abstractmethod
-    def similarity_search(self, query: str, k: int) -> List[Document]:
+    def similarity_search(self, query: str, k: int, namespace: Optional[str] = None) -> List[Document]:
         pass
@@ -0,0 +1,23 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+class IResponseCache(ABC):
+    @abstractmethod
+    def applicable(self, question: str, history: list) -> bool:
+        """Có được dùng cache cho câu hỏi này ở lượt chat với history này không"""
+        pass
+
+    @abstractmethod
+    def key_for(self, context_docs: list) -> str:
+        """Key của tập context đã retrieve (list (doc, score))"""
+        pass
+
+    @abstractmethod
+    def lookup(self, question: str, namespace: Optional[str], key: str) -> Optional[str]:
+        """Câu trả lời đã cache cho câu hỏi tương tự với cùng namespace + context (key), hoặc None"""
+        pass
+
+    @abstractmethod
+    def store(self, question: str, namespace: Optional[str], key: str, answer: str):
+        pass
@@ -1,9 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional
 
 class IVectorDBRepository(ABC):
     @abstractmethod
-    def similarity_search(self, query: str, k: int = 5) -> list:
+    def similarity_search(self, query: str, k: int = 5, namespace: Optional[str] = None) -> list:
         pass
     
     @abstractmethod
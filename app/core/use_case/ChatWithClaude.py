@@ -1,18 +1,19 @@
-from typing import List
+from typing import List, Optional
 from core.entity.Chat import Message
 from core.interface.ILLMRepository import ILLMRepository
 from core.interface.IVectorDBRepository import IVectorDBRepository
 
 class ChatWithClaude:
-    def __init__(self, llm: ILLMRepository, vector_db: IVectorDBRepository):
+    def __init__(self, llm: ILLMRepository, vector_db: IVectorDBRepository, namespace: Optional[str] = None):
         self.llm = llm
         self.vector_db = vector_db
+        self.namespace = namespace
         self.last_query = ""
         self.last_context = ""
 
     def execute(self, question: str, history: List[Message]) -> str:
-        context_docs = self.vector_db.similarity_search(question, k=5)
-        context = "\n\n".join([doc.page_content for doc in context_docs])
+        context_docs = self.vector_db.similarity_search(question, k=5, namespace=self.namespace)
+        context = "\n\n".join([doc.page_content for doc, _ in context_docs])
 
         response = self.llm.chat(context=context, history=history, question=question)
 
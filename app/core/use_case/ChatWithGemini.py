@@ -1,15 +1,26 @@
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 from core.entity.Chat import Message
 from core.interface.ILLMRepository import ILLMRepository
 from core.interface.IVectorDBRepository import IVectorDBRepository
 from core.interface.IFileRepository import IFileRepository
+from core.interface.IResponseCache import IResponseCache
 from fastapi import UploadFile
+from utils.executor import run_blocking
 
 class ChatWithGemini:
-    def __init__(self, llm: ILLMRepository, vector_db: IVectorDBRepository, file_repo: IFileRepository):
+    def __init__(self, llm: ILLMRepository, vector_db: IVectorDBRepository, file_repo: IFileRepository,
+                 max_context_chars: Optional[int] = None, namespace: Optional[str] = None,
+                 response_cache: Optional[IResponseCache] = None):
         self.llm = llm
         self.vector_db = vector_db
         self.file_repo = file_repo
+        # Namespace (user/tenant) của vector DB được search, None = toàn bộ
+        self.namespace = namespace
+        # Giới hạn tổng số ký tự context gửi cho LLM (None = không giới hạn)
+        self.max_context_chars = max_context_chars
+        # Cache câu trả lời theo ngữ nghĩa (opt-in), key theo tập chunk đã retrieve cho câu hỏi
+        self.response_cache = response_cache
+        self.context_key: Optional[str] = None
         self.last_query = ""
         self.last_context = ""
 
@@ -17,23 +28,13 @@ class ChatWithGemini:
                 documents: Optional[List[UploadFile]] = None) -> str:
         
         # 1. Xử lý file nếu có
+        self.context_key = None
         file_context = ""
         if documents:
             try:
                 # Extract content từ các file
                 extracted_docs = self.file_repo.extract_file(documents)
-                
-                if extracted_docs:
-                    # Lưu documents vào vector database để có thể search sau này
-                    #self.vector_db.add_documents(extracted_docs)
-                    #print(f"✅ Đã xử lý và lưu {len(extracted_docs)} documents từ {len(documents)} files")
-                    
-                    # Tạo context từ file content cho câu hỏi hiện tại
-                    file_context = "\n\n".join([doc.page_content for doc in extracted_docs])
-                    print(f"✅ Đã tạo file context với {len(file_context)} ký tự")
-                else:
-                    print("⚠️ Không thể extract content từ files")
-                    
+                file_context = self.build_file_context(extracted_docs)
             except Exception as e:
                 print(f"❌ Lỗi khi xử lý files: {e}")
                 file_context = ""
@@ -41,12 +42,9 @@ class ChatWithGemini:
         # 2. Tìm kiếm context từ vector database (bao gồm cả documents cũ)
         vector_context = ""
         try:
-            context_docs = self.vector_db.similarity_search(question, k=5)
-            if context_docs:
-                vector_context = "\n\n".join([doc[0].page_content for doc in context_docs])
-                print(f"✅ Đã tạo vector context từ {len(context_docs)} documents")
-            else:
-                print("⚠️ Không tìm thấy documents phù hợp trong vector DB")
+            context_docs = self.vector_db.similarity_search(question, k=5, namespace=self.namespace)
+            vector_context = self.build_vector_context(context_docs, self.remaining_budget(file_context))
+            self.context_key = self.cache_key(context_docs, documents)
         except (IndexError, AttributeError) as e:
             print(f"❌ Lỗi khi xử lý vector context: {e}")
             vector_context = ""
@@ -54,18 +52,162 @@ class ChatWithGemini:
         # 3. Kết hợp context từ file mới và vector database
         combined_context = self.combine_contexts(file_context, vector_context)
         
-        # 4. Gửi request đến LLM
-        response = self.llm.chat(
-            context=combined_context, 
-            history=history, 
-            question=question
-        )
+        # 4. Gửi request đến LLM (trừ khi câu hỏi tương tự với cùng context đã có câu trả lời)
+        response = self.cached_answer(question, history)
+        if response is None:
+            response = self.llm.chat(
+                context=combined_context, 
+                history=history, 
+                question=question
+            )
+            self.store_answer(question, history, response)
 
         # 5. Lưu lại query và context cuối cùng
         self.last_query = question
         self.last_context = combined_context
         
         return response
+
+    async def execute_async(self, question: str, history: List[Message],
+                            documents: Optional[List[UploadFile]] = None) -> str:
+        """
+        Phiên bản async của execute: các bước CPU-bound (parse file, embedding query,
+        FAISS search) chạy trong executor giới hạn, LLM được gọi qua achat
+        nên event loop không bị chặn trong lúc chờ model trả lời.
+        """
+        combined_context = await self.prepare_context_async(question, documents)
+
+        # Gửi request đến LLM (non-blocking), trừ khi đã có câu trả lời trong cache
+        response = await run_blocking(self.cached_answer, question, history) if self.context_key else None
+        if response is None:
+            response = await self.llm.achat(
+                context=combined_context,
+                history=history,
+                question=question
+            )
+            if self.context_key:
+                await run_blocking(self.store_answer, question, history, response)
+
+        self.last_query = question
+        self.last_context = combined_context
+
+        return response
+
+    async def stream_async(self, question: str, history: List[Message],
+                           combined_context: str) -> AsyncIterator[str]:
+        """
+        Stream câu trả lời từng token. Context phải được chuẩn bị trước bằng
+        prepare_context_async (khi file upload vẫn còn mở trong request).
+        """
+        cached = await run_blocking(self.cached_answer, question, history) if self.context_key else None
+        if cached is not None:
+            yield cached
+        else:
+            chunks = []
+            async for token in self.llm.astream_chat(
+                context=combined_context,
+                history=history,
+                question=question
+            ):
+                chunks.append(token)
+                yield token
+            if self.context_key:
+                await run_blocking(self.store_answer, question, history, "".join(chunks))
+
+        self.last_query = question
+        self.last_context = combined_context
+
+    async def prepare_context_async(self, question: str,
+                                    documents: Optional[List[UploadFile]] = None) -> str:
+        """Extract file + tìm kiếm vector DB trong executor, trả về combined context"""
+        # 1. Xử lý file nếu có
+        self.context_key = None
+        file_context = ""
+        if documents:
+            try:
+                extracted_docs = await run_blocking(self.file_repo.extract_file, documents)
+                file_context = self.build_file_context(extracted_docs)
+            except Exception as e:
+                print(f"❌ Lỗi khi xử lý files: {e}")
+                file_context = ""
+
+        # 2. Tìm kiếm context từ vector database
+        vector_context = ""
+        try:
+            context_docs = await run_blocking(self.vector_db.similarity_search, question, k=5,
+                                              namespace=self.namespace)
+            vector_context = self.build_vector_context(context_docs, self.remaining_budget(file_context))
+            self.context_key = self.cache_key(context_docs, documents)
+        except (IndexError, AttributeError) as e:
+            print(f"❌ Lỗi khi xử lý vector context: {e}")
+            vector_context = ""
+
+        # 3. Kết hợp context
+        return self.combine_contexts(file_context, vector_context)
+
+    def cache_key(self, context_docs, documents) -> Optional[str]:
+        # Context có file upload thì không cache (câu trả lời phụ thuộc file)
+        if self.response_cache is None or documents:
+            return None
+        return self.response_cache.key_for(context_docs)
+
+    def cached_answer(self, question: str, history: List[Message]) -> Optional[str]:
+        if self.response_cache is None or self.context_key is None or not self.response_cache.applicable(question, history):
+            return None
+        try:
+            return self.response_cache.lookup(question, self.namespace, self.context_key)
+        except Exception as e:
+            print(f"❌ Lỗi khi đọc semantic cache: {e}")
+            return None
+
+    def store_answer(self, question: str, history: List[Message], answer: str):
+        if self.response_cache is None or self.context_key is None or not self.response_cache.applicable(question, history):
+            return
+        try:
+            self.response_cache.store(question, self.namespace, self.context_key, answer)
+        except Exception as e:
+            print(f"❌ Lỗi khi ghi semantic cache: {e}")
+
+    def build_file_context(self, extracted_docs) -> str:
+        """Tạo context từ nội dung các file vừa upload"""
+        if not extracted_docs:
+            print("⚠️ Không thể extract content từ files")
+            return ""
+
+        file_context = "\n\n".join([doc.page_content for doc in extracted_docs])
+        print(f"✅ Đã tạo file context với {len(file_context)} ký tự")
+        return file_context
+
+    def remaining_budget(self, file_context: str) -> Optional[int]:
+        """Số ký tự còn lại cho vector context sau khi đã dùng cho file context"""
+        if self.max_context_chars is None:
+            return None
+        return max(0, self.max_context_chars - len(file_context))
+
+    def build_vector_context(self, context_docs, max_chars: Optional[int] = None) -> str:
+        """
+        Tạo context từ kết quả similarity search (list các tuple (doc, score), score giảm dần).
+        Lấy lần lượt các chunk liên quan nhất cho tới khi hết max_chars; chunk đầu tiên
+        dài hơn budget sẽ bị cắt thay vì bỏ hẳn.
+        """
+        if not context_docs:
+            print("⚠️ Không tìm thấy documents phù hợp trong vector DB")
+            return ""
+
+        parts = []
+        used = 0
+        for doc, _ in context_docs:
+            content = doc.page_content
+            if max_chars is not None and used + len(content) > max_chars:
+                if not parts and max_chars > 0:
+                    parts.append(content[:max_chars])
+                break
+            parts.append(content)
+            used += len(content)
+
+        vector_context = "\n\n".join(parts)
+        print(f"✅ Đã tạo vector context từ {len(parts)}/{len(context_docs)} documents ({len(vector_context)} ký tự)")
+        return vector_context
     
     def combine_contexts(self, file_context: str, vector_context: str) -> str:
         """
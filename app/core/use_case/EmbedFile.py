@@ -1,19 +1,60 @@
+import uuid
+from typing import Callable, Optional
 from langchain_core.documents import Document
 from fastapi import UploadFile
 from core.interface.IQwen3Faiss import IQwen3Faiss
 from core.interface.IFileRepository import IFileRepository
 
 class EmbedFilesUseCase:
-    def __init__(self, file_repo: IFileRepository, embedder: IQwen3Faiss):
+    def __init__(self, file_repo: IFileRepository, embedder: IQwen3Faiss, batch_size: int = 1000,
+                 namespace: Optional[str] = None):
         """
         embedder: EmbeddingRepository
         vector_db: VectorDBRepository
+        batch_size: số documents tối đa mỗi lần đưa vào embedding
+        namespace: user/tenant sở hữu các file (None = dữ liệu dùng chung)
         """
         self.file_repo = file_repo
         self.embedder = embedder
+        self.batch_size = batch_size
+        self.namespace = namespace
+        # Kết quả từng file của lần execute gần nhất (filename, documents, seconds, error)
+        self.file_reports = []
+        # Số chunk cũ đã xóa do file được upload lại với nội dung khác
+        self.removed_chunks = 0
+        # File có ít nhất một batch embed lỗi (chunk cũ của chúng được giữ nguyên)
+        self.failed_sources = []
 
-    def execute(self, files: list[UploadFile]) -> int:
-        documents = self.file_repo.extract_file(files)
-        self.embedder.add_documents_optimized(documents, chunk_size=512)
+    def execute(self, files: list[UploadFile], progress: Optional[Callable[[int, list], None]] = None) -> int:
+        """
+        progress(documents đã embed, file_reports) được gọi sau mỗi batch (job ingest chạy nền).
+        Trả về số documents embed thành công (batch lỗi không được tính).
+        """
+        # File được đọc theo batch và embed ngay, không giữ toàn bộ documents trong memory
+        total = 0
+        self.file_reports = []
+        self.removed_chunks = 0
+        self.failed_sources = []
+        ingest_id = uuid.uuid4().hex
+        failed_sources = set()
+        for documents in self.file_repo.iter_extract_file(files, batch_size=self.batch_size,
+                                                          report=self.file_reports):
+            if not self.embedder.add_documents_optimized(documents, ingest_id=ingest_id, namespace=self.namespace):
+                failed_sources.update(doc.metadata.get("source") for doc in documents)
+            else:
+                total += len(documents)
+            if progress:
+                progress(total, self.file_reports)
+        if progress:
+            progress(total, self.file_reports)
+
+        # Chỉ dọn chunk cũ của file đã parse + embed trọn vẹn, tránh mất dữ liệu khi lỗi giữa chừng
+        sources = [
+            report["filename"] for report in self.file_reports
+            if not report.get("error") and report["documents"] and report["filename"] not in failed_sources
+        ]
+        self.failed_sources = sorted(source for source in failed_sources if source)
+        if sources:
+            self.removed_chunks = self.embedder.remove_stale_chunks(sources, ingest_id, self.namespace)
 
-        return len(documents)
+        return total
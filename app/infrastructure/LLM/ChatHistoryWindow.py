@@ -0,0 +1,126 @@
+import os
+from typing import List, Tuple
+from dotenv import load_dotenv
+from langchain.prompts import ChatPromptTemplate
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, StrOutputParser
+from core.entity.Chat import Message
+from infrastructure.VectorDB.DocumentChunker import approximate_token_counter
+from utils.lruCache import LRUCache
+
+load_dotenv()
+
+# Ngân sách token cho phần history giữ nguyên văn trong prompt
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+# Số lượt (user + assistant) gần nhất giữ nguyên văn, các lượt cũ hơn được gộp vào tóm tắt
+CHAT_HISTORY_KEEP_TURNS = int(os.getenv("CHAT_HISTORY_KEEP_TURNS", "6"))
+# Chỉ tóm tắt lại khi đã dồn thêm ngần này lượt ngoài cửa sổ (không gọi LLM mỗi request)
+CHAT_HISTORY_SUMMARY_EVERY_TURNS = int(os.getenv("CHAT_HISTORY_SUMMARY_EVERY_TURNS", "4"))
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Bạn tóm tắt cuộc trò chuyện giữa người dùng và trợ lý AI để dùng làm ngữ cảnh cho các lượt sau.
+        Giữ lại: yêu cầu và mục tiêu của người dùng, các dữ kiện, tên riêng, số liệu, quyết định và kết luận đã thống nhất.
+        Bỏ qua lời chào và các câu trả lời lặp lại. Viết ngắn gọn (tối đa khoảng 200 từ), cùng ngôn ngữ với cuộc trò chuyện."""),
+    ("human", """Tóm tắt trước đó:
+{summary}
+
+Các lượt trò chuyện tiếp theo:
+{transcript}
+
+Viết lại bản tóm tắt đầy đủ, đã cập nhật các lượt trên.""")
+])
+
+
+class ChatHistoryWindow:
+    """
+    Chuẩn bị history cho prompt: giữ nguyên văn các lượt gần nhất (tối đa keep_turns lượt
+    và token_budget token), các lượt cũ hơn được gộp vào một bản tóm tắt chạy dần.
+
+    Bản tóm tắt được cache theo id của message cuối cùng đã được tóm tắt, nên lượt sau chỉ
+    cần tìm message đó trong history là dùng lại được. Có độ trễ (hysteresis) để không gọi LLM
+    mỗi lượt: khi gộp, cửa sổ được cắt xuống còn token_budget // 2 token; chỉ gộp lại khi phần
+    nằm ngoài cửa sổ đã dồn đủ summary_every_turns lượt hoặc cửa sổ vượt token_budget.
+    """
+
+    def __init__(self, llm, token_budget: int = CHAT_HISTORY_TOKEN_BUDGET,
+                 keep_turns: int = CHAT_HISTORY_KEEP_TURNS,
+                 summary_every_turns: int = CHAT_HISTORY_SUMMARY_EVERY_TURNS):
+        self.token_budget = max(0, token_budget)
+        # Sau mỗi lần gộp cửa sổ chỉ giữ tới mức này, chừa token_budget - trim_budget cho các lượt mới
+        self.trim_budget = self.token_budget // 2
+        self.keep_messages = max(0, keep_turns) * 2
+        self.fold_messages = max(1, summary_every_turns) * 2
+        self.count_tokens = approximate_token_counter
+        self.summary_chain = SUMMARY_PROMPT | llm | StrOutputParser()
+        self.summaries = LRUCache(
+            max_entries=int(os.getenv("CHAT_SUMMARY_CACHE_ENTRIES", "4096")),
+            max_bytes=int(os.getenv("CHAT_SUMMARY_CACHE_BYTES", str(16 * 1024 * 1024))),
+            sizeof=lambda summary: len(summary.encode("utf-8")) + 64,
+        )
+
+    def prepare(self, history: List[Message]) -> Tuple[str, List[BaseMessage]]:
+        """Trả về (bản tóm tắt, các message giữ nguyên văn đã gắn role) cho prompt"""
+        summary, fold, window = self._plan(history)
+        if fold:
+            try:
+                summary = self._store(fold, self.summary_chain.invoke(self._summary_input(summary, fold)))
+            except Exception as e:
+                print(f"❌ Lỗi khi tóm tắt history: {e}")
+        return summary, self.to_chat_messages(window)
+
+    async def aprepare(self, history: List[Message]) -> Tuple[str, List[BaseMessage]]:
+        summary, fold, window = self._plan(history)
+        if fold:
+            try:
+                summary = self._store(fold, await self.summary_chain.ainvoke(self._summary_input(summary, fold)))
+            except Exception as e:
+                print(f"❌ Lỗi khi tóm tắt history: {e}")
+        return summary, self.to_chat_messages(window)
+
+    def _plan(self, history: List[Message]) -> Tuple[str, List[Message], List[Message]]:
+        """Tách history thành (tóm tắt đã có, phần cần gộp thêm vào tóm tắt, cửa sổ nguyên văn)"""
+        messages = [message for message in history if message.content]
+
+        # Tóm tắt gần nhất đã có: message cuối cùng (mới nhất) có id nằm trong cache
+        summary, start = "", 0
+        for i in range(len(messages) - 1, -1, -1):
+            cached = self.summaries.get(messages[i].id) if messages[i].id else None
+            if cached is not None:
+                summary, start = cached, i + 1
+                break
+
+        pending = messages[start:]
+        tokens = self.count_tokens([message.content for message in pending])
+        if len(pending) < self.keep_messages + self.fold_messages and sum(tokens) <= self.token_budget:
+            return summary, [], pending
+
+        # Cửa sổ: các message mới nhất trong giới hạn số lượt + trim_budget token (thấp hơn hẳn
+        # token_budget để vài lượt sau chưa phải gộp lại), phần còn lại gộp vào tóm tắt
+        keep, used = 0, 0
+        for count in reversed(tokens):
+            if keep >= self.keep_messages or used + count > self.trim_budget:
+                break
+            keep += 1
+            used += count
+        if keep == 0 and pending:
+            # Message cuối dài hơn cả ngân sách: vẫn giữ nguyên văn để không mất lượt gần nhất
+            keep = 1
+        return summary, pending[:len(pending) - keep], pending[len(pending) - keep:]
+
+    def _summary_input(self, summary: str, fold: List[Message]) -> dict:
+        transcript = "\n".join(
+            f"{'Người dùng' if message.role == 'user' else 'Trợ lý'}: {message.content}" for message in fold
+        )
+        return {"summary": summary or "(chưa có)", "transcript": transcript}
+
+    def _store(self, fold: List[Message], summary: str) -> str:
+        summary = summary.strip()
+        if fold[-1].id:
+            self.summaries.put(fold[-1].id, summary)
+        return summary
+
+    @staticmethod
+    def to_chat_messages(messages: List[Message]) -> List[BaseMessage]:
+        return [
+            HumanMessage(content=message.content) if message.role == "user" else AIMessage(content=message.content)
+            for message in messages
+        ]
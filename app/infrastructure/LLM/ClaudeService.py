@@ -1,28 +1,27 @@
+import anthropic
 from langchain_anthropic import ChatAnthropic
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import StrOutputParser
-from langchain.memory import ConversationBufferWindowMemory
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from core.entity.Chat import Message
 from core.interface.ILLMRepository import ILLMRepository
+from infrastructure.LLM.ChatHistoryWindow import ChatHistoryWindow
+from infrastructure.VectorDB.DocumentChunker import approximate_token_counter
+from typing import AsyncIterator, List, Optional
+from utils.httpClient import config as http_config, get_async_http_client, get_http_client
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Prompt caching của Anthropic: tắt đi nếu model/tài khoản không hỗ trợ
+CLAUDE_PROMPT_CACHE = os.getenv("CLAUDE_PROMPT_CACHE", "true").lower() == "true"
+CACHE_CONTROL = {"type": "ephemeral"}
+# Prefix ngắn hơn mức tối thiểu (1024 token với Sonnet) không được cache, breakpoint chỉ tốn phí
+CLAUDE_CACHE_MIN_TOKENS = int(os.getenv("CLAUDE_CACHE_MIN_TOKENS", "1024"))
 
-class ClaudeLLMService(ILLMRepository):
-    def __init__(self, model_name="claude-sonnet-4-20250514", temperature=0.7, max_tokens=2000):
-        self.llm = ChatAnthropic(
-            model=model_name,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            api_key=os.getenv("ANTHROPIC_API_KEY"),
-        )
-        self.memory = ConversationBufferWindowMemory(memory_key="chat_history", return_messages=True, k=10)
-
-        # Prompt template được cải thiện cho RAG với context liên tục
-        self.rag_prompt = ChatPromptTemplate.from_messages([
-            ("system", """Bạn là một trợ lý AI thân thiện, thông minh và hữu ích. 
+# Phần hướng dẫn cố định, giống hệt nhau ở mọi request -> prefix được cache
+SYSTEM_INSTRUCTIONS = """Bạn là một trợ lý AI thân thiện, thông minh và hữu ích.
 
         HƯỚNG DẪN TRẢ LỜI:
         1. **Ưu tiên sử dụng thông tin trong Context** để trả lời câu hỏi
@@ -34,24 +33,172 @@ class ClaudeLLMService(ILLMRepository):
         4. **Nếu có từ như "đó", "này", "tiếp tục", "thêm nữa"**, hãy liên kết với nội dung trước đó
         5. Luôn trả lời bằng cùng ngôn ngữ với câu hỏi
         6. Nếu thiếu thông tin, yêu cầu làm rõ một cách thân thiện
-        7. Kết hợp với kiến thức của bạn để cung cấp câu trả lời chính xác và đầy đủ nhất
+        7. Kết hợp với kiến thức của bạn để cung cấp câu trả lời chính xác và đầy đủ nhất"""
 
-        Context hiện tại:
-        {context}
 
-        Lịch sử trò chuyện (để hiểu ngữ cảnh liên tục):
-        {chat_history}"""),
-            ("human", "{question}")
-        ])
-        self.chain = self.rag_prompt | self.llm | StrOutputParser()
+class ClaudeLLMService(ILLMRepository):
+    """
+    Prompt được sắp theo thứ tự từ ổn định nhất đến ít ổn định nhất để dùng prompt caching:
+    hướng dẫn -> context (file + vector DB) + tóm tắt history -> các lượt history -> câu hỏi.
+    Cache breakpoint đặt ở cuối phần system và ở message history cuối cùng, chỉ khi prefix tới
+    đó ước lượng >= CLAUDE_CACHE_MIN_TOKENS (hướng dẫn một mình quá ngắn để cache).
+
+    Ghi cache tốn 1.25x giá input, đọc 0.1x: breakpoint có lời khi số token đọc / ghi
+    >= ~0.3. Lượt tiếp theo chỉ đọc lại được khi context retrieve y hệt (câu hỏi nối tiếp
+    cùng chủ đề, trong 5 phút), nên tỉ lệ kỳ vọng khoảng 0.5-1 cho hội thoại nhiều lượt và
+    gần 0 cho câu hỏi rời rạc; usage_stats() trả về cache_read_write_ratio để kiểm tra.
+    """
+
+    def __init__(self, model_name="claude-sonnet-4-20250514", temperature=0.7, max_tokens=2000,
+                 prompt_cache: bool = CLAUDE_PROMPT_CACHE):
+        self.llm = ChatAnthropic(
+            model=model_name,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            # Retry (backoff + jitter) nằm ở transport dùng chung, SDK không retry thêm
+            max_retries=0,
+        )
+        self.use_shared_http_clients()
+        self.prompt_cache = prompt_cache
+        self.cache_min_tokens = CLAUDE_CACHE_MIN_TOKENS
+        # History gửi cho LLM: vài lượt gần nhất nguyên văn (có role) + tóm tắt các lượt cũ hơn
+        self.history_window = ChatHistoryWindow(self.llm)
+
+        # Token usage (kể cả cache read/write) của request gần nhất + cộng dồn
+        self.usage_lock = threading.Lock()
+        self.last_usage: Optional[dict] = None
+        self.usage_totals = {
+            "requests": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "cache_creation_input_tokens": 0,
+        }
+
+    def use_shared_http_clients(self):
+        """
+        Cho ChatAnthropic dùng client SDK chạy trên connection pool httpx dùng chung
+        (utils.httpClient) thay vì client mặc định. ChatAnthropic tạo client lazily
+        (_client / _async_client), gán sẵn ở đây thì nó dùng luôn.
+        """
+        params = {
+            "api_key": os.getenv("ANTHROPIC_API_KEY"),
+            "base_url": os.getenv("ANTHROPIC_BASE_URL") or None,
+            "max_retries": 0,
+            "timeout": http_config.timeout,
+        }
+        self.llm._client = anthropic.Anthropic(http_client=get_http_client(), **params)
+        self.llm._async_client = anthropic.AsyncAnthropic(http_client=get_async_http_client(), **params)
 
     def chat(self, context: str, history: list[Message], question: str) -> str:
-        print(history)
-        response = self.chain.invoke({
-            "context": context,
-            "chat_history": [m.content for m in history],
-            "question": question
-        })
-        self.memory.chat_memory.add_user_message(question)
-        self.memory.chat_memory.add_ai_message(response)
-        return response
+        summary, chat_history = self.history_window.prepare(history)
+        start_time = time.time()
+        response = self.llm.invoke(self.build_messages(context, summary, chat_history, question))
+        self.record_usage(response, time.time() - start_time)
+        return self.text_of(response)
+
+    async def achat(self, context: str, history: list[Message], question: str) -> str:
+        summary, chat_history = await self.history_window.aprepare(history)
+        start_time = time.time()
+        response = await self.llm.ainvoke(self.build_messages(context, summary, chat_history, question))
+        self.record_usage(response, time.time() - start_time)
+        return self.text_of(response)
+
+    async def astream_chat(self, context: str, history: list[Message], question: str) -> AsyncIterator[str]:
+        """Stream từng token từ LLM, usage (có trong chunk cuối) được ghi khi stream kết thúc"""
+        summary, chat_history = await self.history_window.aprepare(history)
+        start_time = time.time()
+        first_token_s = None
+        full = None
+        async for chunk in self.llm.astream(self.build_messages(context, summary, chat_history, question)):
+            full = chunk if full is None else full + chunk
+            text = self.text_of(chunk)
+            if text:
+                if first_token_s is None:
+                    first_token_s = time.time() - start_time
+                yield text
+
+        if full is not None:
+            self.record_usage(full, time.time() - start_time, first_token_s)
+
+    def build_messages(self, context: str, summary: str, chat_history: List[BaseMessage],
+                       question: str) -> List[BaseMessage]:
+        context_text = (
+            f"Context hiện tại:\n{context}\n\n"
+            f"Tóm tắt các lượt trò chuyện trước (để hiểu ngữ cảnh liên tục):\n{summary or '(chưa có)'}"
+        )
+        prefix_tokens = sum(approximate_token_counter([SYSTEM_INSTRUCTIONS, context_text]))
+        system = SystemMessage(content=[
+            {"type": "text", "text": SYSTEM_INSTRUCTIONS},
+            self.text_block(context_text, prefix_tokens),
+        ])
+
+        # Anthropic yêu cầu message đầu tiên là của user: bỏ câu trả lời lẻ ở đầu cửa sổ history
+        chat_history = list(chat_history)
+        while chat_history and not isinstance(chat_history[0], HumanMessage):
+            chat_history.pop(0)
+        if chat_history:
+            prefix_tokens += sum(approximate_token_counter([self.text_of(message) for message in chat_history]))
+            last = chat_history[-1]
+            chat_history[-1] = type(last)(content=[self.text_block(self.text_of(last), prefix_tokens)])
+
+        return [system, *chat_history, HumanMessage(content=question)]
+
+    def text_block(self, text: str, prefix_tokens: int) -> dict:
+        """Block text, gắn cache breakpoint nếu prefix tới hết block này đủ dài để được cache"""
+        block = {"type": "text", "text": text}
+        if self.prompt_cache and prefix_tokens >= self.cache_min_tokens:
+            block["cache_control"] = CACHE_CONTROL
+        return block
+
+    @staticmethod
+    def text_of(message: BaseMessage) -> str:
+        content = message.content
+        if isinstance(content, str):
+            return content
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+    def record_usage(self, response: AIMessage, elapsed: float, first_token_s: Optional[float] = None):
+        """Ghi token usage của một request, gồm số token đọc/ghi prompt cache"""
+        metadata = getattr(response, "usage_metadata", None) or {}
+        details = metadata.get("input_token_details") or {}
+        raw = (getattr(response, "response_metadata", None) or {}).get("usage") or {}
+        cache_read = details.get("cache_read", raw.get("cache_read_input_tokens")) or 0
+        cache_creation = details.get("cache_creation", raw.get("cache_creation_input_tokens")) or 0
+        # input_tokens của usage_metadata đã gồm cả phần cache, API thô thì không
+        input_tokens = metadata.get("input_tokens")
+        if input_tokens is None:
+            input_tokens = (raw.get("input_tokens") or 0) + cache_read + cache_creation
+
+        usage = {
+            "input_tokens": input_tokens,
+            "output_tokens": metadata.get("output_tokens", raw.get("output_tokens")) or 0,
+            "cache_read_input_tokens": cache_read,
+            "cache_creation_input_tokens": cache_creation,
+            "latency_s": round(elapsed, 3),
+        }
+        if first_token_s is not None:
+            usage["first_token_s"] = round(first_token_s, 3)
+
+        with self.usage_lock:
+            self.last_usage = usage
+            self.usage_totals["requests"] += 1
+            for key in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+                self.usage_totals[key] += usage[key]
+        print(f"📊 Claude usage: input={usage['input_tokens']} (cache read={cache_read}, write={cache_creation}),"
+              f" output={usage['output_tokens']}, {usage['latency_s']:.2f}s")
+
+    def usage_stats(self) -> dict:
+        with self.usage_lock:
+            totals = dict(self.usage_totals)
+            last = dict(self.last_usage) if self.last_usage else None
+        totals["cache_hit_rate"] = (
+            round(totals["cache_read_input_tokens"] / totals["input_tokens"], 4) if totals["input_tokens"] else 0.0
+        )
+        # Số token đọc từ cache trên mỗi token ghi cache (< ~0.3 thì prompt caching đang lỗ)
+        totals["cache_read_write_ratio"] = (
+            round(totals["cache_read_input_tokens"] / totals["cache_creation_input_tokens"], 4)
+            if totals["cache_creation_input_tokens"] else None
+        )
+        return {"prompt_cache": self.prompt_cache, "totals": totals, "last": last}
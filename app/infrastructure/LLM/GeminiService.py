@@ -1,9 +1,11 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import ChatPromptTemplate
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.schema import StrOutputParser
-from langchain.memory import ConversationBufferWindowMemory
 from core.entity.Chat import Message
 from core.interface.ILLMRepository import ILLMRepository
+from infrastructure.LLM.ChatHistoryWindow import ChatHistoryWindow
+from typing import AsyncIterator
+from utils.httpClient import config as http_config
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -11,8 +13,11 @@ load_dotenv()
 
 class GeminiLLMService(ILLMRepository):
     def __init__(self, model_name="gemini-2.0-flash", temperature=0.7, max_tokens=2000):
-        self.llm = ChatGoogleGenerativeAI(model=model_name, temperature=temperature, api_key=os.getenv("GOOGLE_API_KEY"), max_tokens=max_tokens)
-        self.memory = ConversationBufferWindowMemory(memory_key="chat_history", return_messages=True, k=10)
+        # SDK Gemini tự quản lý channel (gRPC/HTTP2, giữ kết nối lâu), dùng chung cấu hình timeout/retry
+        self.llm = ChatGoogleGenerativeAI(model=model_name, temperature=temperature, api_key=os.getenv("GOOGLE_API_KEY"), max_tokens=max_tokens,
+                                          timeout=http_config.read_timeout, max_retries=http_config.retries)
+        # History gửi cho LLM: vài lượt gần nhất nguyên văn (có role) + tóm tắt các lượt cũ hơn
+        self.history_window = ChatHistoryWindow(self.llm)
         
         # Prompt template được cải thiện cho RAG với context liên tục
         self.rag_prompt = ChatPromptTemplate.from_messages([
@@ -33,18 +38,32 @@ class GeminiLLMService(ILLMRepository):
         Context hiện tại:
         {context}
 
-        Lịch sử trò chuyện (để hiểu ngữ cảnh liên tục):
-        {chat_history}"""),
+        Tóm tắt các lượt trò chuyện trước (để hiểu ngữ cảnh liên tục):
+        {history_summary}"""),
+            MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{question}")
         ])
         self.chain = self.rag_prompt | self.llm | StrOutputParser()
 
     def chat(self, context: str, history: list[Message], question: str) -> str:
-        response = self.chain.invoke({
+        summary, chat_history = self.history_window.prepare(history)
+        return self.chain.invoke(self.build_input(context, summary, chat_history, question))
+
+    async def achat(self, context: str, history: list[Message], question: str) -> str:
+        summary, chat_history = await self.history_window.aprepare(history)
+        return await self.chain.ainvoke(self.build_input(context, summary, chat_history, question))
+
+    async def astream_chat(self, context: str, history: list[Message], question: str) -> AsyncIterator[str]:
+        """Stream từng token từ LLM"""
+        summary, chat_history = await self.history_window.aprepare(history)
+        async for chunk in self.chain.astream(self.build_input(context, summary, chat_history, question)):
+            yield chunk
+
+    @staticmethod
+    def build_input(context: str, summary: str, chat_history: list, question: str) -> dict:
+        return {
             "context": context,
-            "chat_history": [m.content for m in history],
+            "history_summary": summary or "(chưa có)",
+            "chat_history": chat_history,
             "question": question
-        })
-        self.memory.chat_memory.add_user_message(question)
-        self.memory.chat_memory.add_ai_message(response)
-        return response
+        }
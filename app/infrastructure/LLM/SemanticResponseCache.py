@@ -0,0 +1,138 @@
+import hashlib
+import os
+import re
+import threading
+from typing import Callable, Iterable, Optional, Sequence
+import numpy as np
+from dotenv import load_dotenv
+from core.interface.IResponseCache import IResponseCache
+from infrastructure.VectorDB.ChunkStore import make_doc_id
+from utils.lruCache import LRUCache
+
+load_dotenv()
+
+# Bật cache câu trả lời theo ngữ nghĩa (mặc định tắt)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+# Cosine tối thiểu giữa câu hỏi mới và câu hỏi đã cache để dùng lại câu trả lời
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+# Số câu hỏi tối đa giữ cho mỗi (namespace, tập context)
+SEMANTIC_CACHE_BUCKET_SIZE = int(os.getenv("SEMANTIC_CACHE_BUCKET_SIZE", "32"))
+# History luôn được lưu (MongoDB) nên hầu như lượt nào cũng có history: mặc định key chỉ theo câu hỏi,
+# trừ câu hỏi tiếp nối (có từ trong SEMANTIC_CACHE_FOLLOWUP_WORDS). false = chỉ cache lượt chưa có history
+SEMANTIC_CACHE_IGNORE_HISTORY = os.getenv("SEMANTIC_CACHE_IGNORE_HISTORY", "true").lower() == "true"
+# Từ cho thấy câu hỏi dựa vào các lượt trước ("cái đó", "thêm nữa"...): không dùng cache khi đã có history
+SEMANTIC_CACHE_FOLLOWUP_WORDS = os.getenv(
+    "SEMANTIC_CACHE_FOLLOWUP_WORDS",
+    "đó,này,kia,ấy,nó,vậy,tiếp,tục,thêm,nữa,trước,it,its,that,this,these,those,more,above,previous",
+)
+
+
+def bucket_sizeof(bucket: tuple) -> int:
+    vectors, answers = bucket
+    return vectors.nbytes + sum(len(answer.encode("utf-8")) + 64 for answer in answers) + 256
+
+
+class SemanticResponseCache(IResponseCache):
+    """
+    Cache câu trả lời của LLM theo (namespace, hash tập context đã retrieve): trong cùng một
+    bucket, câu hỏi mới có cosine >= threshold với một câu hỏi đã cache thì dùng lại câu trả
+    lời, khỏi gọi LLM. Key là hash nội dung các chunk nên thêm/xóa/sửa dữ liệu tự ra bucket
+    khác, không cần invalidate theo phiên bản vector store; entry hết hạn sau ttl giây.
+    Embedding câu hỏi dùng lại model Qwen3 (và query cache) của vector store.
+    """
+
+    def __init__(self, embed_fn: Callable[[str], Sequence[float]],
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL,
+                 bucket_size: int = SEMANTIC_CACHE_BUCKET_SIZE,
+                 ignore_history: bool = SEMANTIC_CACHE_IGNORE_HISTORY,
+                 followup_words: str = SEMANTIC_CACHE_FOLLOWUP_WORDS):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.bucket_size = max(1, bucket_size)
+        self.ignore_history = ignore_history
+        self.followup_words = {word.strip().casefold() for word in followup_words.split(",") if word.strip()}
+        self.buckets = LRUCache(
+            max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_BUCKETS", "4096")),
+            max_bytes=int(os.getenv("SEMANTIC_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl=ttl if ttl > 0 else None,
+            sizeof=bucket_sizeof,
+        )
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.followups = 0
+        self.stores = 0
+
+    def applicable(self, question: str, history: list) -> bool:
+        """Lượt đầu luôn dùng được cache; có history thì chỉ khi câu hỏi tự đứng được (không tiếp nối)"""
+        if not history:
+            return True
+        if not self.ignore_history:
+            return False
+        if self.followup_words.intersection(re.findall(r"\w+", question.casefold())):
+            with self.lock:
+                self.followups += 1
+            return False
+        return True
+
+    @staticmethod
+    def key_for(context_docs: Iterable[tuple]) -> str:
+        """Hash của tập chunk đã retrieve (doc id = source + sha256 nội dung, không phụ thuộc thứ tự)"""
+        doc_ids = sorted({make_doc_id(doc.metadata, doc.page_content) for doc, _ in context_docs})
+        return hashlib.sha256("\n".join(doc_ids).encode("utf-8")).hexdigest()
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, question: str, namespace: Optional[str], key: str) -> Optional[str]:
+        """Câu trả lời đã cache cho câu hỏi gần giống trong cùng namespace + context, hoặc None"""
+        with self.lock:
+            self.lookups += 1
+        bucket = self.buckets.get((namespace, key))
+        if bucket is None:
+            return None
+        vectors, answers = bucket
+
+        scores = vectors @ self._embed(question)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        with self.lock:
+            self.hits += 1
+        print(f"♻️ Semantic cache hit (cosine {scores[best]:.3f})")
+        return answers[best]
+
+    def store(self, question: str, namespace: Optional[str], key: str, answer: str):
+        if not answer:
+            return
+        vector = self._embed(question)
+        # Bucket là tuple bất biến (LRUCache tính kích thước lúc put)
+        bucket = self.buckets.get((namespace, key))
+        if bucket is None:
+            vectors, answers = np.zeros((0, len(vector)), dtype=np.float32), []
+        else:
+            vectors, answers = bucket
+        vectors = np.vstack([vectors, vector[None, :]])[-self.bucket_size:]
+        answers = (answers + [answer])[-self.bucket_size:]
+        self.buckets.put((namespace, key), (vectors, answers))
+        with self.lock:
+            self.stores += 1
+
+    def clear(self):
+        self.buckets.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = {
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "followups_skipped": self.followups,
+                "stores": self.stores,
+            }
+        stats["buckets"] = self.buckets.stats()
+        return stats
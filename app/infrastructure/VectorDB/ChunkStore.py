@@ -0,0 +1,384 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+CHUNK_STORE_FILE = "chunks.sqlite"
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def source_of(metadata: dict) -> str:
+    return str(metadata.get("source") or metadata.get("filename") or "")
+
+
+def make_doc_id(metadata: dict, text: str, namespace: Optional[str] = None) -> str:
+    """Id ổn định theo (namespace, source, nội dung): upload lại cùng file thì chunk không đổi giữ nguyên id"""
+    doc_id = f"{source_of(metadata)}:{hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]}"
+    return f"{namespace}/{doc_id}" if namespace else doc_id
+
+
+def shared_keys_of(metadatas: List[dict]) -> Dict[str, Optional[set]]:
+    """
+    Key metadata chung của file theo từng "source": key nào có cùng giá trị ở mọi document của
+    source trong batch (column_headers, column_types, thuộc tính workbook...) là metadata của file.
+    None nếu source chỉ có một document trong batch (chưa đủ để quyết định).
+    """
+    groups: Dict[str, List[dict]] = {}
+    for metadata in metadatas:
+        groups.setdefault(source_of(metadata), []).append(metadata)
+
+    result: Dict[str, Optional[set]] = {}
+    for source, group in groups.items():
+        if len(group) < 2:
+            result[source] = None
+            continue
+        result[source] = {
+            key for key, value in group[0].items()
+            if all(key in metadata and _dumps(metadata[key]) == _dumps(value) for metadata in group[1:])
+        }
+    return result
+
+
+def split_metadata(metadatas: List[dict], shared_keys: Dict[str, Iterable[str]]) -> List[tuple]:
+    """
+    Tách metadata thành phần chung của file (lưu một lần trong bảng sources, theo shared_keys
+    của source) và phần riêng của từng chunk.
+    Trả về list (source, source_metadata, chunk_metadata) theo đúng thứ tự đầu vào.
+    """
+    result = []
+    for metadata in metadatas:
+        source = source_of(metadata)
+        keys = shared_keys.get(source) or ()
+        shared = {key: metadata[key] for key in keys if key in metadata}
+        chunk_metadata = {key: value for key, value in metadata.items() if key not in shared}
+        result.append((source, shared, chunk_metadata))
+    return result
+
+
+class ChunkStore(Docstore):
+    """
+    Chunk store SQLite thay cho InMemoryDocstore được pickle trong index.pkl:
+
+      sources(source_id, source, metadata, metadata_hash)   -> metadata cấp file, lưu một lần
+      source_keys(source, ingest_id, keys)                  -> key nào là metadata cấp file, quyết
+                                                             định một lần cho mỗi lần upload của source
+      chunks(faiss_id, doc_id, source_id, page_content, metadata, ingest_id, namespace)
+                                                          -> nội dung + metadata riêng của chunk
+
+    Chỉ các chunk thuộc top-k mới được đọc (theo faiss_id), không load toàn bộ vào RAM.
+    File nằm ở persist_path (không thuộc generation); chunk mới được ghi trước khi vector
+    vào WAL/index, nên mọi faiss_id trong index luôn có chunk tương ứng.
+    Đọc qua mmap (PRAGMA mmap_size), journal WAL để các worker đọc song song với writer.
+    ingest_id đánh dấu lần upload gần nhất thấy chunk, chunk của source không được đánh dấu
+    trong lần upload mới là chunk cũ cần xóa (mark & sweep).
+    namespace (user/tenant) NULL là dữ liệu dùng chung; các thao tác theo source chỉ
+    đụng tới chunk của đúng namespace.
+    """
+
+    def __init__(self, path: str, mmap_size: int = 1 << 30):
+        self.path = path
+        self.mmap_size = mmap_size
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " source_id INTEGER PRIMARY KEY,"
+            " source TEXT NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " metadata_hash TEXT NOT NULL UNIQUE);"
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " faiss_id INTEGER PRIMARY KEY,"
+            " doc_id TEXT NOT NULL UNIQUE,"
+            " source_id INTEGER NOT NULL REFERENCES sources(source_id),"
+            " page_content TEXT NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " ingest_id TEXT,"
+            " namespace TEXT);"
+            "CREATE TABLE IF NOT EXISTS source_keys ("
+            " source TEXT NOT NULL,"
+            " ingest_id TEXT NOT NULL,"
+            " keys TEXT NOT NULL,"
+            " PRIMARY KEY (source, ingest_id));"
+            "CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source_id);"
+            "CREATE INDEX IF NOT EXISTS sources_source ON sources(source);"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+        for column in ("ingest_id", "namespace"):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS chunks_namespace ON chunks(namespace, faiss_id)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Mỗi thread một connection
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self.local.conn = conn
+        return conn
+
+    # ---------- ghi ----------
+    def add_chunks(self, faiss_ids: Iterable[int], doc_ids: List[str], texts: List[str], metadatas: List[dict],
+                   ingest_id: Optional[str] = None, namespace: Optional[str] = None):
+        """Ghi một batch chunk (một transaction); faiss_id trùng sẽ bị ghi đè"""
+        rows = []
+        with self.write_lock:
+            conn = self._connection()
+            source_ids: Dict[str, int] = {}
+            shared_keys = self._shared_keys(conn, metadatas, ingest_id)
+            for faiss_id, doc_id, text, (source, source_metadata, chunk_metadata) in zip(
+                faiss_ids, doc_ids, texts, split_metadata(metadatas, shared_keys)
+            ):
+                encoded = _dumps(source_metadata)
+                metadata_hash = hashlib.sha256(f"{source}\x00{encoded}".encode("utf-8")).hexdigest()
+                if metadata_hash not in source_ids:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO sources (source, metadata, metadata_hash) VALUES (?, ?, ?)",
+                        (source, encoded, metadata_hash),
+                    )
+                    source_ids[metadata_hash] = conn.execute(
+                        "SELECT source_id FROM sources WHERE metadata_hash = ?", (metadata_hash,)
+                    ).fetchone()[0]
+                rows.append((int(faiss_id), doc_id, source_ids[metadata_hash], text, _dumps(chunk_metadata),
+                             ingest_id, namespace))
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks"
+                " (faiss_id, doc_id, source_id, page_content, metadata, ingest_id, namespace)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.commit()
+
+    @staticmethod
+    def _shared_keys(conn: sqlite3.Connection, metadatas: List[dict], ingest_id: Optional[str]) -> Dict[str, set]:
+        """
+        Key metadata cấp file của từng source: quyết định ở batch đầu tiên có từ 2 document của source
+        rồi lưu lại, các batch sau của cùng lần upload dùng lại quyết định đó (không tính lại theo batch).
+        """
+        ingest_key = ingest_id or ""
+        result: Dict[str, set] = {}
+        for source, keys in shared_keys_of(metadatas).items():
+            row = conn.execute(
+                "SELECT keys FROM source_keys WHERE source = ? AND ingest_id = ?", (source, ingest_key)
+            ).fetchone()
+            if row is not None:
+                result[source] = set(json.loads(row[0]))
+            elif keys is not None:
+                # Quyết định của các lần upload cũ không còn chunk nào thì bỏ
+                conn.execute(
+                    "DELETE FROM source_keys WHERE source = ? AND ingest_id NOT IN"
+                    " (SELECT DISTINCT COALESCE(c.ingest_id, '') FROM chunks c"
+                    " JOIN sources s ON s.source_id = c.source_id WHERE s.source = ?)",
+                    (source, source),
+                )
+                conn.execute(
+                    "INSERT INTO source_keys (source, ingest_id, keys) VALUES (?, ?, ?)",
+                    (source, ingest_key, _dumps(sorted(keys))),
+                )
+                result[source] = keys
+            else:
+                # Document đầu tiên của source: chưa biết key nào chung, giữ toàn bộ ở metadata chunk
+                result[source] = set()
+        return result
+
+    def import_docstore(self, docstore, index_to_docstore_id: Dict[int, str], batch_size: int = 1000) -> int:
+        """Chuyển InMemoryDocstore cũ (index.pkl) sang chunk store, trả về số chunk đã ghi"""
+        batch = ([], [], [], [])
+        imported = 0
+        for faiss_id, doc_id in sorted(index_to_docstore_id.items()):
+            doc = docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                continue
+            for column, value in zip(batch, (faiss_id, doc_id, doc.page_content, doc.metadata)):
+                column.append(value)
+            if len(batch[0]) >= batch_size:
+                self.add_chunks(*batch)
+                imported += len(batch[0])
+                batch = ([], [], [], [])
+        if batch[0]:
+            self.add_chunks(*batch)
+            imported += len(batch[0])
+        return imported
+
+    def delete_from(self, faiss_id: int) -> int:
+        """Xóa chunk có faiss_id >= faiss_id (chunk mồ côi do crash trước khi vector được lưu)"""
+        with self.write_lock:
+            conn = self._connection()
+            deleted = conn.execute("DELETE FROM chunks WHERE faiss_id >= ?", (int(faiss_id),)).rowcount
+            conn.commit()
+        return deleted
+
+    def mark_ingested(self, doc_ids: List[str], ingest_id: Optional[str] = None) -> set:
+        """Trả về các doc_id đã có; nếu có ingest_id thì đánh dấu chúng thuộc lần upload này"""
+        existing = self.existing_doc_ids(doc_ids)
+        if ingest_id is None or not existing:
+            return existing
+        with self.write_lock:
+            conn = self._connection()
+            conn.executemany("UPDATE chunks SET ingest_id = ? WHERE doc_id = ?",
+                             [(ingest_id, doc_id) for doc_id in existing])
+            conn.commit()
+        return existing
+
+    def delete_faiss_ids(self, faiss_ids: List[int]) -> int:
+        """Xóa chunk theo faiss_id, dọn luôn các dòng sources không còn chunk nào"""
+        with self.write_lock:
+            conn = self._connection()
+            deleted = 0
+            for start in range(0, len(faiss_ids), 500):
+                batch = [int(faiss_id) for faiss_id in faiss_ids[start:start + 500]]
+                placeholders = ",".join("?" * len(batch))
+                deleted += conn.execute(f"DELETE FROM chunks WHERE faiss_id IN ({placeholders})", batch).rowcount
+            conn.execute("DELETE FROM sources WHERE source_id NOT IN (SELECT DISTINCT source_id FROM chunks)")
+            conn.execute("DELETE FROM source_keys WHERE source NOT IN (SELECT DISTINCT source FROM sources)")
+            conn.commit()
+        return deleted
+
+    # ---------- đọc ----------
+    @staticmethod
+    def _to_document(page_content: str, source_metadata: str, chunk_metadata: str) -> Document:
+        metadata = json.loads(source_metadata)
+        metadata.update(json.loads(chunk_metadata))
+        return Document(page_content=page_content, metadata=metadata)
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self._connection().execute(
+            "SELECT c.page_content, s.metadata, c.metadata FROM chunks c"
+            " JOIN sources s ON s.source_id = c.source_id WHERE c.doc_id = ?",
+            (search,),
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return self._to_document(*row)
+
+    def get_by_faiss_ids(self, faiss_ids: Iterable[int]) -> Dict[int, Document]:
+        faiss_ids = [int(faiss_id) for faiss_id in faiss_ids]
+        if not faiss_ids:
+            return {}
+        placeholders = ",".join("?" * len(faiss_ids))
+        rows = self._connection().execute(
+            "SELECT c.faiss_id, c.page_content, s.metadata, c.metadata FROM chunks c"
+            f" JOIN sources s ON s.source_id = c.source_id WHERE c.faiss_id IN ({placeholders})",
+            faiss_ids,
+        ).fetchall()
+        return {row[0]: self._to_document(*row[1:]) for row in rows}
+
+    def existing_doc_ids(self, doc_ids: List[str]) -> set:
+        existing = set()
+        conn = self._connection()
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            existing.update(row[0] for row in conn.execute(
+                f"SELECT doc_id FROM chunks WHERE doc_id IN ({placeholders})", batch
+            ))
+        return existing
+
+    def faiss_ids(self, below: Optional[int] = None) -> List[int]:
+        query = "SELECT faiss_id FROM chunks"
+        params = ()
+        if below is not None:
+            query += " WHERE faiss_id < ?"
+            params = (int(below),)
+        return [row[0] for row in self._connection().execute(query + " ORDER BY faiss_id", params)]
+
+    def source_faiss_ids(self, source: str, namespace: Optional[str] = None) -> List[int]:
+        return [row[0] for row in self._connection().execute(
+            "SELECT c.faiss_id FROM chunks c JOIN sources s ON s.source_id = c.source_id"
+            " WHERE s.source = ? AND c.namespace IS ? ORDER BY c.faiss_id", (source, namespace)
+        )]
+
+    def stale_faiss_ids(self, source: str, ingest_id: str, namespace: Optional[str] = None) -> List[int]:
+        """Chunk của source không được đánh dấu trong lần upload ingest_id (nội dung đã bị sửa/xóa)"""
+        return [row[0] for row in self._connection().execute(
+            "SELECT c.faiss_id FROM chunks c JOIN sources s ON s.source_id = c.source_id"
+            " WHERE s.source = ? AND c.namespace IS ? AND (c.ingest_id IS NULL OR c.ingest_id != ?)"
+            " ORDER BY c.faiss_id",
+            (source, namespace, ingest_id),
+        )]
+
+    def namespace_faiss_ids(self, namespaces: List[Optional[str]], below: Optional[int] = None) -> List[int]:
+        """faiss_id của các chunk thuộc một trong các namespace (None = dữ liệu dùng chung)"""
+        query = "SELECT faiss_id FROM chunks WHERE (" + " OR ".join("namespace IS ?" for _ in namespaces) + ")"
+        params = list(namespaces)
+        if below is not None:
+            query += " AND faiss_id < ?"
+            params.append(int(below))
+        return [row[0] for row in self._connection().execute(query + " ORDER BY faiss_id", params)]
+
+    def list_sources(self, namespace: Optional[str] = None) -> List[dict]:
+        rows = self._connection().execute(
+            # metadata lấy từ phiên bản mới nhất của source
+            "SELECT s.source, COUNT(c.faiss_id),"
+            " (SELECT metadata FROM sources latest WHERE latest.source = s.source"
+            "  ORDER BY latest.source_id DESC LIMIT 1)"
+            " FROM sources s JOIN chunks c ON c.source_id = s.source_id"
+            " WHERE c.namespace IS ? GROUP BY s.source ORDER BY s.source",
+            (namespace,),
+        ).fetchall()
+        sources = []
+        for source, chunks, metadata in rows:
+            metadata = json.loads(metadata)
+            sources.append({
+                "source": source,
+                "chunks": chunks,
+                "file_type": metadata.get("file_type"),
+                "file_size": metadata.get("file_size"),
+            })
+        return sources
+
+    def max_faiss_id(self) -> int:
+        row = self._connection().execute("SELECT MAX(faiss_id) FROM chunks").fetchone()
+        return -1 if row[0] is None else row[0]
+
+    def id_map(self) -> "ChunkIdMap":
+        return ChunkIdMap(self)
+
+    def stats(self) -> dict:
+        conn = self._connection()
+        return {
+            "path": self.path,
+            "chunks": conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0],
+            "sources": conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0],
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+class ChunkIdMap(Mapping):
+    """Ánh xạ faiss_id -> docstore id đọc thẳng từ SQLite (thay cho dict index_to_docstore_id)"""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def __getitem__(self, faiss_id: int) -> str:
+        row = self.store._connection().execute(
+            "SELECT doc_id FROM chunks WHERE faiss_id = ?", (int(faiss_id),)
+        ).fetchone()
+        if row is None:
+            raise KeyError(faiss_id)
+        return row[0]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.store.faiss_ids())
+
+    def __len__(self) -> int:
+        return self.store._connection().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
@@ -0,0 +1,125 @@
+import os
+import re
+from typing import Callable, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+load_dotenv()
+
+# Kích thước chunk tính theo token của model embedding (không phải ký tự)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+
+# Thứ tự tách: block (dòng trống: paragraph/bảng docx, khối dòng txt) -> dòng -> câu -> từ
+SEPARATORS = (
+    re.compile(r"\n\s*\n"),
+    re.compile(r"\n"),
+    re.compile(r"(?<=[.!?…。])\s+"),
+    re.compile(r"\s+"),
+)
+JOINERS = ("\n\n", "\n", " ", " ")
+
+TokenCounter = Callable[[Sequence[str]], List[int]]
+
+
+def approximate_token_counter(texts: Sequence[str]) -> List[int]:
+    """Ước lượng ~4 ký tự/token khi không có tokenizer (ví dụ embedding qua API)"""
+    return [max(1, (len(text) + 3) // 4) for text in texts]
+
+
+class DocumentChunker:
+    """
+    Chia document thành các chunk theo cấu trúc thay vì cắt cứng content[i:i + chunk_size]:
+    ưu tiên ranh giới block (paragraph/bảng docx, khối dòng txt), chỉ tách nhỏ hơn
+    (dòng -> câu -> từ) khi một block vượt max_tokens, rồi gộp các phần liền nhau đến
+    max_tokens. Chunk sau lặp lại các phần cuối của chunk trước (tối đa overlap_tokens).
+
+    count_tokens(texts) -> số token của từng text; dùng tokenizer của Qwen3 nếu có.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 count_tokens: Optional[TokenCounter] = None):
+        self.max_tokens = max(1, max_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.max_tokens // 2))
+        self.count_tokens = count_tokens or approximate_token_counter
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        chunks = []
+        for doc in documents:
+            chunks.extend(self.split_document(doc))
+        return chunks
+
+    def split_document(self, doc: Document) -> List[Document]:
+        text = doc.page_content or ""
+        # Text không dài hơn max_tokens ký tự thì vừa một chunk (phần lớn row Excel/CSV), khỏi tokenize
+        if len(text) <= self.max_tokens or not text.strip():
+            return [doc]
+
+        units = self._split_units(text, 0, JOINERS[0])
+        if sum(count for _, count, _ in units) <= self.max_tokens:
+            return [doc]
+
+        pieces = self._pack(units)
+        chunks = []
+        for i, (content, tokens) in enumerate(pieces):
+            metadata = doc.metadata.copy()
+            metadata.update({
+                "chunk_id": f"{doc.metadata.get('row_index', 0)}_chunk_{i}",
+                "chunk_index": i,
+                "chunk_count": len(pieces),
+                "chunk_tokens": tokens,
+                "is_chunked": True,
+            })
+            chunks.append(Document(page_content=content, metadata=metadata))
+        return chunks
+
+    def _split_units(self, text: str, level: int, joiner: str) -> List[Tuple[str, int, str]]:
+        """Trả về list (text, số token, ký tự nối với phần trước) không phần nào vượt max_tokens"""
+        parts = [part.strip() for part in SEPARATORS[level].split(text)]
+        parts = [part for part in parts if part]
+        if not parts:
+            return []
+
+        units = []
+        for part, count in zip(parts, self.count_tokens(parts)):
+            part_joiner = joiner if not units else JOINERS[level]
+            if count <= self.max_tokens:
+                units.append((part, count, part_joiner))
+            elif level + 1 < len(SEPARATORS):
+                sub_units = self._split_units(part, level + 1, part_joiner)
+                units.extend(sub_units)
+            else:
+                # Một "từ" dài hơn max_tokens (base64, URL...) -> đành cắt theo ký tự
+                step = max(1, len(part) * self.max_tokens // count)
+                pieces = [part[i:i + step] for i in range(0, len(part), step)]
+                for j, (piece, piece_count) in enumerate(zip(pieces, self.count_tokens(pieces))):
+                    units.append((piece, piece_count, part_joiner if j == 0 else ""))
+        return units
+
+    def _pack(self, units: List[Tuple[str, int, str]]) -> List[Tuple[str, int]]:
+        chunks = []
+        current, current_tokens = [], 0
+        for unit in units:
+            count = unit[1]
+            if current and current_tokens + count > self.max_tokens:
+                chunks.append(current)
+                # Overlap: giữ các phần cuối của chunk trước (không lấy lại cả chunk)
+                overlap, overlap_tokens = [], 0
+                for previous in reversed(current[1:]):
+                    if overlap_tokens + previous[1] > self.overlap_tokens:
+                        break
+                    overlap.insert(0, previous)
+                    overlap_tokens += previous[1]
+                while overlap and overlap_tokens + count > self.max_tokens:
+                    overlap_tokens -= overlap.pop(0)[1]
+                current, current_tokens = overlap, overlap_tokens
+            current.append(unit)
+            current_tokens += count
+        if current:
+            chunks.append(current)
+
+        return [
+            (chunk[0][0] + "".join(joiner + text for text, _, joiner in chunk[1:]),
+             sum(count for _, count, _ in chunk))
+            for chunk in chunks
+        ]
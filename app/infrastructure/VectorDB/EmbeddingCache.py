@@ -0,0 +1,236 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Cache embedding trên disk, địa chỉ hóa theo nội dung:
+    key = sha256(model name, instruction, sha256(text)).
+
+    - vectors.f32: ma trận float32 (np.memmap), mỗi slot chứa một vector
+    - tags.u64: 64 bit đầu của key đang nằm trong từng slot (0 = trống / đang ghi)
+    - index.json: danh sách (key, slot) theo thứ tự LRU (cũ -> mới)
+    - Giới hạn max_entries, vượt quá thì evict key ít dùng nhất và tái sử dụng slot
+
+    index.json chỉ được ghi lại khi flush, nên map key -> slot của process chỉ đọc (hoặc
+    index.json còn lại sau crash) có thể đã cũ khi slot bị evict và dùng cho key khác:
+    mỗi lần đọc đều so tag của slot với key, lệch thì coi là miss.
+
+    Chỉ một process giữ quyền ghi (flock trên cache.lock); các process khác
+    (ví dụ các worker gunicorn còn lại) mở ở chế độ chỉ đọc.
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, cache_dir: str, max_entries: int = 100_000, flush_every: int = 256):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.vectors_file = os.path.join(cache_dir, "vectors.f32")
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.tags_file = os.path.join(cache_dir, "tags.u64")
+
+        self.lock = threading.RLock()
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.free_slots: List[int] = []
+        self.dim: Optional[int] = None
+        self.capacity = 0
+        self.matrix: Optional[np.memmap] = None
+        self.tags: Optional[np.memmap] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+        self.pending_writes = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.writable = self._acquire_writer_lock()
+        self._load()
+
+    @staticmethod
+    def make_key(model_name: str, instruction: Optional[str], text: str) -> str:
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{model_name}\x00{instruction or ''}\x00{text_hash}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _tag(key: str) -> int:
+        return int(key[:16], 16) or 1
+
+    def _acquire_writer_lock(self) -> bool:
+        self._lock_fd = open(os.path.join(self.cache_dir, "cache.lock"), "a+")
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            print(f"⚠️ Embedding cache đang được process khác ghi, mở chế độ chỉ đọc: {self.cache_dir}")
+            return False
+
+    def _load(self):
+        if not os.path.exists(self.index_file) or not os.path.exists(self.vectors_file):
+            return
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if not os.path.exists(self.tags_file):
+                # Cache tạo trước khi có tags.u64: không kiểm chứng được slot nào, bỏ đi
+                raise ValueError("thiếu tags.u64")
+            self.dim = meta["dim"]
+            self.capacity = meta["capacity"]
+            self.matrix = np.memmap(
+                self.vectors_file,
+                dtype=np.float32,
+                mode="r+" if self.writable else "r",
+                shape=(self.capacity, self.dim),
+            )
+            self._open_tags()
+            self.entries = OrderedDict((key, slot) for key, slot in meta["entries"])
+            used = set(self.entries.values())
+            self.free_slots = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+            print(f"✅ Đã load embedding cache: {len(self.entries)} vectors từ {self.cache_dir}")
+        except Exception as e:
+            print(f"❌ Lỗi khi load embedding cache, tạo cache mới: {e}")
+            self.entries = OrderedDict()
+            self.free_slots = []
+            self.dim = None
+            self.capacity = 0
+            self.matrix = None
+            self.tags = None
+            if self.writable:
+                for path in (self.index_file, self.vectors_file, self.tags_file):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def _open_tags(self):
+        """tags.u64 có thể ngắn hơn capacity (crash giữa lúc resize): writer nới ra, slot mới tag 0 = miss"""
+        if self.writable and os.path.getsize(self.tags_file) < self.capacity * 8:
+            with open(self.tags_file, "ab") as f:
+                f.truncate(self.capacity * 8)
+        length = min(self.capacity, os.path.getsize(self.tags_file) // 8)
+        self.tags = np.memmap(self.tags_file, dtype=np.uint64, mode="r+" if self.writable else "r",
+                              shape=(length,)) if length else None
+
+    def _resize(self, new_capacity: int):
+        if self.matrix is not None:
+            self.matrix.flush()
+            del self.matrix
+        with open(self.vectors_file, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self.matrix = np.memmap(self.vectors_file, dtype=np.float32, mode="r+", shape=(new_capacity, self.dim))
+        if self.tags is not None:
+            self.tags.flush()
+            del self.tags
+        with open(self.tags_file, "ab") as f:
+            f.truncate(new_capacity * 8)
+        self.tags = np.memmap(self.tags_file, dtype=np.uint64, mode="r+", shape=(new_capacity,))
+        self.free_slots = list(range(new_capacity - 1, self.capacity - 1, -1)) + self.free_slots
+        self.capacity = new_capacity
+
+    def _allocate_slot(self) -> int:
+        if self.free_slots:
+            return self.free_slots.pop()
+        if self.capacity < self.max_entries:
+            self._resize(min(self.max_entries, max(self.INITIAL_CAPACITY, self.capacity * 2)))
+            return self.free_slots.pop()
+        # Cache đầy: evict key ít dùng nhất
+        _, slot = self.entries.popitem(last=False)
+        self.evictions += 1
+        return slot
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Trả về các vector đã có trong cache (copy), cập nhật thứ tự LRU"""
+        found = {}
+        with self.lock:
+            for key in keys:
+                slot = self.entries.get(key)
+                if slot is None:
+                    self.misses += 1
+                    continue
+                vector = self._read_slot(key, slot)
+                if vector is None:
+                    # Slot đã thuộc về key khác (map cũ): bỏ entry, writer lấy lại slot
+                    del self.entries[key]
+                    if self.writable:
+                        self.free_slots.append(slot)
+                    self.stale += 1
+                    self.misses += 1
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = vector
+                self.hits += 1
+        return found
+
+    def _read_slot(self, key: str, slot: int) -> Optional[np.ndarray]:
+        """Vector của key trong slot, None nếu tag không khớp (đọc tag trước và sau để tránh đọc lúc đang ghi)"""
+        if self.tags is None or slot >= len(self.tags):
+            return None
+        tag = self._tag(key)
+        if int(self.tags[slot]) != tag:
+            return None
+        vector = np.array(self.matrix[slot])
+        if int(self.tags[slot]) != tag:
+            return None
+        return vector
+
+    def put_many(self, keys: List[str], vectors) -> None:
+        if not self.writable or not keys:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+            if vectors.shape[1] != self.dim:
+                print(f"⚠️ Bỏ qua cache: dimension {vectors.shape[1]} khác {self.dim}")
+                return
+            for key, vector in zip(keys, vectors):
+                slot = self.entries.get(key)
+                if slot is None:
+                    slot = self._allocate_slot()
+                # Xóa tag trước khi ghi vector, ghi tag mới sau: reader không bao giờ thấy vector dở
+                self.tags[slot] = 0
+                self.matrix[slot] = vector
+                self.tags[slot] = self._tag(key)
+                self.entries[key] = slot
+                self.entries.move_to_end(key)
+            self.pending_writes += len(keys)
+            if self.pending_writes >= self.flush_every:
+                self.flush()
+
+    def flush(self) -> None:
+        """Ghi vectors + index xuống disk (index ghi qua file tạm rồi rename)"""
+        if not self.writable:
+            return
+        with self.lock:
+            if self.matrix is None:
+                return
+            self.matrix.flush()
+            self.tags.flush()
+            tmp_file = self.index_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({
+                    "dim": self.dim,
+                    "capacity": self.capacity,
+                    "entries": list(self.entries.items()),
+                }, f)
+            os.replace(tmp_file, self.index_file)
+            self.pending_writes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "stale_slots": self.stale,
+                "writable": self.writable,
+            }
@@ -6,6 +6,9 @@ from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_core.documents import Document
 from typing import List
 from dotenv import load_dotenv
+from infrastructure.VectorDB.DocumentChunker import DocumentChunker
+from utils.httpClient import config as http_config
+from utils.rateLimiter import AdaptiveRateLimiter
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import asyncio
 load_dotenv()
@@ -20,7 +23,12 @@ class GeminiFaiss():
             google_api_key=os.getenv("GOOGLE_API_KEY"),
             # Thêm config để tối ưu
             task_type="RETRIEVAL_DOCUMENT",
-            # Có thể thêm rate limiting nếu cần
+            request_options={"timeout": http_config.read_timeout},
+        )
+        # Token bucket cho embedding API: rate (request/s) tự giảm khi gặp 429
+        self.rate_limiter = AdaptiveRateLimiter(
+            rate=float(os.getenv("EMBEDDING_RATE_LIMIT", "1.0")),
+            capacity=float(os.getenv("EMBEDDING_RATE_BURST", "5")),
         )
         vector_store = None
 
@@ -41,7 +49,7 @@ class GeminiFaiss():
         else:
             print(f"⚠️ Chưa có vectorstore tại: {self.persist_path}. Sẽ tạo mới sau.")
 
-        super().__init__(vector_store)
+        self.vector_store = vector_store
 
     def save_vectorstore(self):
         print(f"💾 Đang lưu vectorstore vào: {self.persist_path}")
@@ -51,76 +59,72 @@ class GeminiFaiss():
             return True
         return False
     
-    def add_documents_batch(self, documents: List[Document], batch_size: int = 3, delay: float = 5.0):
-        """Thêm documents theo batch với exponential backoff để tránh rate limit"""
+    def add_documents_batch(self, documents: List[Document], batch_size: int = 100, max_retries: int = 5):
+        """
+        Embed mỗi document đúng một lần bằng batch request nhiều text,
+        sau đó đưa vector đã tính vào FAISS (add_embeddings / from_embeddings).
+        Tốc độ gọi API được điều tiết bởi token bucket, tự giảm khi gặp 429.
+        """
         if not documents:
             print("❗ Không có document nào để thêm.")
             return
 
         print(f"🚀 Bắt đầu embedding {len(documents)} documents với batch_size={batch_size}")
         
-        # Chia documents thành batches nhỏ hơn
+        # Chia documents thành batches, mỗi batch là một request
         batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
         
+        embedded_docs = []
         all_embeddings = []
-        total_time = 0
+        start_total = time.time()
         
         for i, batch in enumerate(batches):
             start_time = time.time()
             print(f"📦 Xử lý batch {i+1}/{len(batches)} ({len(batch)} docs)...")
             
             retry_count = 0
-            max_retries = 5
-            base_delay = delay
-            
             while retry_count <= max_retries:
+                self.rate_limiter.acquire()
                 try:
-                    # Embed từng document một để tránh rate limit
-                    batch_embeddings = []
-                    for j, doc in enumerate(batch):
-                        print(f"  📄 Embedding doc {j+1}/{len(batch)} trong batch {i+1}...")
-                        doc_embedding = self.embeddings.embed_documents([doc.page_content])
-                        batch_embeddings.extend(doc_embedding)
-                        
-                        # Delay nhỏ giữa các document
-                        if j < len(batch) - 1:
-                            time.sleep(0.5)
-                    
+                    batch_embeddings = self.embeddings.embed_documents(
+                        [doc.page_content for doc in batch],
+                        batch_size=batch_size
+                    )
+                    self.rate_limiter.on_success()
+                    embedded_docs.extend(batch)
                     all_embeddings.extend(batch_embeddings)
-                    batch_time = time.time() - start_time
-                    total_time += batch_time
-                    print(f"✅ Hoàn thành batch {i+1} trong {batch_time:.2f}s")
+                    print(f"✅ Hoàn thành batch {i+1} trong {time.time() - start_time:.2f}s")
                     break
                     
                 except Exception as e:
                     retry_count += 1
-                    if "429" in str(e) or "exhausted" in str(e):
-                        # Exponential backoff
-                        wait_time = base_delay * (2 ** retry_count)
-                        print(f"🚫 Rate limit hit! Retry {retry_count}/{max_retries} sau {wait_time:.1f}s...")
-                        time.sleep(wait_time)
+                    if "429" in str(e) or "exhausted" in str(e).lower():
+                        self.rate_limiter.on_rate_limited()
+                        print(f"🚫 Rate limit hit! Retry {retry_count}/{max_retries} "
+                              f"(rate giảm còn {self.rate_limiter.rate:.2f} req/s)...")
                     else:
                         print(f"❌ Lỗi khác: {e}")
                         raise
             
             if retry_count > max_retries:
                 print(f"❌ Đã retry {max_retries} lần, bỏ qua batch này")
-                continue
-                
-            # Delay dài giữa các batch
-            if i < len(batches) - 1:
-                print(f"⏳ Chờ {delay}s trước batch tiếp theo...")
-                time.sleep(delay)
 
-        print(f"⏰ Tổng thời gian embedding: {total_time:.2f}s")
-        
-        # Tạo hoặc cập nhật vectorstore
+        print(f"⏰ Tổng thời gian embedding: {time.time() - start_total:.2f}s | limiter: {self.rate_limiter.stats()}")
+
+        if not embedded_docs:
+            print("❌ Không embed được document nào, bỏ qua cập nhật vectorstore.")
+            return
+
+        # Dùng lại vector đã tính, không embed lần hai
+        text_embeddings = list(zip([doc.page_content for doc in embedded_docs], all_embeddings))
+        metadatas = [doc.metadata for doc in embedded_docs]
+
         if self.vector_store:
-            self.vector_store.add_documents(documents)
-            print(f"➕ Đã thêm {len(documents)} documents vào vectorstore.")
+            self.vector_store.add_embeddings(text_embeddings, metadatas=metadatas)
+            print(f"➕ Đã thêm {len(embedded_docs)} documents vào vectorstore.")
         else:
-            self.vector_store = FAISS.from_documents(documents, self.embeddings)
-            print(f"🆕 Đã tạo vectorstore mới từ {len(documents)} documents.")
+            self.vector_store = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas)
+            print(f"🆕 Đã tạo vectorstore mới từ {len(embedded_docs)} documents.")
 
         # Lưu vectorstore
         os.makedirs(self.persist_path, exist_ok=True)
@@ -129,35 +133,18 @@ class GeminiFaiss():
 
     def add_documents(self, documents: List[Document]):
         """Wrapper cho add_documents_batch với config mặc định"""
-        self.add_documents_batch(documents, batch_size=5, delay=1.5)
+        self.add_documents_batch(documents)
 
     def add_documents_optimized(self, documents: List[Document], chunk_size: int = 512):
-        """Version tối ưu với text chunking nếu documents quá dài"""
+        """Version tối ưu với chunking theo cấu trúc, chunk_size tính theo token (ước lượng)"""
         if not documents:
             print("❗ Không có document nào để thêm.")
             return
 
-        # Chunk documents dài thành pieces nhỏ hơn
-        chunked_docs = []
-        for doc in documents:
-            if len(doc.page_content) > chunk_size:
-                # Chia document dài thành chunks
-                content = doc.page_content
-                for i in range(0, len(content), chunk_size):
-                    chunk_content = content[i:i + chunk_size]
-                    # Tạo metadata mới cho chunk
-                    chunk_metadata = doc.metadata.copy()
-                    chunk_metadata['chunk_id'] = f"{doc.metadata.get('row_index', 0)}_chunk_{i//chunk_size}"
-                    chunk_metadata['is_chunked'] = True
-                    
-                    chunked_docs.append(Document(
-                        page_content=chunk_content,
-                        metadata=chunk_metadata
-                    ))
-            else:
-                chunked_docs.append(doc)
+        # Gemini embed qua API nên không có tokenizer local, dùng ước lượng ký tự/token
+        chunked_docs = DocumentChunker(max_tokens=chunk_size).split_documents(documents)
         
         print(f"🔄 Đã chunk {len(documents)} docs thành {len(chunked_docs)} pieces")
         
         # Sử dụng batching
-        self.add_documents_batch(chunked_docs, batch_size=8, delay=1.0)
\ No newline at end of file
+        self.add_documents_batch(chunked_docs)
\ No newline at end of file
@@ -0,0 +1,224 @@
+import math
+import os
+from dataclasses import dataclass
+from typing import Optional
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+# cosine = inner product trên vector đã normalize (Qwen3 trả về vector chuẩn hóa sẵn)
+METRICS = {"cosine": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+
+
+@dataclass
+class IndexConfig:
+    """Cấu hình index FAISS, đọc từ biến môi trường FAISS_*"""
+    index_type: str = "flat"
+    metric: str = "cosine"               # cosine (inner product) / l2
+    nlist: Optional[int] = None          # IVF: số cluster (None = tự tính theo số vector)
+    hnsw_m: int = 32                     # HNSW: số neighbor mỗi node
+    ef_construction: int = 200           # HNSW: độ rộng khi build
+    pq_m: int = 64                       # IVF-PQ: số sub-quantizer (dimension phải chia hết)
+    pq_nbits: int = 8                    # IVF-PQ: số bit mỗi code
+    nprobe: int = 16                     # IVF: số cluster quét mỗi query (mặc định)
+    ef_search: int = 64                  # HNSW: độ rộng khi search (mặc định)
+    min_train_vectors: int = 10000       # IVF: số vector tối thiểu để train, ít hơn thì dùng Flat
+
+    @classmethod
+    def from_env(cls) -> "IndexConfig":
+        index_type = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"FAISS_INDEX_TYPE không hợp lệ: {index_type} (hỗ trợ: {', '.join(INDEX_TYPES)})")
+        metric = os.getenv("FAISS_METRIC", "cosine").lower()
+        if metric not in METRICS:
+            raise ValueError(f"FAISS_METRIC không hợp lệ: {metric} (hỗ trợ: {', '.join(METRICS)})")
+        nlist = os.getenv("FAISS_NLIST")
+        return cls(
+            index_type=index_type,
+            metric=metric,
+            nlist=int(nlist) if nlist else None,
+            hnsw_m=int(os.getenv("FAISS_HNSW_M", "32")),
+            ef_construction=int(os.getenv("FAISS_EF_CONSTRUCTION", "200")),
+            pq_m=int(os.getenv("FAISS_PQ_M", "64")),
+            pq_nbits=int(os.getenv("FAISS_PQ_NBITS", "8")),
+            nprobe=int(os.getenv("FAISS_NPROBE", "16")),
+            ef_search=int(os.getenv("FAISS_EF_SEARCH", "64")),
+            min_train_vectors=int(os.getenv("FAISS_MIN_TRAIN_VECTORS", "10000")),
+        )
+
+    @property
+    def needs_training(self) -> bool:
+        return self.index_type in ("ivf_flat", "ivf_pq")
+
+    @property
+    def faiss_metric(self) -> int:
+        return METRICS[self.metric]
+
+
+def metric_name(metric: int) -> str:
+    return "cosine" if metric == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def to_relevance(scores: np.ndarray, metric: int) -> np.ndarray:
+    """
+    Đổi kết quả search về cosine similarity (càng lớn càng liên quan) cho mọi metric:
+    - inner product trên vector đã normalize chính là cosine
+    - L2 của FAISS là bình phương khoảng cách, với vector đơn vị: cos = 1 - d/2
+    """
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        return scores
+    return 1.0 - scores / 2.0
+
+
+def choose_nlist(n_vectors: int) -> int:
+    """Heuristic phổ biến: nlist ~ 4 * sqrt(N)"""
+    return int(min(65536, max(16, 4 * math.sqrt(max(n_vectors, 1)))))
+
+
+def build_index(config: IndexConfig, dim: int, metric: int = faiss.METRIC_L2,
+                train_vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    Tạo index rỗng hỗ trợ add_with_ids / search theo id ngoài:
+    - flat, hnsw: bọc trong IndexIDMap2
+    - ivf_flat, ivf_pq: IVF tự lưu id, direct map dạng hashtable để reconstruct/remove theo id
+    Index IVF được train bằng train_vectors; nếu chưa đủ dữ liệu thì fallback về flat.
+    """
+    index_type = config.index_type
+    if config.needs_training:
+        n_train = 0 if train_vectors is None else len(train_vectors)
+        if n_train < config.min_train_vectors:
+            print(f"⚠️ Chỉ có {n_train} vectors (< {config.min_train_vectors}) để train {index_type}, tạm dùng flat")
+            index_type = "flat"
+
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlat(dim, metric))
+
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, config.hnsw_m, metric)
+        hnsw.hnsw.efConstruction = config.ef_construction
+        hnsw.hnsw.efSearch = config.ef_search
+        return faiss.IndexIDMap2(hnsw)
+
+    nlist = config.nlist or choose_nlist(len(train_vectors))
+    nlist = min(nlist, len(train_vectors))
+    if index_type == "ivf_flat":
+        index = faiss.index_factory(dim, f"IVF{nlist},Flat", metric)
+    else:
+        if dim % config.pq_m != 0:
+            raise ValueError(f"Dimension {dim} không chia hết cho FAISS_PQ_M={config.pq_m}")
+        index = faiss.index_factory(dim, f"IVF{nlist},PQ{config.pq_m}x{config.pq_nbits}", metric)
+
+    print(f"🏋️ Đang train {index_type} (nlist={nlist}) trên {len(train_vectors)} vectors...")
+    index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+    ivf = faiss.extract_index_ivf(index)
+    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    ivf.nprobe = config.nprobe
+    return index
+
+
+def index_kind(index: faiss.Index) -> str:
+    """Xác định loại index đang dùng (flat / hnsw / ivf_flat / ivf_pq / legacy)"""
+    if isinstance(index, (faiss.IndexIDMap2, faiss.IndexIDMap)):
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            return "hnsw"
+        if isinstance(inner, faiss.IndexFlat):
+            return "flat"
+        return type(inner).__name__
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return "ivf_pq" if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else "ivf_flat"
+    return "legacy"
+
+
+def search_parameters(index: faiss.Index, nprobe: Optional[int] = None,
+                      ef_search: Optional[int] = None, selector=None):
+    """Tạo SearchParameters theo loại index để chỉnh nprobe/efSearch cho từng query (thread-safe)"""
+    kind = index_kind(index)
+    if kind in ("ivf_flat", "ivf_pq"):
+        params = faiss.SearchParametersIVF()
+        if nprobe:
+            params.nprobe = nprobe
+        else:
+            params.nprobe = faiss.extract_index_ivf(index).nprobe
+    elif kind == "hnsw":
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search or faiss.downcast_index(index.index).hnsw.efSearch
+    else:
+        if selector is None:
+            return None
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def exclude_selector(faiss_ids: np.ndarray):
+    """Selector bỏ qua các id cho trước khi search (tombstone của HNSW), None nếu không có id nào"""
+    if faiss_ids is None or not len(faiss_ids):
+        return None
+    faiss_ids = np.ascontiguousarray(faiss_ids, dtype=np.int64)
+    return faiss.IDSelectorNot(faiss.IDSelectorBatch(faiss_ids.size, faiss.swig_ptr(faiss_ids)))
+
+
+def include_selector(faiss_ids: np.ndarray):
+    """Selector chỉ search trong các id cho trước (namespace)"""
+    faiss_ids = np.ascontiguousarray(faiss_ids, dtype=np.int64)
+    return faiss.IDSelectorBatch(faiss_ids.size, faiss.swig_ptr(faiss_ids))
+
+
+def search_subset(vectors: np.ndarray, ids: np.ndarray, query: np.ndarray, k: int, metric: int):
+    """
+    Search exact trên một tập vector nhỏ (đã reconstruct), trả về (scores, ids) dạng
+    (1, k) giống index.search để dùng chung phần xử lý kết quả.
+    """
+    query = np.asarray(query, dtype=np.float32).reshape(-1)
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        scores = vectors @ query
+        order = np.argsort(-scores)
+    else:
+        scores = ((vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(scores)
+    order = order[:k]
+    return scores[order][None, :].astype(np.float32), ids[order][None, :]
+
+
+def stored_ids(index: faiss.Index) -> np.ndarray:
+    """Các id đang có trong index bọc IndexIDMap2 (flat / hnsw)"""
+    return faiss.vector_to_array(index.id_map).astype(np.int64)
+
+
+def reconstruct_vectors(index: faiss.Index, ids: np.ndarray, batch_size: int = 4096) -> np.ndarray:
+    """Lấy lại vector đã lưu theo id (dùng để migrate index mà không cần embed lại)"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+    chunks = []
+    for start in range(0, len(ids), batch_size):
+        batch = np.ascontiguousarray(ids[start:start + batch_size], dtype=np.int64)
+        chunks.append(index.reconstruct_batch(batch))
+    if not chunks:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return np.vstack(chunks).astype(np.float32)
+
+
+def migrate_index(old_index: faiss.Index, ids: np.ndarray, config: IndexConfig,
+                  metric: Optional[int] = None, vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    Chuyển index sang loại/metric khác, giữ nguyên id; vectors có thể truyền sẵn (đã reconstruct).
+    Khi chuyển sang inner product, vector được normalize để score là cosine.
+    """
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    if vectors is None:
+        if index_kind(old_index) == "ivf_pq":
+            print("⚠️ Index nguồn là IVF-PQ: vector reconstruct là xấp xỉ (lossy)")
+        vectors = reconstruct_vectors(old_index, ids)
+    metric = old_index.metric_type if metric is None else metric
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        vectors = np.array(vectors, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+    new_index = build_index(config, old_index.d, metric, train_vectors=vectors)
+    if len(ids):
+        new_index.add_with_ids(vectors, ids)
+    return new_index
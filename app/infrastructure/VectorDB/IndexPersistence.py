@@ -0,0 +1,359 @@
+import fcntl
+import json
+import os
+import pickle
+import re
+import shutil
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+import faiss
+import numpy as np
+from infrastructure.VectorDB.IndexFactory import index_kind
+
+
+class FaissPersistence:
+    """
+    Lưu FAISS theo kiểu write-behind, không bao giờ để lại index ghi dở:
+
+      persist_path/
+        CURRENT                   -> tên generation đang dùng (ghi file tạm rồi os.replace)
+        generations/gen-000001/   -> index.faiss + meta.json (snapshot index, không sửa sau khi publish)
+        wal.log                   -> append-only log các batch (faiss_ids, vectors) / (deleted_ids) chưa được compact
+        writer.lock               -> flock giữa các process cùng publish (chế độ mmap)
+        owner.lock                -> flock giữ suốt đời process writer duy nhất (chế độ không mmap)
+        chunks.sqlite             -> nội dung + metadata của chunk (ChunkStore, không thuộc generation)
+
+    - append(): ghi batch mới (faiss_ids, vectors) vào wal.log + fsync
+    - append_deletion(): ghi các faiss_id đã xóa vào wal.log + fsync
+    - publish(): ghi index thành generation mới, đổi CURRENT, bỏ phần wal.log đã nằm trong snapshot
+    - publish_serialized(): như publish() với index đã serialize sẵn (snapshot chụp dưới lock của caller)
+    - load_index(): đọc index của generation hiện tại (có thể mmap chỉ đọc)
+    - replay(): áp dụng lại wal.log lên index vừa load
+
+    meta.json lưu next_faiss_id tại thời điểm publish; faiss_id tăng dần nên khi replay
+    sẽ bỏ qua record có id < next_faiss_id (đã nằm trong snapshot, ví dụ crash giữa lúc
+    đổi CURRENT và cắt WAL). Record xóa luôn được áp dụng lại (xóa id không còn trong index là no-op).
+    """
+
+    GENERATION_PATTERN = re.compile(r"^gen-(\d+)$")
+    KEEP_GENERATIONS = 2
+
+    def __init__(self, persist_path: str):
+        self.persist_path = persist_path
+        self.generations_dir = os.path.join(persist_path, "generations")
+        self.current_file = os.path.join(persist_path, "CURRENT")
+        self.wal_file = os.path.join(persist_path, "wal.log")
+        self.writer_lock_file = os.path.join(persist_path, "writer.lock")
+        self.owner_lock_file = os.path.join(persist_path, "owner.lock")
+        self.owner_fd = None
+        # lock: WAL (append / cắt); publish_lock: chỉ một generation được ghi tại một thời điểm.
+        # Ghi + fsync generation chỉ giữ publish_lock nên append WAL không bị chặn.
+        self.lock = threading.Lock()
+        self.publish_lock = threading.Lock()
+
+    # ---------- generation ----------
+    def current_generation(self) -> Optional[str]:
+        try:
+            with open(self.current_file, "r", encoding="utf-8") as f:
+                name = f.read().strip()
+            return name or None
+        except FileNotFoundError:
+            return None
+
+    def current_generation_dir(self) -> Optional[str]:
+        name = self.current_generation()
+        if name:
+            return os.path.join(self.generations_dir, name)
+        # Layout cũ: index.faiss nằm trực tiếp trong persist_path
+        if os.path.exists(os.path.join(self.persist_path, "index.faiss")):
+            return self.persist_path
+        return None
+
+    def _next_generation_name(self) -> str:
+        numbers = [0]
+        if os.path.isdir(self.generations_dir):
+            for name in os.listdir(self.generations_dir):
+                match = self.GENERATION_PATTERN.match(name)
+                if match:
+                    numbers.append(int(match.group(1)))
+        return f"gen-{max(numbers) + 1:06d}"
+
+    @staticmethod
+    def _fsync_dir(path: str):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _prune_generations(self, keep: str):
+        names = sorted(
+            name for name in os.listdir(self.generations_dir)
+            if self.GENERATION_PATTERN.match(name)
+        )
+        for name in names[:-self.KEEP_GENERATIONS]:
+            if name != keep:
+                shutil.rmtree(os.path.join(self.generations_dir, name), ignore_errors=True)
+        # Dọn các thư mục tạm còn sót lại do crash
+        for name in os.listdir(self.generations_dir):
+            if name.endswith(".tmp"):
+                shutil.rmtree(os.path.join(self.generations_dir, name), ignore_errors=True)
+
+    # ---------- load ----------
+    def load_index(self, mmap: bool = False) -> Tuple[Optional[faiss.Index], dict]:
+        """
+        Đọc index của generation hiện tại (chưa replay WAL), trả về (index, meta).
+        mmap=True: mmap chỉ đọc (xem mmap_flags) để các worker dùng chung page cache thay vì mỗi
+        worker một bản copy của index trong RAM.
+        Generation cũ (index.pkl, chưa có meta.json) trả thêm meta["legacy_docstore"] =
+        (docstore, index_to_docstore_id) để import sang chunk store.
+        """
+        generation_dir = self.current_generation_dir()
+        if not generation_dir:
+            print(f"⚠️ Chưa có vectorstore tại: {self.persist_path}. Sẽ tạo mới sau.")
+            return None, {}
+
+        index_file = os.path.join(generation_dir, "index.faiss")
+        meta_file = os.path.join(generation_dir, "meta.json")
+        legacy_file = os.path.join(generation_dir, "index.pkl")
+
+        meta = {}
+        if os.path.exists(meta_file):
+            with open(meta_file, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        elif os.path.exists(legacy_file):
+            with open(legacy_file, "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            meta["legacy_docstore"] = (docstore, index_to_docstore_id)
+            meta["next_faiss_id"] = max(index_to_docstore_id.keys(), default=-1) + 1
+
+        if mmap:
+            index = faiss.read_index(index_file, self.mmap_flags(index_file))
+            if index_kind(index) == "legacy":
+                # Index legacy phải chuyển sang dạng có id trong RAM, không mmap được
+                index = faiss.read_index(index_file)
+        else:
+            index = faiss.read_index(index_file)
+        meta.setdefault("next_faiss_id", index.ntotal)
+
+        print(f"✅ Đã load index từ: {generation_dir} ({index.ntotal} vectors{', mmap' if mmap else ''})")
+        return index, meta
+
+    @staticmethod
+    def mmap_flags(index_file: str) -> int:
+        """
+        IO_FLAG_MMAP chỉ mmap inverted lists của IVF; codes của IndexFlat (flat, storage của HNSW,
+        bọc trong IDMap2) chỉ được mmap với IO_FLAG_MMAP_IFC. Chọn theo fourcc đầu file: "Iw.." = IVF.
+        """
+        with open(index_file, "rb") as f:
+            fourcc = f.read(4)
+        if fourcc.startswith(b"Iw"):
+            return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        mmap_ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        if mmap_ifc is None:
+            print("⚠️ FAISS quá cũ, không có IO_FLAG_MMAP_IFC: index flat/HNSW sẽ được copy vào RAM mỗi worker")
+            return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        return mmap_ifc | faiss.IO_FLAG_READ_ONLY
+
+    @contextmanager
+    def writer_lock(self):
+        """Khóa liên process (flock) để chỉ một worker publish generation tại một thời điểm"""
+        os.makedirs(self.persist_path, exist_ok=True)
+        with open(self.writer_lock_file, "a+") as lock_fd:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+    def try_acquire_owner(self) -> bool:
+        """
+        Chế độ không mmap: index trong RAM, WAL và cấp faiss_id là của riêng một process, nên chỉ
+        process giữ owner.lock (flock, không chờ) được ghi; các process khác chỉ đọc generation đã
+        publish. Lock được giữ tới khi process thoát (kể cả crash, kernel tự nhả).
+        """
+        if self.owner_fd is not None:
+            return True
+        os.makedirs(self.persist_path, exist_ok=True)
+        fd = open(self.owner_lock_file, "a+")
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fd.close()
+            return False
+        self.owner_fd = fd
+        return True
+
+    def replay(self, apply_fn: Callable[[np.ndarray, np.ndarray], None], next_faiss_id: int,
+               legacy_fn: Optional[Callable[[List[str], List[str], np.ndarray, List[dict]], None]] = None,
+               delete_fn: Optional[Callable[[np.ndarray], None]] = None) -> int:
+        """
+        Áp dụng lại các batch trong WAL chưa có trong snapshot (faiss_id >= next_faiss_id),
+        trả về số vectors đã replay. Record kiểu cũ (ids, texts, vectors, metadatas, trước khi
+        có chunk store) được chuyển cho legacy_fn, record xóa (deleted_ids) cho delete_fn.
+        """
+        records = self.read_wal()
+        if not records:
+            return 0
+
+        replayed = 0
+        for record in records:
+            if "deleted_ids" in record:
+                if delete_fn is not None:
+                    delete_fn(np.asarray(record["deleted_ids"], dtype=np.int64))
+                    replayed += len(record["deleted_ids"])
+                continue
+            if "faiss_ids" not in record:
+                if legacy_fn is not None:
+                    legacy_fn(record["ids"], record["texts"], np.asarray(record["vectors"], dtype=np.float32),
+                              record["metadatas"])
+                    replayed += len(record["ids"])
+                continue
+            faiss_ids = np.asarray(record["faiss_ids"], dtype=np.int64)
+            keep = faiss_ids >= next_faiss_id
+            if not keep.any():
+                continue
+            apply_fn(faiss_ids[keep], np.asarray(record["vectors"], dtype=np.float32)[keep])
+            replayed += int(keep.sum())
+
+        print(f"🔁 Đã replay {replayed} documents từ WAL ({len(records)} batches)")
+        return replayed
+
+    # ---------- WAL ----------
+    def append(self, faiss_ids: np.ndarray, vectors: np.ndarray):
+        """Ghi một batch vào WAL (length-prefixed pickle) và fsync trước khi trả về"""
+        self._append_record({
+            "faiss_ids": np.asarray(faiss_ids, dtype=np.int64),
+            "vectors": np.asarray(vectors, dtype=np.float32),
+        })
+
+    def append_deletion(self, faiss_ids: np.ndarray):
+        self._append_record({"deleted_ids": np.asarray(faiss_ids, dtype=np.int64)})
+
+    def _append_record(self, record: dict):
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            os.makedirs(self.persist_path, exist_ok=True)
+            with open(self.wal_file, "ab") as f:
+                f.write(struct.pack("<Q", len(payload)))
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def wal_size(self) -> int:
+        """Vị trí cuối WAL hiện tại (offset snapshot dùng cho publish_serialized)"""
+        with self.lock:
+            try:
+                return os.path.getsize(self.wal_file)
+            except FileNotFoundError:
+                return 0
+
+    def _truncate_wal(self, offset: Optional[int]):
+        """
+        Bỏ các record trước offset (đã nằm trong snapshot), giữ lại record ghi sau snapshot.
+        Phần còn lại được chép sang file tạm + fsync rồi os.replace (crash giữa chừng thì WAL cũ
+        còn nguyên, record trùng với snapshot bị replay bỏ qua). offset=None: xóa cả WAL.
+        """
+        with self.lock:
+            if not os.path.exists(self.wal_file):
+                return
+            size = os.path.getsize(self.wal_file)
+            if offset is None or offset >= size:
+                os.remove(self.wal_file)
+                return
+            if offset <= 0:
+                return
+            tmp_file = self.wal_file + ".tmp"
+            with open(self.wal_file, "rb") as src, open(tmp_file, "wb") as dst:
+                src.seek(offset)
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_file, self.wal_file)
+            self._fsync_dir(self.persist_path)
+
+    def read_wal(self) -> List[dict]:
+        records = []
+        if not os.path.exists(self.wal_file):
+            return records
+
+        valid_size = 0
+        with open(self.wal_file, "rb") as f:
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    break
+                (size,) = struct.unpack("<Q", header)
+                payload = f.read(size)
+                if len(payload) < size:
+                    break
+                try:
+                    records.append(pickle.loads(payload))
+                except Exception:
+                    break
+                valid_size = f.tell()
+
+        # Record cuối bị ghi dở (crash giữa chừng) -> cắt bỏ
+        if valid_size < os.path.getsize(self.wal_file):
+            print(f"⚠️ WAL có record ghi dở, cắt về {valid_size} bytes")
+            with open(self.wal_file, "r+b") as f:
+                f.truncate(valid_size)
+        return records
+
+    # ---------- compaction ----------
+    def publish(self, index: faiss.Index, next_faiss_id: int) -> str:
+        """Ghi index thành generation mới rồi đổi CURRENT một cách atomic (index chứa cả WAL)"""
+        def writer(tmp_dir: str):
+            faiss.write_index(index, os.path.join(tmp_dir, "index.faiss"))
+            self._write_meta(tmp_dir, next_faiss_id, index.ntotal)
+        return self.publish_with(writer)
+
+    def publish_serialized(self, data: np.ndarray, next_faiss_id: int, ntotal: int, wal_offset: int) -> str:
+        """
+        Publish index đã faiss.serialize_index; chỉ cắt WAL tới wal_offset (vị trí lúc chụp
+        snapshot), các batch append trong lúc đang ghi generation vẫn còn trong WAL.
+        """
+        def writer(tmp_dir: str):
+            with open(os.path.join(tmp_dir, "index.faiss"), "wb") as f:
+                f.write(memoryview(data))
+            self._write_meta(tmp_dir, next_faiss_id, ntotal)
+        return self.publish_with(writer, wal_offset=wal_offset)
+
+    @staticmethod
+    def _write_meta(tmp_dir: str, next_faiss_id: int, ntotal: int):
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"next_faiss_id": int(next_faiss_id), "ntotal": int(ntotal)}, f)
+
+    def publish_with(self, writer: Callable[[str], None], wal_offset: Optional[int] = None) -> str:
+        """
+        writer(tmp_dir) ghi đầy đủ nội dung generation; sau đó rename + đổi CURRENT + cắt WAL
+        tới wal_offset (None = snapshot chứa mọi thứ trong WAL, xóa luôn).
+        """
+        with self.publish_lock:
+            os.makedirs(self.generations_dir, exist_ok=True)
+            name = self._next_generation_name()
+            tmp_dir = os.path.join(self.generations_dir, name + ".tmp")
+            final_dir = os.path.join(self.generations_dir, name)
+
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            writer(tmp_dir)
+            for file_name in os.listdir(tmp_dir):
+                with open(os.path.join(tmp_dir, file_name), "rb") as f:
+                    os.fsync(f.fileno())
+            os.rename(tmp_dir, final_dir)
+            self._fsync_dir(self.generations_dir)
+
+            tmp_current = self.current_file + ".tmp"
+            with open(tmp_current, "w", encoding="utf-8") as f:
+                f.write(name)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_current, self.current_file)
+            self._fsync_dir(self.persist_path)
+
+            self._truncate_wal(wal_offset)
+            self._prune_generations(keep=name)
+            return name
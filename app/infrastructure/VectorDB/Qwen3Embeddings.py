@@ -0,0 +1,72 @@
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+from langchain_core.embeddings import Embeddings
+
+QWEN3_MODEL_NAME = "Qwen/Qwen3-Embedding-0.6B"
+
+_models: Dict[tuple, object] = {}
+_models_lock = threading.Lock()
+
+
+def get_shared_model(model_name: str = QWEN3_MODEL_NAME, device: Optional[str] = None):
+    """Load SentenceTransformer một lần cho mỗi (model, device) trong process"""
+    from sentence_transformers import SentenceTransformer
+
+    device = device or os.getenv("EMBEDDING_DEVICE", "cpu")  # Dùng 'cuda' nếu có GPU
+    key = (model_name, device)
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            print(f"🔄 Đang load {model_name} ({device})...")
+            model = SentenceTransformer(
+                model_name,
+                trust_remote_code=True,  # Cần thiết cho Qwen models
+                device=device,
+            )
+            _models[key] = model
+            print(f"✅ Đã load {model_name}!")
+        return model
+
+
+class Qwen3Embeddings(Embeddings):
+    """
+    Facade embedding dùng chung một model Qwen3 cho cả process.
+    Instruction được ghép vào đầu text theo từng request (instruction=...),
+    nên đổi instruction không cần load lại model.
+    """
+
+    def __init__(self, model_name: str = QWEN3_MODEL_NAME, instruction: Optional[str] = None,
+                 device: Optional[str] = None, batch_size: int = 32):
+        self.model_name = model_name
+        self.instruction = instruction
+        self.batch_size = batch_size
+        self.model = get_shared_model(model_name, device)
+        self.tokenizer_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str], instruction: Optional[str] = None) -> List[List[float]]:
+        instruction = self.instruction if instruction is None else instruction
+        if instruction:
+            texts = [f"{instruction}{text}" for text in texts]
+
+        embeddings = self.model.encode(
+            texts,
+            normalize_embeddings=True,
+            batch_size=self.batch_size,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+        )
+        return embeddings.tolist()
+
+    def count_tokens(self, texts: Sequence[str]) -> List[int]:
+        """Số token của từng text theo tokenizer của model (không tính instruction)"""
+        if not texts:
+            return []
+        # Tokenizer (Rust) không cho dùng đồng thời từ nhiều thread
+        with self.tokenizer_lock:
+            encoded = self.model.tokenizer(list(texts), add_special_tokens=False,
+                                           return_attention_mask=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def embed_query(self, text: str, instruction: Optional[str] = None) -> List[float]:
+        return self.embed_documents([text], instruction=instruction)[0]
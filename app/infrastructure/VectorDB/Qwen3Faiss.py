@@ -1,89 +1,443 @@
 import os
+import faiss
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
 from core.interface.IQwen3Faiss import IQwen3Faiss
-from typing import List
+from infrastructure.VectorDB.ChunkStore import CHUNK_STORE_FILE, ChunkStore, make_doc_id
+from infrastructure.VectorDB.DocumentChunker import DocumentChunker
+from infrastructure.VectorDB.EmbeddingCache import EmbeddingCache
+from infrastructure.VectorDB.Qwen3Embeddings import Qwen3Embeddings, QWEN3_MODEL_NAME
+from infrastructure.VectorDB.IndexPersistence import FaissPersistence
+from infrastructure.VectorDB.IndexFactory import (
+    IndexConfig, build_index, exclude_selector, include_selector, index_kind, metric_name, migrate_index,
+    reconstruct_vectors, search_parameters, search_subset, stored_ids, to_relevance
+)
+from utils.lruCache import LRUCache
+from typing import Callable, List, Optional
 from dotenv import load_dotenv
+import numpy as np
+import atexit
+import threading
 import time
+import unicodedata
 
 load_dotenv()
 
+# Cache key của câu hỏi trên disk tách khỏi key của document (key là bản normalize, vector là của câu gốc)
+QUERY_KEY_PREFIX = "query:"
+
 class Qwen3Faiss(IQwen3Faiss):
     def __init__(self):
         self.persist_path = os.getenv("PERSIST_PATH")
+        self.model_name = QWEN3_MODEL_NAME
+        self.document_instruction = 'Represent this document for retrieval: '
         
-        # Sử dụng Qwen3-Embedding-0.6B - SOTA model
-        print("🔄 Đang load Qwen3-Embedding-0.6B model...")
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="Qwen/Qwen3-Embedding-0.6B",
-            model_kwargs={
-                'device': 'cpu',  # Dùng 'cuda' nếu có GPU
-                'trust_remote_code': True,  # Cần thiết cho Qwen models
-            },
-            encode_kwargs={
-                'normalize_embeddings': True,
-                'batch_size': 32,  # Tăng batch size vì model mạnh
-                # Có thể thêm instruction để tăng 1-5% performance
-                'instruction': 'Represent this document for retrieval: '
-            }
+        # Sử dụng Qwen3-Embedding-0.6B - SOTA model, một instance dùng chung cho mọi instruction
+        self.embeddings = Qwen3Embeddings(
+            model_name=self.model_name,
+            instruction=self.document_instruction,
+            batch_size=32,  # Tăng batch size vì model mạnh
         )
-        print("✅ Đã load Qwen3-Embedding-0.6B model!")
-        
-        vector_store = None
-        index_file = os.path.join(self.persist_path, "index.faiss")
 
-        if os.path.exists(index_file):
+        # Chunk theo cấu trúc + số token của tokenizer Qwen3 (CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS)
+        self.chunker = DocumentChunker(count_tokens=self.embeddings.count_tokens)
+
+        # Cache embedding trên disk theo (model, instruction, sha256(text))
+        self.embedding_cache = None
+        if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true":
+            self.embedding_cache = EmbeddingCache(
+                os.getenv("EMBEDDING_CACHE_DIR", os.path.join(self.persist_path, "embedding_cache")),
+                max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000")),
+            )
+            atexit.register(self.embedding_cache.flush)
+
+        # LRU in-process cho embedding của câu hỏi (normalized query -> vector float32)
+        query_cache_ttl = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+        self.query_cache = LRUCache(
+            max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2048")),
+            max_bytes=int(os.getenv("QUERY_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+            ttl=query_cache_ttl if query_cache_ttl > 0 else None,
+            sizeof=lambda vector: vector.nbytes,
+        )
+
+        # Persistence: "write_behind" (WAL + compaction định kỳ) hoặc "sync" (snapshot sau mỗi lần thêm)
+        self.persistence = FaissPersistence(self.persist_path)
+        self.persist_mode = os.getenv("FAISS_PERSIST_MODE", "write_behind").lower()
+        self.flush_max_pending = int(os.getenv("FAISS_FLUSH_MAX_PENDING", "5000"))
+        self.flush_interval = float(os.getenv("FAISS_FLUSH_INTERVAL", "60"))
+        self.pending_count = 0
+        self.lock = threading.RLock()
+        # Chỉ một lần compact tại một thời điểm (luôn lấy trước self.lock, không bao giờ lấy khi đang giữ self.lock)
+        self.save_lock = threading.Lock()
+
+        # Chế độ mmap (FAISS_MMAP): index mở chỉ đọc, các worker gunicorn dùng chung page cache.
+        # Ghi = publish generation mới ngay (dưới writer lock), các worker khác tự reload khi CURRENT đổi.
+        self.mmap_mode = os.getenv("FAISS_MMAP", "false").lower() == "true"
+        self.mmap_size = int(os.getenv("FAISS_DOCSTORE_MMAP_SIZE", str(1 << 30)))
+        self.reload_interval = float(os.getenv("FAISS_RELOAD_INTERVAL", "5"))
+        self.loaded_generation = None
+        if self.mmap_mode:
+            self.persist_mode = "sync"  # WAL là riêng từng process, worker khác không thấy được
+        # Không mmap: chunks.sqlite / wal.log / faiss_id dùng chung PERSIST_PATH nhưng index nằm trong RAM
+        # từng process -> chỉ một process (giữ owner.lock) được ghi, các worker khác chỉ đọc generation
+        # đã publish và reload khi CURRENT đổi (như chế độ mmap)
+        self.read_only = not self.mmap_mode and not self.persistence.try_acquire_owner()
+        if self.read_only:
+            print("ℹ️ Process khác đang giữ quyền ghi vector store, process này chỉ đọc")
+
+        # Index: flat / ivf_flat / hnsw / ivf_pq (FAISS_INDEX_TYPE), id FAISS ánh xạ tới docstore id
+        self.index_config = IndexConfig.from_env()
+        # Metric cho index mới (FAISS_METRIC); index cũ giữ metric riêng tới lần compact kế tiếp
+        self.metric = self.index_config.faiss_metric
+        self.next_faiss_id = 0
+
+        # HNSW không hỗ trợ remove_ids: id đã xóa thành tombstone (bị loại khi search),
+        # index được build lại khi số tombstone vượt FAISS_TOMBSTONE_REBUILD_RATIO * ntotal
+        self.tombstones = np.zeros(0, dtype=np.int64)
+        self.tombstone_selector = None
+        self.tombstone_rebuild_ratio = float(os.getenv("FAISS_TOMBSTONE_REBUILD_RATIO", "0.1"))
+
+        # Namespace (user/tenant): search chỉ trên chunk của namespace (+ dữ liệu dùng chung nếu bật).
+        # Namespace nhỏ: reconstruct vector rồi search exact bằng numpy; lớn: IDSelectorBatch trên index.
+        # Cache (ids, vectors | selector) theo namespace, xóa khi index thay đổi.
+        self.namespace_include_shared = os.getenv("FAISS_NAMESPACE_INCLUDE_SHARED", "true").lower() == "true"
+        self.namespace_brute_force_max = int(os.getenv("FAISS_NAMESPACE_BRUTE_FORCE_MAX", "4096"))
+        self.namespace_cache = LRUCache(
+            max_entries=int(os.getenv("FAISS_NAMESPACE_CACHE_ENTRIES", "256")),
+            max_bytes=int(os.getenv("FAISS_NAMESPACE_CACHE_BYTES", str(256 * 1024 * 1024))),
+            sizeof=lambda entry: entry[0].nbytes + (entry[1].nbytes if entry[1] is not None else entry[0].nbytes),
+        )
+
+        # Ngưỡng relevance (cosine) mặc định khi search, loại bớt chunk ít liên quan
+        self.score_threshold = float(os.getenv("RETRIEVAL_SCORE_THRESHOLD", "0.0"))
+
+        # Nội dung + metadata chunk nằm trong SQLite, chỉ đọc các chunk thuộc top-k
+        self.chunk_store = ChunkStore(os.path.join(self.persist_path, CHUNK_STORE_FILE), mmap_size=self.mmap_size)
+
+        self.vector_store = None
+        self._load_vectorstore()
+
+        if self.persist_mode == "write_behind" and not self.read_only:
+            self._stop_flusher = threading.Event()
+            threading.Thread(target=self._flush_loop, name="faiss-flusher", daemon=True).start()
+            atexit.register(self.flush)
+
+        if self.mmap_mode or self.read_only:
+            self._stop_reloader = threading.Event()
+            threading.Thread(target=self._reload_loop, name="faiss-reloader", daemon=True).start()
+
+    def _load_vectorstore(self):
+        """Load index, chuyển index/docstore legacy sang dạng mới, rồi replay WAL"""
+        if self.mmap_mode or self.read_only:
+            self._load_shared()
+            return
+        try:
+            self.loaded_generation = self.persistence.current_generation()
+            index, meta = self.persistence.load_index()
+            self._import_legacy_docstore(meta)
+            self.vector_store = self._wrap(self._ensure_id_index(index)) if index is not None else None
+            self.next_faiss_id = meta.get("next_faiss_id", 0)
+
+            # Vectors replay từ WAL chưa nằm trong snapshot
+            self.pending_count = self.persistence.replay(
+                self._add_vectors, self.next_faiss_id, legacy_fn=self._replay_legacy,
+                delete_fn=self._remove_vectors,
+            )
+            # Chunk đã ghi nhưng vector chưa kịp vào WAL (crash giữa chừng)
+            orphans = self.chunk_store.delete_from(self.next_faiss_id)
+            if orphans:
+                print(f"🧹 Đã xóa {orphans} chunk không có vector")
+            self._load_tombstones()
+        except Exception as e:
+            print(f"❌ Lỗi khi load vectorstore: {e}")
+            self.vector_store = None
+
+    def _load_shared(self):
+        """Mở index của generation hiện tại ở chế độ mmap chỉ đọc (chế độ mmap, hoặc process không giữ quyền ghi)"""
+        try:
+            generation = self.persistence.current_generation()
+            index, meta = self.persistence.load_index(mmap=True)
+            if "legacy_docstore" in meta and not self.read_only:
+                with self.persistence.writer_lock():
+                    self._import_legacy_docstore(meta)
+            with self.lock:
+                self.vector_store = self._wrap(self._ensure_id_index(index)) if index is not None else None
+                self.next_faiss_id = meta.get("next_faiss_id", 0)
+                self.loaded_generation = generation
+                self._load_tombstones()
+                self._invalidate_search_caches()
+        except Exception as e:
+            print(f"❌ Lỗi khi mmap vectorstore: {e}")
+
+    def _reload_loop(self):
+        """Theo dõi file CURRENT, khi writer publish generation mới thì mmap lại"""
+        while not self._stop_reloader.wait(self.reload_interval):
+            generation = self.persistence.current_generation()
+            if generation and generation != self.loaded_generation:
+                print(f"🔁 Phát hiện generation mới {generation}, đang reload...")
+                self._load_shared()
+
+    def _publish_shared(self, apply_fn: Callable[[], None]) -> bool:
+        """
+        Chế độ mmap: dưới writer lock, load bản ghi được của generation mới nhất, áp dụng
+        thay đổi (apply_fn: thêm / xóa), publish generation mới rồi mmap lại (caller giữ self.lock).
+        """
+        with self.persistence.writer_lock():
+            reader = (self.vector_store, self.tombstones, self.tombstone_selector)
+            index, meta = self.persistence.load_index()
+            self._import_legacy_docstore(meta)
+            self.vector_store = self._wrap(self._ensure_id_index(index)) if index is not None else None
+            self.next_faiss_id = meta.get("next_faiss_id", 0)
             try:
-                vector_store = FAISS.load_local(
-                    self.persist_path,
-                    self.embeddings,
-                    allow_dangerous_deserialization=True
-                ) 
-                print(f"✅ Đã load vectorstore từ: {self.persist_path}")
-            except Exception as e:
-                print(f"❌ Lỗi khi load vectorstore: {e}")
-                vector_store = None
-        else:
-            print(f"⚠️ Chưa có vectorstore tại: {self.persist_path}. Sẽ tạo mới sau.")
+                self.chunk_store.delete_from(self.next_faiss_id)
+                self._load_tombstones()
+                apply_fn()
+                if self.vector_store is not None:
+                    self._maybe_upgrade_index()
+                    generation = self.persistence.publish(self.vector_store.index, self.next_faiss_id)
+                    print(f"💾 Đã publish {generation} ({self.vector_store.index.ntotal} vectors)")
+            finally:
+                self.vector_store, self.tombstones, self.tombstone_selector = reader
+        self._load_shared()
+        return True
+
+    def _wrap(self, index: faiss.Index) -> FAISS:
+        """Bọc index trong FAISS của LangChain, docstore là chunk store (không giữ Document trong RAM)"""
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=self.chunk_store,
+            index_to_docstore_id=self.chunk_store.id_map(),
+        )
+
+    def _import_legacy_docstore(self, meta: dict):
+        """Generation cũ có index.pkl: chuyển InMemoryDocstore sang chunk store (một lần)"""
+        legacy = meta.pop("legacy_docstore", None)
+        if legacy is None:
+            return
+        docstore, index_to_docstore_id = legacy
+        if self.chunk_store.max_faiss_id() >= 0:
+            return
+        start_time = time.time()
+        imported = self.chunk_store.import_docstore(docstore, index_to_docstore_id)
+        print(f"📦 Đã chuyển {imported} documents từ index.pkl sang chunk store trong {time.time() - start_time:.2f}s")
+
+    def _replay_legacy(self, ids: List[str], texts: List[str], vectors: np.ndarray, metadatas: List[dict]):
+        """Record WAL kiểu cũ (chưa có chunk store): documents đã có trong snapshot được bỏ qua"""
+        self._insert_documents(ids, texts, vectors, metadatas)
+
+    @staticmethod
+    def _ensure_id_index(index: faiss.Index) -> faiss.Index:
+        """Index cũ (IndexFlatL2 đánh số theo vị trí) được bọc lại để hỗ trợ add_with_ids"""
+        if index_kind(index) != "legacy":
+            return index
+        ntotal = index.ntotal
+        index = migrate_index(index, np.arange(ntotal, dtype=np.int64), IndexConfig(index_type="flat"))
+        print(f"🔄 Đã chuyển index legacy ({ntotal} vectors) sang IndexIDMap2")
+        return index
+
+    def _needs_upgrade(self) -> bool:
+        """
+        Cần đổi loại index / metric theo cấu hình (ví dụ flat -> ivf khi đã đủ vector để train,
+        hoặc index L2 cũ -> cosine), hoặc HNSW có quá nhiều tombstone (caller giữ self.lock).
+        """
+        index = self.vector_store.index
+        same_kind = index_kind(index) == self.index_config.index_type
+        same_metric = index.metric_type == self.metric
+        # Quá nhiều tombstone (HNSW): build lại chỉ với các chunk còn lại
+        purge = len(self.tombstones) > 0 and len(self.tombstones) >= self.tombstone_rebuild_ratio * index.ntotal
+        if same_kind and same_metric and not purge:
+            return False
+        if (same_metric and not purge and self.index_config.needs_training
+                and index.ntotal < self.index_config.min_train_vectors):
+            return False
+        return True
+
+    def _maybe_upgrade_index(self):
+        """Migrate index ngay tại chỗ (chế độ mmap: index là bản ghi được riêng của _publish_shared)"""
+        if not self._needs_upgrade():
+            return
+        start_time = time.time()
+        ids = np.array(self.chunk_store.faiss_ids(below=self.next_faiss_id), dtype=np.int64)
+        self.vector_store.index = migrate_index(self.vector_store.index, ids, self.index_config, metric=self.metric)
+        self._set_tombstones(np.zeros(0, dtype=np.int64))
+        self._invalidate_search_caches()
+        print(f"🔄 Đã chuyển index sang {index_kind(self.vector_store.index)} "
+              f"({metric_name(self.metric)}) trong {time.time() - start_time:.2f}s")
+
+    def _upgrade_outside_lock(self) -> bool:
+        """
+        Migrate index mà không giữ self.lock trong lúc train / build: dưới lock chỉ reconstruct
+        vector của các chunk hiện có, build index mới ngoài lock, rồi dưới lock bù các thay đổi
+        xảy ra trong lúc build (chunk thêm mới / đã xóa, theo chunk store) trước khi thay index.
+        """
+        with self.lock:
+            if self.vector_store is None or not self._needs_upgrade():
+                return False
+            index = self.vector_store.index
+            if index_kind(index) == "ivf_pq":
+                print("⚠️ Index nguồn là IVF-PQ: vector reconstruct là xấp xỉ (lossy)")
+            snapshot_next = self.next_faiss_id
+            ids = np.array(self.chunk_store.faiss_ids(below=snapshot_next), dtype=np.int64)
+            vectors = reconstruct_vectors(index, ids)
+            dim = index.d
 
-        self.vector_store = vector_store
+        start_time = time.time()
+        if self.metric == faiss.METRIC_INNER_PRODUCT:
+            faiss.normalize_L2(vectors)
+        new_index = build_index(self.index_config, dim, self.metric, train_vectors=vectors)
+        if len(ids):
+            new_index.add_with_ids(vectors, ids)
+        del vectors
+
+        with self.lock:
+            live_ids = np.array(self.chunk_store.faiss_ids(below=self.next_faiss_id), dtype=np.int64)
+            added = live_ids[live_ids >= snapshot_next]
+            if len(added):
+                added_vectors = reconstruct_vectors(self.vector_store.index, added)
+                if self.metric == faiss.METRIC_INNER_PRODUCT:
+                    faiss.normalize_L2(added_vectors)
+                new_index.add_with_ids(added_vectors, added)
+            removed = np.setdiff1d(ids, live_ids)
+            if len(removed) and index_kind(new_index) != "hnsw":
+                new_index.remove_ids(np.ascontiguousarray(removed, dtype=np.int64))
+            self.vector_store.index = new_index
+            # HNSW: id đã xóa trong lúc build thành tombstone
+            self._load_tombstones()
+            self._invalidate_search_caches()
+        print(f"🔄 Đã chuyển index sang {index_kind(new_index)} ({metric_name(self.metric)}) trong "
+              f"{time.time() - start_time:.2f}s (bù {len(added)} chunk thêm, {len(removed)} chunk xóa)")
+        return True
 
     def save_vectorstore(self) -> bool:
-        """Lưu vectorstore vào persist_path"""
+        """
+        Compact vectorstore thành generation mới (ghi atomic). Dưới self.lock chỉ chụp snapshot:
+        serialize index + next_faiss_id + vị trí cuối WAL; ghi / fsync / publish chạy ngoài lock nên
+        add và search không bị chặn. WAL chỉ bị cắt tới vị trí snapshot, batch ghi sau đó vẫn còn.
+        Không gọi khi đang giữ self.lock.
+        """
+        if self.mmap_mode or self.read_only:
+            # Mọi thay đổi đã được publish ngay trong _publish_shared / process chỉ đọc không có gì để lưu
+            return True
+
         print(f"💾 Đang lưu vectorstore vào: {self.persist_path}")
         try:
-            if self.vector_store:
-                os.makedirs(self.persist_path, exist_ok=True)
-                self.vector_store.save_local(self.persist_path)
-                print(f"💾 Đã lưu vectorstore vào: {self.persist_path}")
+            with self.save_lock:
+                self._upgrade_outside_lock()
+                with self.lock:
+                    if not self.vector_store:
+                        print("❌ Không có vectorstore để lưu!")
+                        return False
+                    data = faiss.serialize_index(self.vector_store.index)
+                    ntotal = self.vector_store.index.ntotal
+                    next_faiss_id = self.next_faiss_id
+                    wal_offset = self.persistence.wal_size()
+                    pending = self.pending_count
+
+                generation = self.persistence.publish_serialized(data, next_faiss_id, ntotal, wal_offset)
+                with self.lock:
+                    self.pending_count = max(0, self.pending_count - pending)
+                    self.loaded_generation = generation
+                print(f"💾 Đã lưu vectorstore vào: {self.persist_path} ({generation}, {ntotal} vectors)")
                 return True
-            else:
-                print("❌ Không có vectorstore để lưu!")
-                return False
         except Exception as e:
             print(f"❌ Lỗi khi lưu vectorstore: {e}")
             return False
+
+    def flush(self) -> bool:
+        """Compact nếu còn documents chỉ nằm trong WAL"""
+        if self.pending_count:
+            return self.save_vectorstore()
+        return True
+
+    def _flush_loop(self):
+        while not self._stop_flusher.wait(self.flush_interval):
+            self.flush()
     
-    def add_documents(self, documents: List[Document]) -> bool:
+    def add_documents(self, documents: List[Document], ingest_id: Optional[str] = None,
+                      namespace: Optional[str] = None) -> bool:
         """Thêm documents với Qwen3 - NHANH và CHẤT LƯỢNG CAO"""
+        return self._add_documents(documents, self.document_instruction, self.embeddings.embed_documents,
+                                   ingest_id=ingest_id, namespace=namespace)
+
+    def add_documents_with_custom_instruction(self, documents: List[Document], instruction: str,
+                                              ingest_id: Optional[str] = None,
+                                              namespace: Optional[str] = None) -> bool:
+        """Thêm documents với custom instruction để tăng performance"""
         if not documents:
             print("❗ Không có document nào để thêm.")
             return False
 
+        if not instruction:
+            print("⚠️ Không có instruction, sử dụng add_documents thông thường.")
+            return self.add_documents(documents, ingest_id=ingest_id, namespace=namespace)
+
         try:
+            print(f"🎯 Sử dụng custom instruction: '{instruction[:50]}...'")
+            
+            # Dùng chung model đã load, chỉ đổi instruction theo request
+            def embed_fn(texts: List[str]) -> List[List[float]]:
+                return self.embeddings.embed_documents(texts, instruction=instruction)
+
+            success = self._add_documents(documents, instruction, embed_fn, ingest_id=ingest_id, namespace=namespace)
+            print("đã xong")
+            return success
+            
+        except Exception as e:
+            print(f"❌ Lỗi khi thêm documents với custom instruction: {e}")
+            return False
+
+    def _add_documents(self, documents: List[Document], instruction: str,
+                       embed_fn: Callable[[List[str]], List[List[float]]], ingest_id: Optional[str] = None,
+                       namespace: Optional[str] = None) -> bool:
+        """
+        Embed (qua cache) rồi thêm vector đã tính vào FAISS, không embed lại lần hai.
+        Id chunk = namespace + source + hash nội dung: chunk đã có (upload lại file không đổi)
+        được bỏ qua và chỉ đánh dấu ingest_id, để remove_stale_chunks biết chunk nào còn dùng.
+        """
+        if not documents:
+            print("❗ Không có document nào để thêm.")
+            return False
+        if self.read_only:
+            print("❌ Process này chỉ đọc vector store, không thêm được documents")
+            return False
+
+        try:
+            unique = {}
+            for doc in documents:
+                unique.setdefault(make_doc_id(doc.metadata, doc.page_content, namespace), doc)
+            existing = self.chunk_store.mark_ingested(list(unique), ingest_id)
+            new_documents = {doc_id: doc for doc_id, doc in unique.items() if doc_id not in existing}
+            if len(new_documents) < len(documents):
+                print(f"♻️ Bỏ qua {len(documents) - len(new_documents)}/{len(documents)} documents "
+                      f"đã có hoặc trùng nội dung")
+            if not new_documents:
+                return True
+            documents = list(new_documents.values())
+
             print(f"🚀 Bắt đầu embedding {len(documents)} documents với Qwen3-0.6B...")
             start_time = time.time()
 
-            if self.vector_store:
-                self.vector_store.add_documents(documents)
-                print(f"➕ Đã thêm {len(documents)} documents vào vectorstore.")
-            else:
-                self.vector_store = FAISS.from_documents(documents, self.embeddings)
-                print(f"🆕 Đã tạo vectorstore mới từ {len(documents)} documents.")
+            texts = [doc.page_content for doc in documents]
+            vectors = self._embed_texts(texts, instruction, embed_fn)
+            metadatas = [doc.metadata for doc in documents]
+            ids = list(new_documents)
 
-            # Tự động lưu sau khi thêm
-            save_success = self.save_vectorstore()
+            save_success, compact = True, False
+            with self.lock:
+                if self.mmap_mode:
+                    save_success = self._publish_shared(
+                        lambda: self._insert_documents(ids, texts, vectors, metadatas, ingest_id, namespace)
+                    )
+                    print(f"➕ Đã thêm {len(documents)} documents (mmap, {self.loaded_generation}).")
+                else:
+                    compact = self._insert_and_persist(ids, texts, vectors, metadatas, ingest_id, namespace)
+            # Compact sau khi nhả lock (save_vectorstore chỉ giữ lock lúc chụp snapshot)
+            if compact:
+                save_success = self.save_vectorstore()
+
+            if self.embedding_cache:
+                self.embedding_cache.flush()
             
             total_time = time.time() - start_time
             print(f"⏰ Hoàn thành trong {total_time:.2f}s (trung bình {total_time/len(documents):.2f}s/doc)")
@@ -94,107 +448,307 @@ class Qwen3Faiss(IQwen3Faiss):
             print(f"❌ Lỗi khi thêm documents: {e}")
             return False
 
-    def add_documents_with_custom_instruction(self, documents: List[Document], instruction: str) -> bool:
-        """Thêm documents với custom instruction để tăng performance"""
-        if not documents:
-            print("❗ Không có document nào để thêm.")
+    def _insert_and_persist(self, ids: List[str], texts: List[str], vectors: List[List[float]],
+                            metadatas: List[dict], ingest_id: Optional[str] = None,
+                            namespace: Optional[str] = None) -> bool:
+        """
+        Thêm vào chunk store + index trong process rồi ghi WAL (caller giữ self.lock).
+        Trả về True nếu cần compact ngay (chế độ sync, hoặc WAL vượt ngưỡng) - caller gọi
+        save_vectorstore sau khi nhả lock.
+        """
+        is_new = self.vector_store is None
+        faiss_ids, vectors = self._insert_documents(ids, texts, vectors, metadatas, ingest_id, namespace)
+        if not len(faiss_ids):
             return False
+        if is_new:
+            print(f"🆕 Đã tạo vectorstore mới ({index_kind(self.vector_store.index)}) từ {len(faiss_ids)} documents.")
+        else:
+            print(f"➕ Đã thêm {len(faiss_ids)} documents vào vectorstore.")
 
-        if not instruction:
-            print("⚠️ Không có instruction, sử dụng add_documents thông thường.")
-            return self.add_documents(documents)
+        if self.persist_mode == "write_behind":
+            # Chỉ append batch mới vào WAL, compact khi đủ ngưỡng hoặc theo timer
+            self.persistence.append(faiss_ids, vectors)
+            self.pending_count += len(faiss_ids)
+            return self.pending_count >= self.flush_max_pending
+        return True
 
-        try:
-            print(f"🎯 Sử dụng custom instruction: '{instruction[:50]}...'")
-            
-            # Tạo embedding instance mới với instruction khác
-            custom_embeddings = HuggingFaceEmbeddings(
-                model_name="Qwen/Qwen3-Embedding-0.6B",
-                model_kwargs={
-                    'device': 'cpu',
-                    'trust_remote_code': True,
-                },
-                encode_kwargs={
-                    'normalize_embeddings': True,
-                    'batch_size': 32,
-                    'instruction': instruction
-                }
+    def _insert_documents(self, ids: List[str], texts: List[str], vectors: List[List[float]],
+                          metadatas: List[dict], ingest_id: Optional[str] = None,
+                          namespace: Optional[str] = None):
+        """
+        Cấp faiss_id mới, ghi chunk vào chunk store trước rồi mới thêm vector vào index.
+        Kiểm tra lại doc_id đã có ngay dưới lock (hai request cùng upload một file).
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        existing = self.chunk_store.existing_doc_ids(ids)
+        if existing:
+            keep = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+            ids, texts, metadatas = [ids[i] for i in keep], [texts[i] for i in keep], [metadatas[i] for i in keep]
+            vectors = vectors[keep]
+        faiss_ids = np.arange(self.next_faiss_id, self.next_faiss_id + len(ids), dtype=np.int64)
+        if not len(ids):
+            return faiss_ids, vectors
+        self.chunk_store.add_chunks(faiss_ids.tolist(), ids, texts, metadatas, ingest_id, namespace)
+        self._add_vectors(faiss_ids, vectors)
+        return faiss_ids, vectors
+
+    def _add_vectors(self, faiss_ids: np.ndarray, vectors: np.ndarray):
+        """Thêm vector đã tính vào index theo faiss_id (caller giữ self.lock)"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(faiss_ids):
+            return
+        if self.vector_store is None:
+            index = build_index(self.index_config, vectors.shape[1], self.metric, train_vectors=vectors)
+            self.vector_store = self._wrap(index)
+
+        if self.vector_store.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            vectors = vectors.copy()
+            faiss.normalize_L2(vectors)
+
+        faiss_ids = np.ascontiguousarray(faiss_ids, dtype=np.int64)
+        self.vector_store.index.add_with_ids(vectors, faiss_ids)
+        self._invalidate_search_caches()
+        self.next_faiss_id = max(self.next_faiss_id, int(faiss_ids.max()) + 1)
+
+    def _remove_vectors(self, faiss_ids: np.ndarray):
+        """Xóa vector khỏi index theo faiss_id; HNSW chỉ đánh dấu tombstone (caller giữ self.lock)"""
+        if self.vector_store is None or not len(faiss_ids):
+            return
+        faiss_ids = np.ascontiguousarray(faiss_ids, dtype=np.int64)
+        self._invalidate_search_caches()
+        index = self.vector_store.index
+        if index_kind(index) == "hnsw":
+            self._set_tombstones(np.union1d(self.tombstones, faiss_ids))
+        else:
+            index.remove_ids(faiss_ids)
+
+    def _load_tombstones(self):
+        """Tombstone = id còn trong index HNSW nhưng chunk đã bị xóa khỏi chunk store"""
+        index = self.vector_store.index if self.vector_store is not None else None
+        if index is None or index_kind(index) != "hnsw":
+            self._set_tombstones(np.zeros(0, dtype=np.int64))
+            return
+        live = np.array(self.chunk_store.faiss_ids(), dtype=np.int64)
+        self._set_tombstones(np.setdiff1d(stored_ids(index), live))
+
+    def _set_tombstones(self, tombstones: np.ndarray):
+        self.tombstones = tombstones
+        self.tombstone_selector = exclude_selector(tombstones)
+
+    def _delete_chunks(self, faiss_ids: List[int]) -> int:
+        """Xóa chunk khỏi chunk store (nguồn dữ liệu chính) rồi xóa vector, ghi WAL / publish như khi thêm"""
+        if not faiss_ids:
+            return 0
+        if self.read_only:
+            print("❌ Process này chỉ đọc vector store, không xóa được chunk")
+            return 0
+
+        def apply():
+            self.chunk_store.delete_faiss_ids(faiss_ids)
+            self._remove_vectors(np.asarray(faiss_ids, dtype=np.int64))
+
+        compact = False
+        with self.lock:
+            if self.mmap_mode:
+                self._publish_shared(apply)
+            else:
+                apply()
+                if self.persist_mode == "write_behind":
+                    self.persistence.append_deletion(np.asarray(faiss_ids, dtype=np.int64))
+                    self.pending_count += len(faiss_ids)
+                    compact = self.pending_count >= self.flush_max_pending
+                else:
+                    compact = True
+        if compact:
+            self.save_vectorstore()
+        print(f"🗑️ Đã xóa {len(faiss_ids)} chunks")
+        return len(faiss_ids)
+
+    def remove_stale_chunks(self, sources: List[str], ingest_id: str, namespace: Optional[str] = None) -> int:
+        """Sau khi upload lại file: xóa các chunk của source không còn trong lần upload ingest_id"""
+        removed = 0
+        for source in sources:
+            removed += self._delete_chunks(self.chunk_store.stale_faiss_ids(source, ingest_id, namespace))
+        return removed
+
+    def delete_source(self, source: str, namespace: Optional[str] = None) -> int:
+        """Xóa toàn bộ chunk của một source (file) trong namespace, trả về số chunk đã xóa"""
+        return self._delete_chunks(self.chunk_store.source_faiss_ids(source, namespace))
+
+    def list_sources(self, namespace: Optional[str] = None) -> List[dict]:
+        return self.chunk_store.list_sources(namespace)
+
+    def _invalidate_search_caches(self):
+        self.namespace_cache.clear()
+
+    def _namespace_entry(self, namespace: str) -> tuple:
+        """(ids, vectors, selector) của namespace: vectors cho namespace nhỏ, selector cho namespace lớn"""
+        entry = self.namespace_cache.get(namespace)
+        if entry is None:
+            namespaces = [namespace, None] if self.namespace_include_shared else [namespace]
+            ids = np.array(self.chunk_store.namespace_faiss_ids(namespaces, below=self.next_faiss_id),
+                           dtype=np.int64)
+            if len(ids) <= self.namespace_brute_force_max:
+                entry = (ids, reconstruct_vectors(self.vector_store.index, ids), None)
+            else:
+                entry = (ids, None, include_selector(ids))
+            self.namespace_cache.put(namespace, entry)
+        return entry
+
+    def _search_by_vector(self, vector: List[float], k: int, nprobe: Optional[int] = None,
+                          ef_search: Optional[int] = None, namespace: Optional[str] = None):
+        """
+        Search trực tiếp trên index với nprobe/efSearch riêng cho query này, trả về (doc, cosine).
+        namespace: chỉ xét chunk của namespace đó (id lấy từ chunk store nên không gồm tombstone).
+        """
+        index = self.vector_store.index
+        query = np.asarray([vector], dtype=np.float32)
+        selector = self.tombstone_selector
+        if namespace is not None:
+            ids, vectors, selector = self._namespace_entry(namespace)
+            if not len(ids):
+                return []
+            if vectors is not None:
+                scores, faiss_ids = search_subset(vectors, ids, query, k, index.metric_type)
+                return self._collect_hits(faiss_ids, to_relevance(scores, index.metric_type))
+
+        params = search_parameters(
+            index,
+            nprobe=nprobe or self.index_config.nprobe,
+            ef_search=ef_search or self.index_config.ef_search,
+            selector=selector,
+        )
+        if params is not None:
+            scores, faiss_ids = index.search(query, k, params=params)
+        else:
+            scores, faiss_ids = index.search(query, k)
+        return self._collect_hits(faiss_ids, to_relevance(scores, index.metric_type))
+
+    def _collect_hits(self, faiss_ids: np.ndarray, scores: np.ndarray):
+        # Chỉ đọc các chunk thuộc top-k từ chunk store (một query)
+        hits = [(int(faiss_id), float(score)) for faiss_id, score in zip(faiss_ids[0], scores[0]) if faiss_id >= 0]
+        documents = self.chunk_store.get_by_faiss_ids(faiss_id for faiss_id, _ in hits)
+        return [(documents[faiss_id], score) for faiss_id, score in hits if faiss_id in documents]
+
+    def _embed_texts(self, texts: List[str], instruction: Optional[str],
+                     embed_fn: Callable[[List[str]], List[List[float]]],
+                     key_texts: Optional[List[str]] = None) -> List[List[float]]:
+        """
+        Tra cache trước, chỉ gọi model cho các text chưa có (mỗi key unique chỉ embed một lần).
+        key_texts (nếu có) thay texts khi tính cache key, model vẫn embed texts gốc.
+        """
+        if not self.embedding_cache:
+            return embed_fn(texts)
+
+        keys = [EmbeddingCache.make_key(self.model_name, instruction, text) for text in (key_texts or texts)]
+        cached = self.embedding_cache.get_many(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            new_vectors = embed_fn(list(missing.values()))
+            self.embedding_cache.put_many(list(missing.keys()), new_vectors)
+            cached.update(zip(missing.keys(), new_vectors))
+
+        print(f"🗃️ Embedding cache: {len(texts) - len(missing)}/{len(texts)} hit | {self.embedding_cache.stats()}")
+        return [list(map(float, cached[key])) for key in keys]
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Cache key của câu hỏi (NFC + gộp khoảng trắng + casefold), không dùng để embed"""
+        return " ".join(unicodedata.normalize("NFC", query).split()).casefold()
+
+    def embed_query(self, query: str) -> List[float]:
+        """Vector của câu hỏi, dùng chung cache với similarity_search"""
+        return self._embed_query(query)
+
+    def _embed_query(self, query: str) -> List[float]:
+        """
+        Embed câu hỏi: LRU in-process -> embedding cache trên disk -> model.
+        Bản normalize chỉ làm cache key; model embed câu hỏi gốc (chỉ gộp khoảng trắng) vì
+        hoa/thường và dấu vẫn mang nghĩa (tên riêng, mã sản phẩm).
+        """
+        normalized = self._normalize_query(query)
+        vector = self.query_cache.get(normalized)
+        if vector is None:
+            vector = np.asarray(
+                self._embed_texts([" ".join(query.split())], self.document_instruction,
+                                  self.embeddings.embed_documents, key_texts=[QUERY_KEY_PREFIX + normalized])[0],
+                dtype=np.float32,
             )
-            
-            # Backup embedding hiện tại
-            original_embeddings = self.embeddings
-            self.embeddings = custom_embeddings
-            
-            # Thêm documents
-            success = self.add_documents(documents)
-            
-            # Restore embedding
-            self.embeddings = original_embeddings
-            print("đã xong")
-            return success
-            
-        except Exception as e:
-            print(f"❌ Lỗi khi thêm documents với custom instruction: {e}")
-            # Restore embedding trong trường hợp lỗi
-            if 'original_embeddings' in locals():
-                self.embeddings = original_embeddings
-            return False
+            self.query_cache.put(normalized, vector)
+        return vector.tolist()
 
-    def add_documents_optimized(self, documents: List[Document], chunk_size: int = 1000) -> bool:
-        """Version tối ưu với chunking phù hợp cho Qwen3"""
+    def add_documents_optimized(self, documents: List[Document], chunk_size: Optional[int] = None,
+                                ingest_id: Optional[str] = None, namespace: Optional[str] = None) -> bool:
+        """Version tối ưu với chunking theo cấu trúc, chunk_size tính theo token Qwen3 (mặc định CHUNK_MAX_TOKENS)"""
         if not documents:
             print("❗ Không có document nào để thêm.")
             return False
 
         try:
-            print(f"🔧 Tối ưu hóa documents với chunk_size={chunk_size}")
-            
-            # Chunk với size lớn hơn vì Qwen3 xử lý context dài tốt hơn
-            chunked_docs = []
-            for doc in documents:
-                if len(doc.page_content) > chunk_size:
-                    content = doc.page_content
-                    for i in range(0, len(content), chunk_size):
-                        chunk_content = content[i:i + chunk_size]
-                        chunk_metadata = doc.metadata.copy()
-                        chunk_metadata['chunk_id'] = f"{doc.metadata.get('row_index', 0)}_chunk_{i//chunk_size}"
-                        chunk_metadata['is_chunked'] = True
-                        
-                        chunked_docs.append(Document(
-                            page_content=chunk_content,
-                            metadata=chunk_metadata
-                        ))
-                else:
-                    chunked_docs.append(doc)
-            
+            chunker = self.chunker
+            if chunk_size and chunk_size != chunker.max_tokens:
+                chunker = DocumentChunker(max_tokens=chunk_size, overlap_tokens=chunker.overlap_tokens,
+                                          count_tokens=self.embeddings.count_tokens)
+            print(f"🔧 Tối ưu hóa documents với chunk_size={chunker.max_tokens} tokens "
+                  f"(overlap {chunker.overlap_tokens})")
+
+            chunked_docs = chunker.split_documents(documents)
             if len(chunked_docs) != len(documents):
                 print(f"🔄 Đã chunk {len(documents)} docs thành {len(chunked_docs)} pieces")
             
             # Sử dụng instruction phù hợp cho technical documents
             return self.add_documents_with_custom_instruction(
                 chunked_docs, 
-                instruction="Represent this technical document for semantic search and retrieval: "
+                instruction="Represent this technical document for semantic search and retrieval: ",
+                ingest_id=ingest_id,
+                namespace=namespace,
             )
             
         except Exception as e:
             print(f"❌ Lỗi khi tối ưu hóa documents: {e}")
             return False
     
-    def similarity_search(self, query: str, k: int = 5, score_threshold: float = 0.0):
-        """Bonus method: Tìm kiếm documents tương tự"""
+    def similarity_search(self, query: str, k: int = 5, score_threshold: Optional[float] = None,
+                          nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                          namespace: Optional[str] = None):
+        """
+        Tìm kiếm documents tương tự, trả về list (doc, score) với score là cosine similarity
+        (càng lớn càng liên quan, sắp xếp giảm dần). Kết quả có score < score_threshold
+        (mặc định RETRIEVAL_SCORE_THRESHOLD) bị loại.
+        nprobe (IVF) / ef_search (HNSW) chỉnh độ chính xác cho từng query.
+        namespace: chỉ search trong chunk của user/tenant đó (None = toàn bộ index).
+        """
         if not self.vector_store:
             print("❌ Chưa có vectorstore để search!")
             return []
         
         try:
-            results = self.vector_store.similarity_search_with_score(query, k=k)
-            # Filter theo score threshold nếu cần
+            query_vector = self._embed_query(query)
+            with self.lock:
+                results = self._search_by_vector(query_vector, k, nprobe=nprobe, ef_search=ef_search,
+                                                 namespace=namespace)
+            if score_threshold is None:
+                score_threshold = self.score_threshold
             filtered_results = [(doc, score) for doc, score in results if score >= score_threshold]
             return filtered_results
         except Exception as e:
             print(f"❌ Lỗi khi search: {e}")
             return []
     
+    def readiness_info(self) -> dict:
+        """Trạng thái load cho health check: chỉ đọc thuộc tính trong memory, không chạm SQLite / disk"""
+        return {
+            "status": "loaded" if self.vector_store else "empty",
+            "generation": self.loaded_generation,
+            "mmap": self.mmap_mode,
+            "read_only": self.read_only,
+        }
+
     def get_vectorstore_info(self) -> dict:
         """Bonus method: Lấy thông tin về vectorstore"""
         if not self.vector_store:
@@ -205,8 +759,23 @@ class Qwen3Faiss(IQwen3Faiss):
             info = {
                 "status": "loaded",
                 "persist_path": self.persist_path,
-                "embedding_model": "Qwen/Qwen3-Embedding-0.6B"
+                "embedding_model": self.model_name,
+                "generation": self.persistence.current_generation(),
+                "persist_mode": self.persist_mode,
+                "mmap": self.mmap_mode,
+                "read_only": self.read_only,
+                "pending_in_wal": self.pending_count,
+                "tombstones": len(self.tombstones),
+                "index_type": index_kind(self.vector_store.index),
+                "configured_index_type": self.index_config.index_type,
+                "metric": metric_name(self.vector_store.index.metric_type),
+                "configured_metric": self.index_config.metric,
             }
+            info["chunk_store"] = self.chunk_store.stats()
+            if self.embedding_cache:
+                info["embedding_cache"] = self.embedding_cache.stats()
+            info["query_cache"] = self.query_cache.stats()
+            info["namespace_cache"] = self.namespace_cache.stats()
             
             # Thử lấy số vectors nếu có thể
             if hasattr(self.vector_store, 'index') and hasattr(self.vector_store.index, 'ntotal'):
@@ -215,41 +784,3 @@ class Qwen3Faiss(IQwen3Faiss):
             return info
         except Exception as e:
             return {"status": "error", "error": str(e)}
-
-
-# Alternative: Sử dụng trực tiếp sentence-transformers cho flexibility cao hơn
-class DirectQwen3EmbeddingService:
-    def __init__(self):
-        from sentence_transformers import SentenceTransformer
-        print("🔄 Đang load Qwen3-Embedding-0.6B với SentenceTransformers...")
-        
-        self.model = SentenceTransformer(
-            "Qwen/Qwen3-Embedding-0.6B",
-            trust_remote_code=True,
-            device='cpu'  # hoặc 'cuda'
-        )
-        print("✅ Đã load xong!")
-    
-    def embed_documents(self, texts: List[str], instruction: str = None) -> List[List[float]]:
-        """Embed documents với optional instruction"""
-        if instruction:
-            texts = [f"{instruction}{text}" for text in texts]
-        
-        embeddings = self.model.encode(
-            texts,
-            normalize_embeddings=True,
-            batch_size=32,
-            show_progress_bar=True
-        )
-        return embeddings.tolist()
-    
-    def embed_query(self, query: str, instruction: str = "Represent this query for retrieving relevant documents: ") -> List[float]:
-        """Embed query với instruction phù hợp"""
-        if instruction:
-            query = f"{instruction}{query}"
-        
-        embedding = self.model.encode(
-            query,
-            normalize_embeddings=True
-        )
-        return embedding.tolist()
\ No newline at end of file
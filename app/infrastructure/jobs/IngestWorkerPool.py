@@ -0,0 +1,178 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from typing import Awaitable, Callable, List, Optional
+from dotenv import load_dotenv
+from core.interface.IIngestJobRepository import IIngestJobRepository
+from core.interface.IQwen3Faiss import IQwen3Faiss
+from core.use_case.EmbedFile import EmbedFilesUseCase
+from infrastructure.repository.FileRepository import FileRepository
+from utils.executor import run_blocking
+
+load_dotenv()
+
+# Số documents tối đa mỗi batch khi stream file vào embedding
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+# Số job chạy song song (embedding CPU-bound, mặc định 1 để không tranh CPU với request search)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "5"))
+
+
+class StoredUpload:
+    """File upload đã được lưu xuống spool dir, có cùng interface filename/file như UploadFile"""
+
+    def __init__(self, filename: str, path: str):
+        self.filename = filename
+        self.file = open(path, "rb")
+
+
+class IngestWorkerPool:
+    """
+    Chạy job ingest ở background thay vì trong request /embed:
+    - spool(): lưu file upload xuống đĩa + thêm job vào hàng đợi (trả về ngay)
+    - N worker (asyncio task) lấy job từ hàng đợi, embedding chạy trong executor
+    File của job được xóa khi job kết thúc; job bị gián đoạn (restart) sẽ được chạy lại.
+    """
+
+    def __init__(self, jobs: IIngestJobRepository, get_embedder: Callable[[], Awaitable[IQwen3Faiss]],
+                 spool_dir: str, workers: int = INGEST_WORKERS, batch_size: int = INGEST_BATCH_SIZE,
+                 poll_interval: float = INGEST_POLL_INTERVAL):
+        self.jobs = jobs
+        self.get_embedder = get_embedder
+        self.spool_dir = spool_dir
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.tasks: List[asyncio.Task] = []
+        self.wakeup: Optional[asyncio.Event] = None
+
+    # ---------- enqueue ----------
+    def spool(self, files: list, user_id: Optional[str], namespace: Optional[str] = None) -> dict:
+        """Copy file upload vào spool_dir/<job_id>/ rồi enqueue job (blocking, chạy trong executor)"""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.spool_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+
+        stored = []
+        for position, file in enumerate(files):
+            path = os.path.join(job_dir, f"{position:04d}_{os.path.basename(file.filename)}")
+            file.file.seek(0)
+            with open(path, "wb") as out:
+                shutil.copyfileobj(file.file, out, 1024 * 1024)
+            stored.append({"filename": file.filename, "path": path, "size": os.path.getsize(path)})
+
+        job = self.jobs.enqueue(job_id, user_id, stored, namespace)
+        print(f"📥 Đã nhận job {job_id}: {len(stored)} files, {job['progress']['bytes_total']} bytes")
+        return job
+
+    def notify(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    # ---------- worker ----------
+    def start(self):
+        if self.tasks:
+            return
+        self.wakeup = asyncio.Event()
+        self.tasks = [
+            asyncio.create_task(self._worker_loop(), name=f"ingest-worker-{i}") for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        # Job đang embed dở vẫn chạy nốt trong executor (shutdown_executor chờ), không bị mất
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _worker_loop(self):
+        try:
+            embedder = await self.get_embedder()
+        except Exception:
+            embedder = None  # Lỗi load được báo theo từng job bên dưới
+        if embedder is not None and embedder.read_only:
+            # Chỉ process giữ quyền ghi vector store mới lấy job, các worker khác chỉ enqueue
+            print("ℹ️ Vector store của process này chỉ đọc, không chạy worker ingest")
+            return
+
+        while True:
+            try:
+                await run_blocking(self._fail_stale_jobs)
+                job = await run_blocking(self.jobs.claim_next)
+            except Exception as e:
+                print(f"❌ Không đọc được hàng đợi ingest: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+
+            try:
+                embedder = await self.get_embedder()
+            except Exception as e:
+                await run_blocking(self.jobs.finish, job["job_id"], "failed", None, f"Vector service lỗi: {e}")
+                continue
+            try:
+                await run_blocking(self._run_job, job, embedder)
+            except Exception as e:
+                print(f"❌ Worker ingest lỗi với job {job['job_id']}: {e}")
+
+    def _fail_stale_jobs(self):
+        """Job treo quá số lần thử bị đánh dấu failed: xóa luôn file spool của chúng"""
+        for job_id in self.jobs.fail_stale():
+            print(f"❌ Job {job_id} bị treo quá số lần thử, đã đánh dấu failed")
+            shutil.rmtree(os.path.join(self.spool_dir, job_id), ignore_errors=True)
+
+    @staticmethod
+    def _position(file: StoredUpload, size: int) -> int:
+        """Số bytes đã đọc của file đang xử lý (stream xlsx/csv đọc tuần tự nên tell() tăng dần)"""
+        try:
+            return min(max(file.file.tell(), 0), size)
+        except (OSError, ValueError):
+            return 0
+
+    def _run_job(self, job: dict, embedder: IQwen3Faiss):
+        job_id = job["job_id"]
+        sizes = [file["size"] for file in job["files"]]
+        use_case = EmbedFilesUseCase(FileRepository(), embedder, batch_size=self.batch_size,
+                                     namespace=job["namespace"])
+        start_time = time.time()
+        print(f"⚙️ Bắt đầu job {job_id} (lần {job['attempts']})")
+
+        def progress(documents: int, reports: list):
+            done = len(reports)
+            bytes_done = sum(sizes[:done])
+            if done < len(files):
+                # Tính cả phần đã đọc của file đang xử lý, để file lớn duy nhất vẫn có ETA
+                bytes_done += self._position(files[done], sizes[done])
+            self.jobs.update_progress(job_id, documents, done, bytes_done)
+
+        files = []
+        try:
+            for file in job["files"]:
+                files.append(StoredUpload(file["filename"], file["path"]))
+            total = use_case.execute(files, progress=progress)
+            result = {"documents": total, "files": use_case.file_reports, "removed_chunks": use_case.removed_chunks,
+                      "failed_sources": use_case.failed_sources}
+            if not total:
+                self.jobs.finish(job_id, "failed", result, "Embedding failed")
+            elif use_case.failed_sources:
+                # Một phần file embed lỗi: job vẫn có dữ liệu mới nhưng client cần biết file nào phải upload lại
+                self.jobs.finish(job_id, "partial", result,
+                                 f"Embedding failed: {', '.join(use_case.failed_sources)}")
+            else:
+                self.jobs.finish(job_id, "done", result)
+            print(f"✅ Job {job_id}: {total} documents trong {time.time() - start_time:.2f}s")
+        except Exception as e:
+            print(f"❌ Job {job_id} lỗi: {e}")
+            self.jobs.finish(job_id, "failed", None, str(e))
+        finally:
+            for file in files:
+                file.file.close()
+            shutil.rmtree(os.path.join(self.spool_dir, job_id), ignore_errors=True)
@@ -0,0 +1,93 @@
+import os
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from core.entity.Chat import Message
+from core.entity.Conversation import Conversation
+from core.interface.IConversationRepository import IConversationRepository
+from utils.lruCache import LRUCache
+
+load_dotenv()
+
+# Số message gần nhất của mỗi conversation được load/giữ trong cache để làm history cho LLM
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "50"))
+# Độ dài tối đa của title khi tự tạo conversation từ câu hỏi đầu tiên
+CHAT_TITLE_MAX_CHARS = 60
+
+
+def history_sizeof(entry: dict) -> int:
+    """Ước lượng bytes của một entry: nội dung UTF-8 + overhead mỗi Message"""
+    return 256 + sum(len(message.content.encode("utf-8")) + 200 for message in entry["messages"])
+
+
+class ChatHistoryStore:
+    """
+    History của /chat đọc/ghi qua conversation repository (MongoDB, dùng chung giữa các worker),
+    mỗi worker giữ một LRU các conversation đang hoạt động, giới hạn theo tổng số bytes.
+
+    Mỗi lượt chat chỉ hỏi MongoDB số message của conversation: nếu khớp với cache thì
+    dùng luôn, nếu khác (worker khác vừa ghi thêm) thì load lại CHAT_HISTORY_MAX_MESSAGES
+    message mới nhất.
+    """
+
+    def __init__(self, repo: IConversationRepository, max_messages: int = CHAT_HISTORY_MAX_MESSAGES):
+        self.repo = repo
+        self.max_messages = max_messages
+        self.cache = LRUCache(
+            max_entries=int(os.getenv("CHAT_HISTORY_CACHE_ENTRIES", "4096")),
+            max_bytes=int(os.getenv("CHAT_HISTORY_CACHE_BYTES", str(64 * 1024 * 1024))),
+            sizeof=history_sizeof,
+        )
+
+    async def load(self, user_id: str, conversation_id: Optional[str], question: str) -> Tuple[str, List[Message]]:
+        """
+        Trả về (conversation_id, history). Không có conversation_id thì dùng conversation
+        gần nhất của user, chưa có conversation nào thì tạo mới với title từ câu hỏi.
+        """
+        if not conversation_id:
+            latest = await self.repo.get_conversations_by_user_id(user_id, limit=1)
+            if latest:
+                conversation_id = latest[0].id
+            else:
+                conversation = await self.repo.create_conversation(
+                    Conversation(user_id=user_id, title=question.strip()[:CHAT_TITLE_MAX_CHARS] or "New chat")
+                )
+                self.cache.put(conversation.id, {"user_id": user_id, "count": 0, "messages": []})
+                return conversation.id, []
+
+        count = await self.repo.get_message_count(conversation_id, user_id)
+        if count is None:
+            self.cache.pop(conversation_id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Conversation not found or you don't have permission to access it"
+            )
+
+        entry = self.cache.get(conversation_id)
+        if entry is None or entry["user_id"] != user_id or entry["count"] != count:
+            messages = await self.repo.get_messages(conversation_id, user_id, limit=self.max_messages)
+            entry = {"user_id": user_id, "count": count, "messages": messages}
+            self.cache.put(conversation_id, entry)
+
+        # Trả về bản copy: use case có thể giữ list trong lúc lượt khác được append
+        return conversation_id, list(entry["messages"])
+
+    async def append(self, user_id: str, conversation_id: str, messages: List[Message]) -> bool:
+        """Ghi các message của lượt chat vào MongoDB rồi cập nhật cache của worker này"""
+        saved = await self.repo.add_messages(conversation_id, messages)
+        entry = self.cache.get(conversation_id)
+        if not saved:
+            self.cache.pop(conversation_id)
+            return False
+
+        if entry is not None and entry["user_id"] == user_id:
+            # Không sửa entry tại chỗ (tổng bytes của cache tính lúc put)
+            self.cache.put(conversation_id, {
+                "user_id": user_id,
+                "count": entry["count"] + len(messages),
+                "messages": (entry["messages"] + messages)[-self.max_messages:] if self.max_messages > 0 else [],
+            })
+        return True
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -150,6 +150,48 @@ class ConversationRepositoryMongo(IConversationRepository):
             print(f"Error adding message: {e}")
             return False
 
+    async def add_messages(self, conversation_id: str, messages: List[Message]) -> bool:
+        """Thêm nhiều message vào conversation trong một lần ghi ($push $each)"""
+        try:
+            message_docs = [
+                {
+                    "_id": ObjectId(),
+                    "role": message.role,
+                    "content": message.content,
+                    "timestamp": message.timestamp
+                }
+                for message in messages
+            ]
+
+            result = await self.collection.update_one(
+                {"_id": ObjectId(conversation_id)},
+                {
+                    "$push": {"messages": {"$each": message_docs}},
+                    "$set": {"updated_at": datetime.now()}
+                }
+            )
+
+            for message, message_doc in zip(messages, message_docs):
+                message.id = str(message_doc["_id"])
+
+            return result.modified_count > 0
+        except Exception as e:
+            print(f"Error adding messages: {e}")
+            return False
+
+    async def get_message_count(self, conversation_id: str, user_id: str) -> Optional[int]:
+        """Số message của conversation, chỉ trả về một số nguyên (không load messages)"""
+        try:
+            cursor = self.collection.aggregate([
+                {"$match": {"_id": ObjectId(conversation_id), "user_id": user_id, "is_active": True}},
+                {"$project": {"count": {"$size": {"$ifNull": ["$messages", []]}}}}
+            ])
+            docs = await cursor.to_list(length=1)
+            return docs[0]["count"] if docs else None
+        except Exception as e:
+            print(f"Error counting messages: {e}")
+            return None
+
     async def delete_conversation(self, conversation_id: str, user_id: str) -> bool:
         """Xóa conversation (soft delete - chỉ owner mới được xóa)"""
         try:
@@ -182,11 +224,15 @@ class ConversationRepositoryMongo(IConversationRepository):
     async def get_messages(self, conversation_id: str, user_id: str, limit: int = 50) -> List[Message]:
         """Lấy messages của conversation (chỉ owner mới được xem)"""
         try:
-            # Kiểm tra quyền sở hữu
-            doc = await self.collection.find_one({
-                "_id": ObjectId(conversation_id),
-                "user_id": user_id
-            })
+            # Kiểm tra quyền sở hữu, chỉ lấy `limit` messages mới nhất từ MongoDB ($slice)
+            # thay vì kéo cả mảng messages về rồi mới cắt
+            doc = await self.collection.find_one(
+                {
+                    "_id": ObjectId(conversation_id),
+                    "user_id": user_id
+                },
+                {"messages": {"$slice": -limit} if limit > 0 else 0}
+            )
             
             if not doc:
                 raise HTTPException(
@@ -194,14 +240,8 @@ class ConversationRepositoryMongo(IConversationRepository):
                     detail="Conversation not found or you don't have permission to access it"
                 )
             
-            # Lấy messages (giới hạn số lượng để tối ưu performance)
             messages = []
-            raw_messages = doc.get("messages", [])
-            
-            # Lấy messages mới nhất (reverse để lấy từ cuối)
-            recent_messages = raw_messages[-limit:] if len(raw_messages) > limit else raw_messages
-            
-            for msg_doc in recent_messages:
+            for msg_doc in doc.get("messages", []):
                 messages.append(Message(
                     id=str(msg_doc.get("_id", "")),
                     role=msg_doc["role"],
@@ -1,10 +1,14 @@
 from core.interface.IEmbeddingRepository import IEmbeddingRepository
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_core.documents import Document
+from utils.httpClient import config as http_config
 
 class GoogleEmbeddingService(IEmbeddingRepository):
     def __init__(self):
-        self.embedding_model = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
+        self.embedding_model = GoogleGenerativeAIEmbeddings(
+            model="models/gemini-embedding-001",
+            request_options={"timeout": http_config.read_timeout},
+        )
 
     def embed_text(self, text: str) -> list[float]:
         return self.embedding_model.embed_query(text)
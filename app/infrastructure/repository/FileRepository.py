@@ -1,9 +1,30 @@
 from core.interface.IFileRepository import IFileRepository
 from langchain_core.documents import Document
-from typing import List, Dict, Any
+from typing import Iterator, List, Dict, Any, Optional, Tuple
 from fastapi import UploadFile
 from datetime import datetime
-import chardet, re, openpyxl, io, base64, os, docx, pandas as pd
+from utils.executor import get_process_pool, reset_process_pool
+from concurrent.futures.process import BrokenProcessPool
+from docx.oxml.table import CT_Tbl
+from docx.oxml.text.paragraph import CT_P
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+import chardet, re, openpyxl, io, base64, os, time, docx, numpy as np, pandas as pd
+
+
+class BufferedUpload:
+    """File đã đọc vào memory, có cùng interface filename/file như UploadFile (dùng trong process con)"""
+
+    def __init__(self, filename: str, content: bytes):
+        self.filename = filename
+        self.file = io.BytesIO(content)
+
+
+def convert_in_worker(filename: str, content: bytes) -> Tuple[List[Document], float]:
+    """Chạy trong process pool: parse một file, trả về (documents, thời gian xử lý)"""
+    start_time = time.perf_counter()
+    documents = FileRepository().convert_one(BufferedUpload(filename, content))
+    return documents, time.perf_counter() - start_time
 
 
 class FileRepository(IFileRepository):
@@ -25,24 +46,23 @@ class FileRepository(IFileRepository):
             # Đọc file DOCX
             doc = docx.Document(docx_stream)
             
-            # Trích xuất text từ tất cả paragraphs
+            # Trích xuất paragraphs và tables theo đúng thứ tự trong document,
+            # mỗi paragraph / table là một block (ngăn cách bằng dòng trống) để chunker không cắt ngang
             text_content = []
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():  # Chỉ thêm paragraph có nội dung
-                    text_content.append(paragraph.text.strip())
-            
-            # Trích xuất text từ tables (nếu có)
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            row_text.append(cell.text.strip())
-                    if row_text:
-                        text_content.append(" | ".join(row_text))
+            for block in self.iter_docx_blocks(doc):
+                if isinstance(block, Table):
+                    rows = []
+                    for row in block.rows:
+                        row_text = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+                        if row_text:
+                            rows.append(" | ".join(row_text))
+                    if rows:
+                        text_content.append("\n".join(rows))
+                elif block.text.strip():  # Chỉ thêm paragraph có nội dung
+                    text_content.append(block.text.strip())
             
             # Kết hợp tất cả text
-            full_text = "\n".join(text_content)
+            full_text = "\n\n".join(text_content)
             
             # Tạo metadata
             metadata = {
@@ -51,6 +71,7 @@ class FileRepository(IFileRepository):
                 "file_size": len(file_content),
                 "source": file.filename,
                 "page_count": len(doc.paragraphs),  # Số paragraphs như một metric
+                "block_count": len(text_content),
             }
             
             # Thêm metadata từ document properties (nếu có)
@@ -74,94 +95,166 @@ class FileRepository(IFileRepository):
             
         except Exception as e:
             raise Exception(f"Lỗi khi xử lý file DOCX: {str(e)}")
+    @staticmethod
+    def iter_docx_blocks(doc):
+        """Duyệt paragraphs và tables theo thứ tự xuất hiện trong body"""
+        for child in doc.element.body.iterchildren():
+            if isinstance(child, CT_P):
+                yield Paragraph(child, doc)
+            elif isinstance(child, CT_Tbl):
+                yield Table(child, doc)
 #endregion
 
 #region Excel
     def combine_text_columns(self, row, headers) -> str:
         return " ".join(f"{header}: {row[header]}" for header in headers if header in row and pd.notna(row[header]))
 
-    def convert_file_xlsx(self, file: UploadFile) -> List[Document]:
+    @staticmethod
+    def render_rows(df: pd.DataFrame, headers: list, separator: str = " ",
+                    include_headers: bool = True, strip_values: bool = False) -> Tuple[List[str], np.ndarray]:
+        """
+        Render tất cả rows thành text bằng phép toán theo cột (thay cho iterrows + combine_*):
+        mỗi ô không null thành "header: value", nối bằng separator.
+        strip_values=True: strip value và bỏ ô rỗng (giống combine_csv_row_columns).
+        Trả về (list content theo thứ tự row, số ô được render của mỗi row).
+        """
+        headers = [header for header in headers if header in df.columns]
+        mask = df[headers].notna()
+        # Đếm theo đúng mask dùng để render: ô chỉ có khoảng trắng bị bỏ khi strip_values thì không tính
+        non_null_values = np.zeros(len(df), dtype=np.int64)
+
+        rendered = pd.Series("", index=df.index, dtype=object)
+        for header in headers:
+            values = df[header].astype(str)
+            keep = mask[header]
+            if strip_values:
+                values = values.str.strip()
+                keep = keep & (values != "")
+            non_null_values += keep.to_numpy(dtype=np.int64)
+            prefix = f"{separator}{header}: " if include_headers else separator
+            rendered = rendered + (prefix + values).where(keep, "")
+
+        # Mọi phần tử đều bắt đầu bằng separator -> bỏ separator đầu tiên
+        return rendered.str.slice(len(separator)).tolist(), non_null_values
+
+    @staticmethod
+    def read_workbook_metadata(wb) -> Dict[str, Any]:
+        """Lấy thuộc tính workbook từ chính workbook đang stream (không parse file lần hai)"""
+        workbook_metadata = {}
         try:
-            # Đọc nội dung file
-            file_content = file.file.read()
-            file.file.seek(0)  # Reset pointer
-            
-            # Đọc file Excel
-            df = pd.read_excel(io.BytesIO(file_content))
-            
-            # Lấy thông tin cơ bản
-            headers = df.columns.tolist()
-            total_rows = len(df)
-            
-            # Lấy metadata từ Excel workbook
-            workbook_metadata = {}
-            try:
-                # Sử dụng openpyxl để lấy metadata chi tiết
-                wb = openpyxl.load_workbook(io.BytesIO(file_content), read_only=True)
-                props = wb.properties
-                
-                if props.creator:
-                    workbook_metadata["creator"] = props.creator
-                if props.title:
-                    workbook_metadata["title"] = props.title
-                if props.subject:
-                    workbook_metadata["subject"] = props.subject
-                if props.description:
-                    workbook_metadata["description"] = props.description
-                if props.created:
-                    workbook_metadata["created"] = props.created.isoformat()
-                if props.modified:
-                    workbook_metadata["modified"] = props.modified.isoformat()
-                if props.lastModifiedBy:
-                    workbook_metadata["last_modified_by"] = props.lastModifiedBy
-                
-                # Thông tin về sheets
-                workbook_metadata["sheet_names"] = wb.sheetnames
-                workbook_metadata["active_sheet"] = wb.active.title if wb.active else None
-                
-                wb.close()
-            except Exception as e:
-                # Nếu không lấy được metadata từ openpyxl, bỏ qua
-                workbook_metadata["metadata_error"] = str(e)
-            
-            # Tạo documents
-            documents = []
-            for index, row in df.iterrows():
-                # Kết hợp text từ các cột
-                content = self.combine_text_columns(row, headers)
-                
-                # Tạo metadata cho mỗi row
-                row_metadata = {
-                    "row_index": int(index),
-                    "filename": file.filename,
-                    "file_type": "xlsx",
-                    "source": file.filename,
-                    "total_rows": total_rows,
-                    "total_columns": len(headers),
-                    "column_headers": headers,
-                    "file_size": len(file_content),
-                }
-                
-                # Thêm workbook metadata vào mỗi row
-                row_metadata.update(workbook_metadata)
-                
-                # Thêm thống kê về row hiện tại
-                non_null_values = sum(1 for header in headers if header in row and pd.notna(row[header]))
-                row_metadata["non_null_values"] = non_null_values
-                row_metadata["completeness_ratio"] = round(non_null_values / len(headers), 2)
-                
-                documents.append(
-                    Document(
-                        page_content=content,
-                        metadata=row_metadata
-                    )
-                )
-            
-            return documents
-            
+            props = wb.properties
+            if props.creator:
+                workbook_metadata["creator"] = props.creator
+            if props.title:
+                workbook_metadata["title"] = props.title
+            if props.subject:
+                workbook_metadata["subject"] = props.subject
+            if props.description:
+                workbook_metadata["description"] = props.description
+            if props.created:
+                workbook_metadata["created"] = props.created.isoformat()
+            if props.modified:
+                workbook_metadata["modified"] = props.modified.isoformat()
+            if props.lastModifiedBy:
+                workbook_metadata["last_modified_by"] = props.lastModifiedBy
+
+            # Thông tin về sheets
+            workbook_metadata["sheet_names"] = wb.sheetnames
+            workbook_metadata["active_sheet"] = wb.active.title if wb.active else None
+        except Exception as e:
+            # Nếu không lấy được metadata, bỏ qua
+            workbook_metadata["metadata_error"] = str(e)
+        return workbook_metadata
+
+    @staticmethod
+    def build_sheet_headers(header_row: tuple) -> List[str]:
+        """Chuẩn hóa header giống pandas: ô trống -> 'Unnamed: i', trùng tên -> 'name.1'"""
+        headers = []
+        seen: Dict[str, int] = {}
+        for i, value in enumerate(header_row):
+            header = str(value).strip() if value is not None and str(value).strip() else f"Unnamed: {i}"
+            if header in seen:
+                seen[header] += 1
+                header = f"{header}.{seen[header]}"
+            else:
+                seen[header] = 0
+            headers.append(header)
+        return headers
+
+    def iter_file_xlsx(self, file: UploadFile, batch_size: int = 1000) -> Iterator[List[Document]]:
+        """
+        Đọc Excel dạng stream (openpyxl read_only + iter_rows) trên tất cả các sheet,
+        yield từng batch tối đa batch_size documents (mỗi row một document).
+        File được đọc trực tiếp từ upload, không copy toàn bộ vào memory và không parse hai lần.
+        """
+        try:
+            file.file.seek(0, os.SEEK_END)
+            file_size = file.file.tell()
+            file.file.seek(0)
+
+            wb = openpyxl.load_workbook(file.file, read_only=True, data_only=True)
         except Exception as e:
             raise Exception(f"Lỗi khi xử lý file Excel: {str(e)}")
 
+        try:
+            workbook_metadata = self.read_workbook_metadata(wb)
+            batch = []
+            for ws in wb.worksheets:
+                rows = ws.iter_rows(values_only=True)
+
+                # Row không rỗng đầu tiên là header
+                headers = None
+                for header_row in rows:
+                    if any(value is not None and str(value).strip() for value in header_row):
+                        headers = self.build_sheet_headers(header_row)
+                        break
+                if not headers:
+                    continue
+
+                # read_only: max_row lấy từ dimension của sheet (có thể không có)
+                total_rows = ws.max_row - 1 if ws.max_row else None
+                for index, row in enumerate(rows):
+                    values = [
+                        (header, value) for header, value in zip(headers, row)
+                        if value is not None and str(value).strip()
+                    ]
+                    if not values:
+                        continue
+
+                    content = " ".join(f"{header}: {value}" for header, value in values)
+                    row_metadata = {
+                        "row_index": index,
+                        "sheet_name": ws.title,
+                        "filename": file.filename,
+                        "file_type": "xlsx",
+                        "source": file.filename,
+                        "total_rows": total_rows,
+                        "total_columns": len(headers),
+                        "column_headers": headers,
+                        "file_size": file_size,
+                    }
+                    row_metadata.update(workbook_metadata)
+                    row_metadata["non_null_values"] = len(values)
+                    row_metadata["completeness_ratio"] = round(len(values) / len(headers), 2)
+
+                    batch.append(Document(page_content=content, metadata=row_metadata))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+            if batch:
+                yield batch
+        except Exception as e:
+            raise Exception(f"Lỗi khi xử lý file Excel: {str(e)}")
+        finally:
+            wb.close()
+            file.file.seek(0)
+
+    def convert_file_xlsx(self, file: UploadFile) -> List[Document]:
+        documents = []
+        for batch in self.iter_file_xlsx(file):
+            documents.extend(batch)
+        return documents
+
     def convert_file_xlsx_advanced(self, file: UploadFile, 
                                 sheet_name: str = None, 
                                 include_empty_rows: bool = False,
@@ -231,19 +324,14 @@ class FileRepository(IFileRepository):
                 pass
             
             documents = []
+            contents, non_null_counts = self.render_rows(df, headers)
             
             # Xử lý theo chunk nếu được chỉ định
             if chunk_size and chunk_size > 1:
                 # Gộp nhiều rows thành một document
                 for i in range(0, len(df), chunk_size):
-                    chunk_df = df.iloc[i:i+chunk_size]
-                    
                     # Kết hợp content từ nhiều rows
-                    chunk_content = []
-                    for _, row in chunk_df.iterrows():
-                        row_content = self.combine_text_columns(row, headers)
-                        if row_content.strip():  # Chỉ thêm nếu có content
-                            chunk_content.append(row_content)
+                    chunk_content = [content for content in contents[i:i + chunk_size] if content.strip()]
                     
                     if chunk_content:  # Chỉ tạo document nếu có content
                         content = "\n".join(chunk_content)
@@ -270,9 +358,7 @@ class FileRepository(IFileRepository):
                         ))
             else:
                 # Xử lý từng row một (như phiên bản gốc)
-                for index, row in df.iterrows():
-                    content = self.combine_text_columns(row, headers)
-                    
+                for index, content, non_null_values in zip(df.index, contents, non_null_counts):
                     if content.strip() or include_empty_rows:  # Chỉ tạo document nếu có content hoặc cho phép empty rows
                         row_metadata = {
                             "row_index": int(index),
@@ -288,7 +374,7 @@ class FileRepository(IFileRepository):
                         row_metadata.update(workbook_metadata)
                         
                         # Thống kê row
-                        non_null_values = sum(1 for header in headers if header in row and pd.notna(row[header]))
+                        non_null_values = int(non_null_values)
                         row_metadata["non_null_values"] = non_null_values
                         row_metadata["completeness_ratio"] = round(non_null_values / len(headers), 2)
                         
@@ -304,6 +390,30 @@ class FileRepository(IFileRepository):
 #endregion
 
 #region CSV
+    CSV_SAMPLE_BYTES = 64 * 1024
+    CSV_NA_VALUES = ['', 'NA', 'N/A', 'NULL', 'null', 'None']
+
+    @staticmethod
+    def detect_csv_encoding(sample: bytes) -> str:
+        """Phát hiện encoding từ một đoạn đầu file (không chạy chardet trên toàn bộ file)"""
+        # Bỏ dòng cuối có thể bị cắt giữa ký tự multi-byte
+        if b"\n" in sample:
+            sample = sample[:sample.rfind(b"\n") + 1]
+
+        encoding = chardet.detect(sample).get('encoding') or 'utf-8'
+        # Đoạn đầu toàn ASCII không có nghĩa phần sau cũng vậy
+        if encoding.lower() == 'ascii':
+            encoding = 'utf-8'
+
+        for candidate in [encoding, 'utf-8', 'cp1252', 'latin-1']:
+            try:
+                sample.decode(candidate)
+                return candidate
+            except (UnicodeDecodeError, LookupError):
+                continue
+        return 'latin-1'
+
+    @staticmethod
     def detect_csv_delimiter(sample_text: str) -> str:
         """Phát hiện delimiter của CSV file"""
         # Thử các delimiter phổ biến
@@ -328,6 +438,7 @@ class FileRepository(IFileRepository):
         
         return ','  # Default fallback
 
+    @staticmethod
     def clean_header_names(headers: list) -> list:
         """Làm sạch tên headers"""
         cleaned = []
@@ -354,135 +465,112 @@ class FileRepository(IFileRepository):
                 parts.append(f"{header}: {value}")
         return " | ".join(parts)
 
-    def convert_file_csv(self, file: UploadFile) -> List[Document]:
-        try:
-            # Đọc nội dung file
-            file_content = file.file.read()
+    def iter_file_csv(self, file: UploadFile, batch_size: int = 1000) -> Iterator[List[Document]]:
+        """
+        Đọc CSV dạng stream: encoding + delimiter được phát hiện từ CSV_SAMPLE_BYTES đầu file,
+        pandas đọc trực tiếp từ file upload với chunksize, mỗi chunk yield một batch documents.
+        Memory chỉ phụ thuộc batch_size, không phụ thuộc kích thước file.
+        """
+        file.file.seek(0, os.SEEK_END)
+        file_size = file.file.tell()
+        file.file.seek(0)
+        sample = file.file.read(self.CSV_SAMPLE_BYTES)
+        file.file.seek(0)
+
+        encoding = self.detect_csv_encoding(sample)
+        delimiter = self.detect_csv_delimiter(sample.decode(encoding, errors='replace')[:1000])
+
+        def open_reader(sep: str):
             file.file.seek(0)
-            
-            # Phát hiện encoding
-            detected_encoding = chardet.detect(file_content)
-            encoding = detected_encoding.get('encoding', 'utf-8')
-            
-            # Decode nội dung
-            try:
-                text_content = file_content.decode(encoding)
-            except UnicodeDecodeError:
-                # Thử các encoding phổ biến
-                for fallback_encoding in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
-                    try:
-                        text_content = file_content.decode(fallback_encoding)
-                        encoding = fallback_encoding
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                else:
-                    raise Exception("Không thể decode file CSV")
-            
-            # Phát hiện delimiter
-            delimiter = self.detect_csv_delimiter(text_content[:1000])  # Sample 1000 ký tự đầu
-            
-            # Đọc CSV với pandas
-            try:
-                df = pd.read_csv(
-                    io.StringIO(text_content),
-                    delimiter=delimiter,
-                    encoding=None,  # Đã decode rồi
-                    na_values=['', 'NA', 'N/A', 'NULL', 'null', 'None'],
-                    keep_default_na=True,
-                    skip_blank_lines=True
-                )
-            except Exception as e:
-                # Fallback: thử với delimiter khác
-                for fallback_delimiter in [',', ';', '\t']:
-                    if fallback_delimiter != delimiter:
-                        try:
-                            df = pd.read_csv(io.StringIO(text_content), delimiter=fallback_delimiter)
-                            delimiter = fallback_delimiter
-                            break
-                        except:
-                            continue
-                else:
-                    raise Exception(f"Không thể parse CSV: {str(e)}")
-            
+            reader = pd.read_csv(
+                file.file,
+                delimiter=sep,
+                encoding=encoding,
+                encoding_errors='replace',
+                na_values=self.CSV_NA_VALUES,
+                keep_default_na=True,
+                skip_blank_lines=True,
+                chunksize=batch_size,
+            )
+            return reader, next(reader, None)
+
+        # Chỉ thử delimiter khác khi chưa đọc được chunk đầu tiên
+        try:
+            reader, chunk = open_reader(delimiter)
+        except Exception as e:
+            for fallback_delimiter in [',', ';', '\t']:
+                if fallback_delimiter == delimiter:
+                    continue
+                try:
+                    reader, chunk = open_reader(fallback_delimiter)
+                    delimiter = fallback_delimiter
+                    break
+                except Exception:
+                    continue
+            else:
+                raise Exception(f"Lỗi khi xử lý file CSV: Không thể parse CSV: {str(e)}")
+
+        if chunk is None:
+            return
+
+        try:
             # Làm sạch headers
-            original_headers = df.columns.tolist()
+            original_headers = chunk.columns.tolist()
             clean_headers = self.clean_header_names(original_headers)
-            df.columns = clean_headers
-            
-            # Thống kê CSV
-            total_rows = len(df)
-            total_columns = len(df.columns)
-            non_empty_cells = df.count().sum()  # Tổng số cells không null
-            total_cells = total_rows * total_columns
-            
-            # Phát hiện kiểu dữ liệu của columns
-            column_types = {}
-            for col in df.columns:
-                dtype = str(df[col].dtype)
-                non_null_count = df[col].count()
-                unique_count = df[col].nunique()
-                
-                column_types[col] = {
-                    "dtype": dtype,
-                    "non_null_count": int(non_null_count),
-                    "unique_values": int(unique_count),
-                    "null_percentage": round((total_rows - non_null_count) / total_rows * 100, 1)
-                }
-            
+            total_columns = len(clean_headers)
+
             # Metadata chung cho tất cả documents
             base_metadata = {
                 "filename": file.filename,
                 "file_type": "csv",
                 "source": file.filename,
-                "file_size": len(file_content),
+                "file_size": file_size,
                 "encoding": encoding,
                 "delimiter": delimiter,
-                "total_rows": total_rows,
                 "total_columns": total_columns,
                 "column_names": clean_headers,
                 "original_headers": original_headers,
-                "column_types": column_types,
-                "data_completeness": round(non_empty_cells / total_cells * 100, 1),
-                "non_empty_cells": int(non_empty_cells),
             }
-            
-            # Tạo documents cho mỗi row
-            documents = []
-            for index, row in df.iterrows():
-                # Kết hợp content từ các columns
-                content = self.combine_csv_row_columns(row, clean_headers)
-                
-                # Skip empty rows nếu không có content
-                if not content.strip():
-                    continue
-                
-                # Metadata cho row này
-                row_metadata = base_metadata.copy()
-                row_metadata.update({
-                    "row_index": int(index),
-                    "row_number": int(index + 1),  # 1-indexed cho user-friendly
-                })
-                
-                # Thống kê row hiện tại
-                non_null_values = sum(1 for col in clean_headers if col in row and pd.notna(row[col]))
-                row_metadata.update({
-                    "non_null_values": non_null_values,
-                    "completeness_ratio": round(non_null_values / total_columns, 2),
-                    "empty_fields": total_columns - non_null_values,
-                })
-                
-                documents.append(
-                    Document(
-                        page_content=content,
-                        metadata=row_metadata
-                    )
-                )
-            
-            return documents
-            
+
+            while chunk is not None:
+                chunk.columns = clean_headers
+                contents, non_null_counts = self.render_rows(chunk, clean_headers, separator=" | ", strip_values=True)
+
+                documents = []
+                for index, content, non_null_values in zip(chunk.index, contents, non_null_counts):
+                    # Skip empty rows nếu không có content
+                    if not content.strip():
+                        continue
+
+                    non_null_values = int(non_null_values)
+                    row_metadata = base_metadata.copy()
+                    row_metadata.update({
+                        "row_index": int(index),
+                        "row_number": int(index + 1),  # 1-indexed cho user-friendly
+                        "non_null_values": non_null_values,
+                        "completeness_ratio": round(non_null_values / total_columns, 2),
+                        "empty_fields": total_columns - non_null_values,
+                    })
+                    documents.append(Document(page_content=content, metadata=row_metadata))
+
+                if documents:
+                    yield documents
+                chunk = next(reader, None)
         except Exception as e:
             raise Exception(f"Lỗi khi xử lý file CSV: {str(e)}")
+        finally:
+            reader.close()
+            file.file.seek(0)
+
+    def convert_file_csv(self, file: UploadFile) -> List[Document]:
+        documents = []
+        for batch in self.iter_file_csv(file):
+            documents.extend(batch)
+
+        # Khi đọc hết file mới biết tổng số rows
+        for document in documents:
+            document.metadata["total_rows"] = len(documents)
+        return documents
 
     def convert_file_csv_advanced(self, file: UploadFile,
                                 chunk_rows: int = None,
@@ -566,22 +654,17 @@ class FileRepository(IFileRepository):
             }
             
             documents = []
+            contents, non_null_counts = self.render_rows(
+                df, clean_headers, separator=" | ",
+                include_headers=include_headers_in_content,
+                strip_values=include_headers_in_content,
+            )
             
             if chunk_rows and chunk_rows > 1:
                 # Chunking mode: gộp nhiều rows thành một document
                 for i in range(0, len(df), chunk_rows):
-                    chunk_df = df.iloc[i:i+chunk_rows]
-                    
                     # Combine content từ nhiều rows
-                    chunk_contents = []
-                    for _, row in chunk_df.iterrows():
-                        if include_headers_in_content:
-                            row_content = self.combine_csv_row_columns(row, clean_headers)
-                        else:
-                            row_content = " | ".join([str(val) for val in row.values if pd.notna(val)])
-                        
-                        if row_content.strip():
-                            chunk_contents.append(row_content)
+                    chunk_contents = [content for content in contents[i:i + chunk_rows] if content.strip()]
                     
                     if chunk_contents:
                         content = "\n".join(chunk_contents)
@@ -601,12 +684,7 @@ class FileRepository(IFileRepository):
                         ))
             else:
                 # Single row mode (mặc định)
-                for index, row in df.iterrows():
-                    if include_headers_in_content:
-                        content = self.combine_csv_row_columns(row, clean_headers)
-                    else:
-                        content = " | ".join([str(val) for val in row.values if pd.notna(val)])
-                    
+                for index, content, non_null_values in zip(df.index, contents, non_null_counts):
                     if not content.strip():
                         continue
                     
@@ -618,7 +696,7 @@ class FileRepository(IFileRepository):
                     })
                     
                     # Row statistics
-                    non_null_values = sum(1 for val in row.values if pd.notna(val))
+                    non_null_values = int(non_null_values)
                     row_metadata.update({
                         "non_null_values": non_null_values,
                         "completeness_ratio": round(non_null_values / len(clean_headers), 2),
@@ -780,6 +858,7 @@ class FileRepository(IFileRepository):
         except Exception as e:
             raise Exception(f"Lỗi khi xử lý file TXT: {str(e)}")
 
+    @staticmethod
     def detect_text_format(text: str) -> str:
         """Phát hiện định dạng đặc biệt của file text"""
         text_lower = text.lower().strip()
@@ -825,6 +904,7 @@ class FileRepository(IFileRepository):
         
         return "plain_text"
 
+    @staticmethod
     def detect_language_hints(text: str) -> list:
         """Phát hiện gợi ý ngôn ngữ dựa trên ký tự"""
         hints = []
@@ -966,16 +1046,124 @@ class FileRepository(IFileRepository):
 #endregion
 
     
+    def convert_one(self, file) -> List[Document]:
+        """Parse một file theo phần mở rộng; định dạng không hỗ trợ trả về list rỗng"""
+        if file.filename.endswith(".docx"):
+            return [self.convert_file_docx(file)]
+        elif file.filename.endswith(".xlsx"):
+            return self.convert_file_xlsx(file)
+        elif file.filename.endswith(".csv"):
+            return self.convert_file_csv(file)
+        elif file.filename.endswith(".txt"):
+            return [self.convert_file_txt(file)]
+        return []
+
+    @staticmethod
+    def file_size(file) -> int:
+        file.file.seek(0, os.SEEK_END)
+        size = file.file.tell()
+        file.file.seek(0)
+        return size
+
+    def submit_extraction(self, documents: list) -> list:
+        """
+        Gửi các file sang process pool (bytes được ship sang process con), trả về list
+        (pool, future) theo đúng thứ tự đầu vào; None nếu không có pool (chạy tuần tự).
+        """
+        pool = get_process_pool()
+        if pool is None or len(documents) < 2:
+            return [None] * len(documents)
+
+        futures = []
+        for doc in documents:
+            content = doc.file.read()
+            doc.file.seek(0)
+            try:
+                futures.append((pool, pool.submit(convert_in_worker, doc.filename, content)))
+            except BrokenProcessPool:
+                # Pool đã hỏng từ trước: các file còn lại chạy trong process hiện tại
+                reset_process_pool(pool)
+                futures.extend([None] * (len(documents) - len(futures)))
+                break
+        return futures
+
+    def collect_extraction(self, doc, submitted) -> Dict[str, Any]:
+        """Kết quả của một file: documents, thời gian và lỗi (không làm hỏng cả batch)"""
+        result = {"filename": doc.filename, "documents": [], "seconds": 0.0, "error": None}
+        start_time = time.perf_counter()
+        try:
+            if submitted is not None:
+                pool, future = submitted
+                try:
+                    result["documents"], result["seconds"] = future.result()
+                except BrokenProcessPool:
+                    # Process con chết giữa chừng (OOM, crash): bỏ pool, parse lại file này tại chỗ
+                    print(f"⚠️ Process pool bị hỏng khi parse {doc.filename}, chạy lại trong process hiện tại")
+                    reset_process_pool(pool)
+                    doc.file.seek(0)
+                    result["documents"] = self.convert_one(doc)
+                    result["seconds"] = time.perf_counter() - start_time
+            else:
+                result["documents"] = self.convert_one(doc)
+                result["seconds"] = time.perf_counter() - start_time
+        except Exception as e:
+            result["error"] = str(e)
+            result["seconds"] = time.perf_counter() - start_time
+
+        if result["error"]:
+            print(f"❌ {doc.filename}: {result['error']}")
+        else:
+            print(f"📄 {doc.filename}: {len(result['documents'])} documents trong {result['seconds']:.2f}s")
+        return result
+
+    def extract_files_detailed(self, documents: list[UploadFile]) -> List[Dict[str, Any]]:
+        """Parse nhiều file song song (process pool), giữ thứ tự, báo thời gian/lỗi từng file"""
+        submitted = self.submit_extraction(documents)
+        return [self.collect_extraction(doc, item) for doc, item in zip(documents, submitted)]
+
     def extract_file(self, documents: list[UploadFile]) -> List[Document]:
         list_docs = []
-        for doc in documents:
-            if doc.filename.endswith(".docx"):
-                list_docs.append(self.convert_file_docx(doc))
-            elif doc.filename.endswith(".xlsx"):
-                list_docs.extend(self.convert_file_xlsx(doc))
-            elif doc.filename.endswith(".csv"):
-                list_docs.append(self.convert_file_csv(doc))
-            elif doc.filename.endswith(".txt"):
-                list_docs.append(self.convert_file_txt(doc))
+        for result in self.extract_files_detailed(documents):
+            list_docs.extend(result["documents"])
 
         return list_docs
+
+    def iter_extract_file(self, documents: list[UploadFile], batch_size: int = 1000,
+                          report: Optional[List[Dict[str, Any]]] = None) -> Iterator[List[Document]]:
+        """
+        Như extract_file nhưng yield từng batch theo thứ tự file.
+        File xlsx/csv lớn hơn EXTRACT_STREAM_MIN_BYTES được stream trong process hiện tại
+        (memory không phụ thuộc kích thước file), các file còn lại parse song song trong process pool.
+        report (nếu truyền vào) nhận thông tin từng file: filename, documents (số lượng), seconds, error.
+        """
+        stream_min_bytes = int(os.getenv("EXTRACT_STREAM_MIN_BYTES", str(32 * 1024 * 1024)))
+        streamed = [
+            doc.filename.endswith((".xlsx", ".csv")) and self.file_size(doc) > stream_min_bytes
+            for doc in documents
+        ]
+        pooled = [doc for doc, stream in zip(documents, streamed) if not stream]
+        futures = iter(self.submit_extraction(pooled))
+
+        for doc, stream in zip(documents, streamed):
+            if stream:
+                result = {"filename": doc.filename, "documents": 0, "seconds": 0.0, "error": None}
+                start_time = time.perf_counter()
+                iterator = self.iter_file_xlsx if doc.filename.endswith(".xlsx") else self.iter_file_csv
+                try:
+                    for batch in iterator(doc, batch_size=batch_size):
+                        result["documents"] += len(batch)
+                        yield batch
+                except Exception as e:
+                    result["error"] = str(e)
+                    print(f"❌ {doc.filename}: {e}")
+                result["seconds"] = time.perf_counter() - start_time
+            else:
+                result = self.collect_extraction(doc, next(futures))
+                docs = result["documents"]
+                result["documents"] = len(docs)
+                for start in range(0, len(docs), batch_size):
+                    yield docs[start:start + batch_size]
+
+            result["seconds"] = round(result["seconds"], 3)
+            if report is not None:
+                report.append(result)
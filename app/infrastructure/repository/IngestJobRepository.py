@@ -0,0 +1,173 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+from core.interface.IIngestJobRepository import IIngestJobRepository
+
+
+class IngestJobRepository(IIngestJobRepository):
+    """
+    Hàng đợi job ingest lưu trong SQLite (bền qua restart, dùng chung giữa các worker process):
+
+      jobs(job_id, user_id, namespace, status, files, ..., progress, result, error)
+
+    status: queued -> running -> done / partial (một số file embed lỗi) / failed. Job running không cập nhật tiến độ quá
+    stale_after giây (process chết giữa chừng) được đưa lại về queued, tối đa max_attempts lần
+    (sau đó fail_stale đánh dấu failed).
+    """
+
+    def __init__(self, path: str, stale_after: float = 900, max_attempts: int = 3):
+        self.path = path
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " user_id TEXT,"
+            " status TEXT NOT NULL,"
+            " files TEXT NOT NULL,"
+            " files_total INTEGER NOT NULL,"
+            " bytes_total INTEGER NOT NULL,"
+            " files_done INTEGER NOT NULL DEFAULT 0,"
+            " bytes_done INTEGER NOT NULL DEFAULT 0,"
+            " documents_done INTEGER NOT NULL DEFAULT 0,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " updated_at REAL,"
+            " finished_at REAL,"
+            " result TEXT,"
+            " error TEXT,"
+            " namespace TEXT)"
+        )
+        if "namespace" not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN namespace TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # Mỗi thread một connection, autocommit (transaction mở bằng BEGIN IMMEDIATE khi cần)
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    def enqueue(self, job_id: str, user_id: Optional[str], files: List[dict], namespace: Optional[str] = None) -> dict:
+        self._connection().execute(
+            "INSERT INTO jobs (job_id, user_id, namespace, status, files, files_total, bytes_total, created_at)"
+            " VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, user_id, namespace, json.dumps(files, ensure_ascii=False), len(files),
+             sum(file["size"] for file in files), time.time()),
+        )
+        return self.get(job_id)
+
+    def fail_stale(self) -> List[str]:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Job của process đã chết và đã quá số lần thử: caller dọn file spool của các job này
+            job_ids = [row["job_id"] for row in conn.execute(
+                "SELECT job_id FROM jobs WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                (now - self.stale_after, self.max_attempts),
+            )]
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = 'Quá số lần thử lại' WHERE job_id = ?",
+                [(now, job_id) for job_id in job_ids],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job_ids
+
+    def claim_next(self) -> Optional[dict]:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Job của process đã chết: thử lại (job quá số lần thử do fail_stale xử lý)
+            conn.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ? AND attempts < ?",
+                (now - self.stale_after, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, updated_at = ?,"
+                " files_done = 0, bytes_done = 0, documents_done = 0 WHERE job_id = ?",
+                (now, now, row["job_id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row["job_id"])
+
+    def update_progress(self, job_id: str, documents_done: int, files_done: int, bytes_done: int):
+        self._connection().execute(
+            "UPDATE jobs SET documents_done = ?, files_done = ?, bytes_done = ?, updated_at = ? WHERE job_id = ?",
+            (documents_done, files_done, bytes_done, time.time(), job_id),
+        )
+
+    def finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        now = time.time()
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, updated_at = ? WHERE job_id = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, now, now, job_id),
+        )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._connection().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return self._to_dict(row)
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        job = {
+            "job_id": row["job_id"],
+            "user_id": row["user_id"],
+            "namespace": row["namespace"],
+            "status": row["status"],
+            "files": json.loads(row["files"]),
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "error": row["error"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+        }
+
+        # Tiến độ: throughput theo documents, ETA ước lượng theo số bytes đã đọc (gồm cả file đang xử lý)
+        elapsed = 0.0
+        if row["started_at"]:
+            elapsed = (row["finished_at"] or time.time()) - row["started_at"]
+        progress = {
+            "files_total": row["files_total"],
+            "files_done": row["files_done"],
+            "bytes_total": row["bytes_total"],
+            "bytes_done": row["bytes_done"],
+            "documents_embedded": row["documents_done"],
+            "elapsed_s": round(elapsed, 1),
+            "documents_per_s": round(row["documents_done"] / elapsed, 2) if elapsed > 0 else 0.0,
+            "eta_s": None,
+        }
+        if row["status"] == "running" and row["bytes_done"] > 0:
+            remaining = row["bytes_total"] - row["bytes_done"]
+            progress["eta_s"] = round(elapsed * remaining / row["bytes_done"], 1)
+        elif row["status"] in ("done", "partial", "failed"):
+            progress["eta_s"] = 0.0
+        job["progress"] = progress
+        return job
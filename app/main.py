@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -6,8 +7,21 @@ from presentation.api.v1.EmbedRoute import router as embed_router
 from presentation.api.v1.ChatRoute import router as chat_router
 from presentation.api.v1.AuthRoute import router as auth_router
 from presentation.api.v1.ConversationRoute import router as conversation_router
+from presentation.api.v1.HealthRoute import router as health_router
+from container import container, WARMUP_ON_STARTUP
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Model + FAISS được load ở background sau khi server đã bind port (xem /health/ready)
+    if WARMUP_ON_STARTUP:
+        container.start_warmup()
+    # Worker xử lý job ingest (/embed) ở background, chạy tiếp các job còn dở từ lần trước
+    container.get_ingest_pool().start()
+    yield
+    await container.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 #Exception Handler toàn cục
 @app.exception_handler(HTTPException)
@@ -40,3 +54,4 @@ app.include_router(embed_router, prefix="/embed", tags=["embed"])
 app.include_router(chat_router, prefix="/chat", tags=["chat"])
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(conversation_router, prefix="/conversations", tags=["conversations"])
+app.include_router(health_router, prefix="/health", tags=["health"])
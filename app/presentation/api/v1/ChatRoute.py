@@ -5,31 +5,41 @@ from infrastructure.LLM.GeminiService import GeminiLLMService
 from infrastructure.LLM.ClaudeService import ClaudeLLMService
 from infrastructure.VectorDB.GeminiFaiss import GeminiFaiss
 from infrastructure.VectorDB.Qwen3Faiss import Qwen3Faiss
+from infrastructure.repository.ChatHistoryStore import ChatHistoryStore
+from infrastructure.LLM.SemanticResponseCache import SemanticResponseCache
+from container import get_chat_history_store, get_llm_service, get_response_cache, get_vector_service, namespace_for
 from presentation.schema.Chat import CreateChatRequest, CreateChatResponse
 from security import decode_jwt, require_csrf
 from core.entity.Chat import Message
 from datetime import datetime, timezone
 from typing import Optional, List
 from fastapi import UploadFile, Form, File
+from fastapi.responses import StreamingResponse
+import json
+import os
 
 router = APIRouter()
-llm_service = ClaudeLLMService()
-vector_service = Qwen3Faiss()
-chat_histories: dict[str, list[Message]] = {}
+# Giới hạn số ký tự context (file + vector DB) gửi cho LLM, 0 = không giới hạn
+MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "12000")) or None
 
 async def parse_chat_request(
     message: str = Form(...),
+    conversation_id: Optional[str] = Form(default=None),
     files: List[UploadFile] = File(default=[])
 ) -> CreateChatRequest:
     """
     Dependency để parse multipart/form-data thành CreateChatRequest
     """
-    return CreateChatRequest(message=message, files=files if files else [])
+    return CreateChatRequest(conversation_id=conversation_id or None, message=message, files=files if files else [])
 
 @router.post("/") 
 async def chat_endpoint(
     request: Request,
-    req: CreateChatRequest = Depends(parse_chat_request)
+    req: CreateChatRequest = Depends(parse_chat_request),
+    llm_service: ClaudeLLMService = Depends(get_llm_service),
+    vector_service: Qwen3Faiss = Depends(get_vector_service),
+    history_store: ChatHistoryStore = Depends(get_chat_history_store),
+    response_cache: Optional[SemanticResponseCache] = Depends(get_response_cache)
 ):
     require_csrf(request)
     payload = decode_jwt(request)
@@ -39,21 +49,85 @@ async def chat_endpoint(
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid or missing token")
     
-    history = chat_histories.get(user_id, [])
+    conversation_id, history = await history_store.load(user_id, req.conversation_id, req.message)
     
     file_repo = FileRepository()
-    use_case = ChatWithGemini(llm_service, vector_service, file_repo)
+    use_case = ChatWithGemini(llm_service, vector_service, file_repo, MAX_CONTEXT_CHARS,
+                              namespace=namespace_for(user_id), response_cache=response_cache)
 
-    answer = use_case.execute(req.message, history, req.files)
+    question_time = datetime.now(timezone.utc)
+    answer = await use_case.execute_async(req.message, history, req.files)
 
-    history.append(Message(role="user", content=req.message, timestamp=datetime.now(timezone.utc)))
-    history.append(Message(role="assistant", content=answer, timestamp=datetime.now(timezone.utc)))
-
-    chat_histories[user_id] = history
+    await history_store.append(user_id, conversation_id, [
+        Message(role="user", content=req.message, timestamp=question_time),
+        Message(role="assistant", content=answer, timestamp=datetime.now(timezone.utc)),
+    ])
     
     return CreateChatResponse(
         code=200,
         isSuccess=True,
         message="Success",
-        data=answer
-    )
\ No newline at end of file
+        data=answer,
+        conversation_id=conversation_id
+    )
+
+def format_sse(data: dict, event: Optional[str] = None) -> str:
+    """Đóng gói một event theo định dạng Server-Sent Events"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+@router.post("/stream")
+async def chat_stream_endpoint(
+    request: Request,
+    req: CreateChatRequest = Depends(parse_chat_request),
+    llm_service: ClaudeLLMService = Depends(get_llm_service),
+    vector_service: Qwen3Faiss = Depends(get_vector_service),
+    history_store: ChatHistoryStore = Depends(get_chat_history_store),
+    response_cache: Optional[SemanticResponseCache] = Depends(get_response_cache)
+):
+    require_csrf(request)
+    payload = decode_jwt(request)
+    user_id = payload.get("sub")
+
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid or missing token")
+
+    conversation_id, history = await history_store.load(user_id, req.conversation_id, req.message)
+
+    file_repo = FileRepository()
+    use_case = ChatWithGemini(llm_service, vector_service, file_repo, MAX_CONTEXT_CHARS,
+                              namespace=namespace_for(user_id), response_cache=response_cache)
+
+    # Chuẩn bị context trước khi stream (file upload sẽ bị đóng sau khi endpoint return)
+    combined_context = await use_case.prepare_context_async(req.message, req.files)
+    question_time = datetime.now(timezone.utc)
+
+    async def event_stream():
+        chunks = []
+        try:
+            async for token in use_case.stream_async(req.message, history, combined_context):
+                chunks.append(token)
+                yield format_sse({"token": token})
+        except Exception as e:
+            print(f"❌ Lỗi khi stream câu trả lời: {e}")
+            yield format_sse({"message": str(e)}, event="error")
+            return
+
+        answer = "".join(chunks)
+        await history_store.append(user_id, conversation_id, [
+            Message(role="user", content=req.message, timestamp=question_time),
+            Message(role="assistant", content=answer, timestamp=datetime.now(timezone.utc)),
+        ])
+
+        yield format_sse({"reply": answer, "conversation_id": conversation_id}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
+    )
@@ -1,7 +1,7 @@
 import base64
-from fastapi import APIRouter, UploadFile, File, Request
+import os
+from fastapi import APIRouter, Depends, UploadFile, File, Request
 import io
-from core.use_case.EmbedFile import EmbedFilesUseCase
 #from infrastructure.repository.EmbeddingRepository import GoogleEmbeddingService
 from infrastructure.VectorDB.GeminiFaiss import GeminiFaiss
 from infrastructure.VectorDB.Qwen3Faiss import Qwen3Faiss
@@ -11,24 +11,63 @@ from security import (
     require_csrf,
     decode_jwt,
 )
-from infrastructure.repository.FileRepository import FileRepository
-from presentation.api.v1.ChatRoute import vector_service as embedder
+from infrastructure.jobs.IngestWorkerPool import IngestWorkerPool
+from container import get_ingest_pool, get_vector_service, namespace_for
+from utils.executor import run_blocking
 
 
 router = APIRouter()
 
-@router.post("/")
+@router.post("/", status_code=202)
 async def embed_files(
     request: Request,
-    files: list[UploadFile] = File(...)
+    files: list[UploadFile] = File(...),
+    ingest_pool: IngestWorkerPool = Depends(get_ingest_pool)
 ):
     require_csrf(request)
-    user_id = decode_jwt(request)
-    
-    file_repo = FileRepository()
-    use_case = EmbedFilesUseCase(file_repo, embedder)
-    isSuccess = use_case.execute(files)
-    if isSuccess:
-        return EmbedderResponse.from_entity(ApiResponse.success(isSuccess))
-    return EmbedderResponse.from_entity(ApiResponse.error("Embedding failed"))
+    user_id = decode_jwt(request).get("sub")
 
+    # Chỉ lưu file + tạo job, embedding chạy ở background (xem GET /embed/jobs/{job_id})
+    job = await run_blocking(ingest_pool.spool, files, user_id, namespace_for(user_id))
+    ingest_pool.notify()
+    return EmbedderResponse.from_entity(ApiResponse.success(
+        {"job_id": job["job_id"], "status": job["status"], "progress": job["progress"]},
+        message="Accepted", code=202,
+    ))
+
+
+@router.get("/jobs/{job_id}")
+async def embed_job_status(job_id: str, request: Request, ingest_pool: IngestWorkerPool = Depends(get_ingest_pool)):
+    user_id = decode_jwt(request).get("sub")
+    job = await run_blocking(ingest_pool.jobs.get, job_id)
+    if job is None or job["user_id"] != user_id:
+        return EmbedderResponse.from_entity(ApiResponse.error(f"Không tìm thấy job {job_id}", code=404))
+    job.pop("files", None)  # Đường dẫn spool nội bộ
+    return EmbedderResponse.from_entity(ApiResponse.success(job))
+
+
+@router.get("/stats")
+async def embed_stats(request: Request, embedder: Qwen3Faiss = Depends(get_vector_service)):
+    decode_jwt(request)
+    return ApiResponse.success(await run_blocking(embedder.get_vectorstore_info))
+
+
+@router.get("/sources")
+async def list_sources(request: Request, embedder: Qwen3Faiss = Depends(get_vector_service)):
+    user_id = decode_jwt(request).get("sub")
+    sources = await run_blocking(embedder.list_sources, namespace_for(user_id))
+    return EmbedderResponse.from_entity(ApiResponse.success(sources))
+
+
+@router.delete("/sources/{source:path}")
+async def delete_source(source: str, request: Request, embedder: Qwen3Faiss = Depends(get_vector_service)):
+    require_csrf(request)
+    user_id = decode_jwt(request).get("sub")
+    if embedder.read_only:
+        return EmbedderResponse.from_entity(
+            ApiResponse.error("Worker này không giữ quyền ghi vector store, vui lòng thử lại", code=503)
+        )
+    removed = await run_blocking(embedder.delete_source, source, namespace_for(user_id))
+    if not removed:
+        return EmbedderResponse.from_entity(ApiResponse.error(f"Không tìm thấy source {source}", code=404))
+    return EmbedderResponse.from_entity(ApiResponse.success({"source": source, "removed_chunks": removed}))
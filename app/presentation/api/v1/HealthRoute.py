@@ -0,0 +1,24 @@
+from fastapi import APIRouter
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from core.entity.Response import ApiResponse
+from container import container
+
+
+router = APIRouter()
+
+@router.get("/live")
+async def liveness():
+    """Process đã bind port và event loop đang chạy"""
+    return ApiResponse.success({"status": "alive"})
+
+@router.get("/ready")
+async def readiness():
+    """Sẵn sàng nhận request khi model + vector store đã load xong (503 nếu chưa)"""
+    info = container.info()
+    if container.ready:
+        return ApiResponse.success(info)
+    return JSONResponse(
+        status_code=503,
+        content=jsonable_encoder(ApiResponse.error("Vector store chưa sẵn sàng", code=503, data=info))
+    )
@@ -6,7 +6,7 @@ from fastapi import UploadFile
 
 #Chat
 class CreateChatRequest(BaseModel):
-    conversation_id: str
+    conversation_id: Optional[str] = None
     message: str
     files: Optional[List[UploadFile]] = None
     
@@ -18,6 +18,7 @@ class CreateChatResponse(BaseModel):
     isSuccess: bool
     message: str
     data: Optional[Any] = None
+    conversation_id: Optional[str] = None
 
     @classmethod
     def from_entity(cls, response: ApiResponse):
@@ -14,7 +14,7 @@ class EmbedderResponse(BaseModel):
             code=response.code,
             isSuccess=response.isSuccess,
             message=response.message,
-            data=None
+            data=response.data
         )
 
 
@@ -0,0 +1,112 @@
+"""
+Rebuild / migrate FAISS index sang loại index khác mà không cần embed lại.
+
+Chạy offline (dừng app trước) từ thư mục app/:
+    python rebuild_index.py --type hnsw
+    python rebuild_index.py --type ivf_pq --nlist 4096 --pq-m 64
+    python rebuild_index.py --type flat --metric cosine   # index L2 cũ -> cosine
+
+Vector được reconstruct từ index hiện tại (kể cả các batch còn trong WAL, trừ chunk đã xóa),
+build + train index mới theo cấu hình, rồi publish thành generation mới.
+Nhớ đặt FAISS_INDEX_TYPE / FAISS_METRIC giống --type / --metric để app không tự chuyển ngược lại khi compact.
+"""
+import argparse
+import os
+import time
+import numpy as np
+from dotenv import load_dotenv
+from infrastructure.VectorDB.ChunkStore import CHUNK_STORE_FILE, ChunkStore
+from infrastructure.VectorDB.IndexFactory import (
+    INDEX_TYPES, METRICS, IndexConfig, index_kind, metric_name, migrate_index, reconstruct_vectors
+)
+from infrastructure.VectorDB.IndexPersistence import FaissPersistence
+
+load_dotenv()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rebuild/migrate FAISS index không cần embed lại")
+    parser.add_argument("--type", choices=INDEX_TYPES, required=True, help="Loại index đích")
+    parser.add_argument("--metric", choices=tuple(METRICS), default=None,
+                        help="Metric đích (mặc định giữ metric của index hiện tại)")
+    parser.add_argument("--persist-path", default=os.getenv("PERSIST_PATH"))
+    parser.add_argument("--nlist", type=int, default=None, help="IVF: số cluster (mặc định ~4*sqrt(N))")
+    parser.add_argument("--hnsw-m", type=int, default=None)
+    parser.add_argument("--ef-construction", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=None)
+    parser.add_argument("--pq-nbits", type=int, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = IndexConfig.from_env()
+    config.index_type = args.type
+    config.min_train_vectors = 1  # Offline: luôn build đúng loại được yêu cầu
+    for field, value in (("nlist", args.nlist), ("hnsw_m", args.hnsw_m),
+                         ("ef_construction", args.ef_construction),
+                         ("pq_m", args.pq_m), ("pq_nbits", args.pq_nbits)):
+        if value is not None:
+            setattr(config, field, value)
+
+    persistence = FaissPersistence(args.persist_path)
+    if not persistence.try_acquire_owner():
+        raise SystemExit("❌ Một process server đang giữ quyền ghi vector store (owner.lock), hãy dừng server trước")
+    chunk_store = ChunkStore(os.path.join(args.persist_path, CHUNK_STORE_FILE))
+
+    start_time = time.time()
+    index, meta = persistence.load_index()
+    if index is None:
+        raise SystemExit(f"❌ Không tìm thấy index tại {args.persist_path}")
+    print(f"📂 Đã đọc {persistence.current_generation_dir()}: {index.ntotal} vectors "
+          f"({index_kind(index)}, {metric_name(index.metric_type)})")
+
+    legacy = meta.pop("legacy_docstore", None)
+    if legacy is not None and chunk_store.max_faiss_id() < 0:
+        imported = chunk_store.import_docstore(*legacy)
+        print(f"📦 Đã chuyển {imported} documents từ index.pkl sang chunk store")
+
+    next_id = meta["next_faiss_id"]
+    ids = np.array(chunk_store.faiss_ids(below=next_id), dtype=np.int64)
+    vectors = reconstruct_vectors(index, ids)
+
+    # Gộp các batch còn trong WAL (vector đã có sẵn, không cần model)
+    extra_ids, extra_vectors = [], []
+
+    def apply_wal(faiss_ids, wal_vectors):
+        nonlocal next_id
+        extra_ids.append(faiss_ids)
+        extra_vectors.append(wal_vectors)
+        next_id = max(next_id, int(faiss_ids.max()) + 1)
+
+    def apply_legacy_wal(doc_ids, texts, wal_vectors, metadatas):
+        existing = chunk_store.existing_doc_ids(doc_ids)
+        keep = [i for i, doc_id in enumerate(doc_ids) if doc_id not in existing]
+        if not keep:
+            return
+        faiss_ids = np.arange(next_id, next_id + len(keep), dtype=np.int64)
+        chunk_store.add_chunks(faiss_ids.tolist(), [doc_ids[i] for i in keep],
+                               [texts[i] for i in keep], [metadatas[i] for i in keep])
+        apply_wal(faiss_ids, wal_vectors[keep])
+
+    def apply_wal_deletion(deleted_ids):
+        for i, (faiss_ids, wal_vectors) in enumerate(zip(extra_ids, extra_vectors)):
+            keep = ~np.isin(faiss_ids, deleted_ids)
+            extra_ids[i], extra_vectors[i] = faiss_ids[keep], wal_vectors[keep]
+
+    persistence.replay(apply_wal, next_id, legacy_fn=apply_legacy_wal, delete_fn=apply_wal_deletion)
+    if extra_ids:
+        ids = np.concatenate([ids] + extra_ids)
+        vectors = np.vstack([vectors] + extra_vectors)
+
+    metric = METRICS[args.metric] if args.metric else index.metric_type
+    new_index = migrate_index(index, ids, config, metric=metric, vectors=vectors)
+
+    generation = persistence.publish(new_index, next_id)
+    chunk_store.delete_from(next_id)
+    print(f"✅ Đã rebuild {new_index.ntotal} vectors sang {index_kind(new_index)} ({metric_name(metric)}) "
+          f"-> {generation} trong {time.time() - start_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+_executor: ThreadPoolExecutor | None = None
+_process_pool: ProcessPoolExecutor | None = None
+_process_pool_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Thread pool có giới hạn cho các tác vụ blocking/CPU-bound (embedding, parse file, FAISS search)"""
+    global _executor
+    if _executor is None:
+        max_workers = int(os.getenv("BLOCKING_WORKERS", min(8, (os.cpu_count() or 1) + 2)))
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="blocking")
+    return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Chạy hàm blocking trong executor để không chặn event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
+
+
+def get_process_pool() -> ProcessPoolExecutor | None:
+    """
+    Process pool cho tác vụ CPU-bound thuần Python (parse file) để dùng nhiều core.
+    Dùng context "spawn" để process con không fork theo model/thread của process chính.
+    EXTRACT_WORKERS <= 1 thì trả về None (chạy tuần tự trong process hiện tại).
+    """
+    global _process_pool
+    max_workers = int(os.getenv("EXTRACT_WORKERS", min(4, os.cpu_count() or 1)))
+    if max_workers <= 1:
+        return None
+    # Nhiều request/ingest worker có thể gọi cùng lúc: chỉ tạo một pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def reset_process_pool(pool: ProcessPoolExecutor):
+    """
+    Bỏ pool bị hỏng (BrokenProcessPool: process con bị kill/crash, vd. OOM) để lần gọi
+    get_process_pool() sau tạo pool mới. Không đụng tới pool mới nếu thread khác đã reset trước.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_process_pool(wait: bool = True):
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait)
+
+
+def shutdown_executor(wait: bool = True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
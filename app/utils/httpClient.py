@@ -0,0 +1,163 @@
+import asyncio
+import importlib.util
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Các status nên thử lại (rate limit, quá tải, lỗi gateway)
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+# Chỉ thử lại lỗi xảy ra trước khi server nhận request (hoặc connection keep-alive đã bị đóng),
+# không thử lại ReadTimeout để tránh gọi LLM hai lần cho cùng một request
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+class HttpClientConfig:
+    """Cấu hình connection pool dùng chung cho các provider LLM/embedding (đọc từ env)"""
+
+    def __init__(self):
+        self.max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+        self.max_keepalive = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        self.keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+        self.connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+        self.write_timeout = float(os.getenv("HTTP_WRITE_TIMEOUT", "30"))
+        self.pool_timeout = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+        # HTTP/2 cần package h2 (httpx[http2]), không có thì dùng HTTP/1.1 keep-alive
+        self.http2 = (os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+                      and importlib.util.find_spec("h2") is not None)
+        self.retries = int(os.getenv("HTTP_RETRIES", "2"))
+        self.backoff = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+        self.backoff_max = float(os.getenv("HTTP_RETRY_BACKOFF_MAX", "8"))
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    def retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """Exponential backoff + full jitter, ưu tiên Retry-After của server nếu có"""
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return min(self.backoff_max, max(0.0, float(retry_after)))
+                except ValueError:
+                    try:
+                        return min(self.backoff_max, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+                    except (TypeError, ValueError):
+                        pass
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+
+config = HttpClientConfig()
+
+
+class RetryTransport(httpx.BaseTransport):
+    """Thử lại request khi gặp RETRY_ERRORS hoặc status trong RETRY_STATUS (backoff + jitter)"""
+
+    def __init__(self, transport: httpx.BaseTransport, settings: HttpClientConfig):
+        self.transport = transport
+        self.settings = settings
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(self.settings.retries + 1):
+            last = attempt == self.settings.retries
+            try:
+                response = self.transport.handle_request(request)
+            except RETRY_ERRORS:
+                if last:
+                    raise
+                time.sleep(self.settings.retry_delay(attempt))
+                continue
+            if response.status_code not in RETRY_STATUS or last:
+                return response
+            response.close()
+            time.sleep(self.settings.retry_delay(attempt, response))
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    """Phiên bản async của RetryTransport"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, settings: HttpClientConfig):
+        self.transport = transport
+        self.settings = settings
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(self.settings.retries + 1):
+            last = attempt == self.settings.retries
+            try:
+                response = await self.transport.handle_async_request(request)
+            except RETRY_ERRORS:
+                if last:
+                    raise
+                await asyncio.sleep(self.settings.retry_delay(attempt))
+                continue
+            if response.status_code not in RETRY_STATUS or last:
+                return response
+            await response.aclose()
+            await asyncio.sleep(self.settings.retry_delay(attempt, response))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def get_http_client() -> httpx.Client:
+    """httpx.Client dùng chung cả process (connection pool + keep-alive + retry)"""
+    global _client
+    if _client is None or _client.is_closed:
+        transport = httpx.HTTPTransport(limits=config.limits, http2=config.http2)
+        _client = httpx.Client(transport=RetryTransport(transport, config), timeout=config.timeout)
+    return _client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """httpx.AsyncClient dùng chung cả process, tạo lazily trong event loop của app"""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        transport = httpx.AsyncHTTPTransport(limits=config.limits, http2=config.http2)
+        _async_client = httpx.AsyncClient(transport=AsyncRetryTransport(transport, config), timeout=config.timeout)
+    return _async_client
+
+
+async def close_http_clients():
+    global _client, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def http_client_info() -> dict:
+    return {
+        "http2": config.http2,
+        "max_connections": config.max_connections,
+        "max_keepalive_connections": config.max_keepalive,
+        "keepalive_expiry_s": config.keepalive_expiry,
+        "retries": config.retries,
+    }
@@ -0,0 +1,69 @@
+import threading
+import time
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket có tốc độ tự điều chỉnh (AIMD):
+    - Mỗi request lấy `cost` token từ bucket, chờ nếu chưa đủ
+    - Gặp 429 / quota exhausted: giảm rate một nửa, xả bucket và tạm dừng
+    - Request thành công: tăng rate dần lên tới max_rate
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None,
+                 min_rate: float = 0.05, max_rate: float | None = None,
+                 increase_step: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.increase_step = increase_step or rate * 0.1
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.rate_limited_count = 0
+        self.total_wait = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, cost: float = 1.0) -> float:
+        """Chờ đến khi đủ token, trả về số giây đã chờ"""
+        cost = min(cost, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= cost:
+                        self.tokens -= cost
+                        self.total_wait += waited
+                        return waited
+                    wait = (cost - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_rate_limited(self, retry_after: float | None = None):
+        with self.lock:
+            self.rate_limited_count += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            backoff = retry_after if retry_after else self.capacity / self.rate
+            self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "rate": round(self.rate, 3),
+                "tokens": round(self.tokens, 3),
+                "rate_limited_count": self.rate_limited_count,
+                "total_wait": round(self.total_wait, 2),
+            }